@@ -1,16 +1,15 @@
 """Load and unload grammars and handle language setting."""
+import gc
 import gettext
 import os.path
+import sys
+import types
+from importlib import import_module
 from pkg_resources import resource_filename, Requirement
-import natlinkstatus
-from dragonfly_grammars.common import set_translator
-from dragonfly_grammars import (
-    aenea_,
-    i3,
-    global_,
-    cli,
-    password,
-    vim)
+from dragonfly_grammars import budget, cache
+from dragonfly_grammars.common import MemoTranslator, set_translator
+from dragonfly_grammars.context import (
+    SNAPSHOT, linux, terminal_not_vim, vim_normal_mode)
 
 _LOCALEDIR = os.path.join(resource_filename(
     Requirement.parse('dragonfly_grammars'),
@@ -19,30 +18,364 @@ ENX = gettext.translation(
     'dragonfly_grammars', _LOCALEDIR, languages=['en'])
 NLD = gettext.translation(
     'dragonfly_grammars', _LOCALEDIR, languages=['nl'])
-set_translator(ENX.lgettext)
+CATALOGS = {'enx': ENX, 'nld': NLD}
+TRANSLATORS = dict(
+    (lang, MemoTranslator(catalog)) for lang, catalog in CATALOGS.iteritems())
+set_translator(TRANSLATORS['enx'])
 
-def load_grammars():
-    """Set language, reload grammar modules and register grammars."""
+GRAMMAR_MODULES = ('aenea_', 'i3', 'global_', 'cli', 'password', 'vim')
+# grammar modules that only apply in a context, these can be
+# loaded the first time their context matches
+LAZY_CONTEXTS = {
+    'cli': terminal_not_vim,
+    'i3': linux,
+    'vim': vim_normal_mode}
+LAZY_GRAMMARS = []
+# grammar module loaded first in staged mode
+FIRST_GRAMMAR_MODULE = 'global_'
+STAGED_LOADER = None
+# grammar modules kept built per language for switching, the others
+# hold shared lists and are rebuilt on a language switch
+RESIDENT_MODULES = ('i3', 'global_', 'cli', 'vim')
+# resident grammars per language
+GRAMMAR_SETS = {}
+ACTIVE_LANGUAGE = None
+
+def grammar_modules():
+    """
+    Import and return grammar modules.
+
+    Grammar modules are imported on use, because building their
+    rules needs a speech engine (see headless).
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[module]
+    """
+    return [
+        import_module('dragonfly_grammars.{}'.format(name))
+        for name in GRAMMAR_MODULES]
+
+def loaded_grammars():
+    """
+    Return grammars registered by load_grammars.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[dragonfly.Grammar]
+    """
+    grammars = list(LAZY_GRAMMARS)
+    for lang in sorted(GRAMMAR_SETS):
+        grammars.extend(GRAMMAR_SETS[lang])
+    for name in GRAMMAR_MODULES:
+        module = sys.modules.get('dragonfly_grammars.{}'.format(name))
+        if module is not None:
+            grammars.extend(
+                value for key, value in sorted(vars(module).items())
+                if key.endswith('GRAMMAR') and value is not None)
+    return grammars
+
+class Options(object):
+
+    """
+    Options of load_grammars.
+
+    Parameters
+    ----------
+    lazy: bool
+        register a stand-in for the grammar modules in LAZY_CONTEXTS,
+        which builds them on a background thread when their context
+        first matches and then loads them (see lazy)
+    staged: bool
+        load FIRST_GRAMMAR_MODULE right away and build the other
+        grammar modules on a background thread
+    use_cache: bool
+        build grammars through the on-disk grammar cache (see cache)
+    keep_languages: bool
+        keep the grammars of every language loaded and switch
+        between them (see switch_language), lazy and staged
+        are ignored
+    compiled_contexts: bool
+        evaluate the contexts of all registered grammars with one
+        compiled matcher (see context_compiler), grammars that are
+        registered later keep their own context
+    focus_port: int
+        subscribe to focus events on this port of the aenea server,
+        so contexts need no request to the server (see focus)
+    password_key_ttl: float
+        seconds to keep keys of unlocked passwords, so unlocking
+        them again is fast (see decryption)
+    pooled_connections: bool
+        keep connections to the aenea server open and reuse them
+        (see connection)
+    record_latency: bool
+        record phase durations of every rule, unload_grammars() and
+        saying "dump latency" write them to latency.default_path()
+        (see latency)
+    record_recognitions: bool
+        append recognitions to replay.default_path(), for
+        grammarreplay (see replay)
+    stream_text: bool
+        type long text in chunks from a background thread, so it
+        starts right away and "stop typing" can cancel it, installs
+        the connection pool (see stream)
+    grammar_budget: Union[int, Dict[str, int]]
+        compiled bytes per grammar, or by grammar module name,
+        repetition bounds are lowered to fit (see budget)
+    """
+
+    def __init__(
+            self,
+            lazy=False,
+            staged=False,
+            use_cache=False,
+            keep_languages=False,
+            compiled_contexts=False,
+            focus_port=None,
+            password_key_ttl=None,
+            pooled_connections=False,
+            record_latency=False,
+            record_recognitions=False,
+            stream_text=False,
+            grammar_budget=None):
+        self.lazy = lazy
+        self.staged = staged
+        self.use_cache = use_cache
+        self.keep_languages = keep_languages
+        self.compiled_contexts = compiled_contexts
+        self.focus_port = focus_port
+        self.password_key_ttl = password_key_ttl
+        self.pooled_connections = pooled_connections
+        self.record_latency = record_latency
+        self.record_recognitions = record_recognitions
+        self.stream_text = stream_text
+        self.grammar_budget = grammar_budget
+
+# modules started after the grammars are loaded, in this order, and
+# stopped in reverse order before they are unloaded; each has
+# start_feature(options, language, grammars) and stop_feature(grammars)
+FEATURE_MODULES = (
+    'context_compiler',
+    'focus',
+    'decryption',
+    'connection',
+    'latency',
+    'replay',
+    'stream')
+
+def load_grammars(options=None, **kwargs):
+    """
+    Set language, reload grammar modules and register grammars.
+
+    Parameters
+    ----------
+    options: Options
+        what to load, built from kwargs if not given
+    kwargs: Dict[str, Any]
+        arguments of Options, e.g. lazy=True
+
+    Raises
+    ------
+    TypeError
+        if kwargs has an unknown option, or options is given too
+
+    Returns
+    -------
+    None
+    """
+    if options is None:
+        options = Options(**kwargs)
+    elif len(kwargs) > 0:
+        raise TypeError('give either options or keyword arguments')
+    # natlinkstatus is imported here, so the grammars can be
+    # built without natlink (see headless)
+    import natlinkstatus
     lang = natlinkstatus.NatlinkStatus().getLanguage()
-    if lang == 'enx':
-        set_translator(ENX.lgettext)
-    elif lang == 'nld':
-        set_translator(NLD.lgettext)
+    # fallback to english
+    if lang not in TRANSLATORS:
+        lang = 'enx'
+    set_translator(TRANSLATORS[lang])
+    budget.set_budget(options.grammar_budget)
+    # before any grammar, see WindowSnapshot.observe
+    SNAPSHOT.observe()
+    if options.use_cache:
+        cache.ACTIVE_CACHE = cache.GrammarCache(lang)
+    else:
+        cache.ACTIVE_CACHE = None
+    if options.keep_languages:
+        switch_language(lang)
     else:
-        # fallback
-        set_translator(ENX.lgettext)
-    aenea_.load()
-    i3.load()
-    global_.load()
-    cli.load()
-    password.load()
-    vim.load()
-
-def unload_grammars():
-    """Unregister grammars and reload grammar modules."""
-    aenea_.unload()
-    i3.unload()
-    global_.unload()
-    cli.unload()
-    password.unload()
-    vim.unload()
+        _load_grammar_modules(options.lazy, options.staged)
+    for name in FEATURE_MODULES:
+        module = import_module('dragonfly_grammars.{}'.format(name))
+        module.start_feature(options, lang, loaded_grammars())
+
+def _load_grammar_modules(lazy, staged):
+    global STAGED_LOADER
+    from dragonfly_grammars.lazy import LazyGrammar
+    from dragonfly_grammars.staged import StagedLoader
+    background = []
+    for name in GRAMMAR_MODULES:
+        if lazy and name in LAZY_CONTEXTS:
+            grammar = LazyGrammar(name, LAZY_CONTEXTS[name]())
+            grammar.load()
+            LAZY_GRAMMARS.append(grammar)
+        elif staged and name != FIRST_GRAMMAR_MODULE:
+            background.append(name)
+        else:
+            module = import_module('dragonfly_grammars.{}'.format(name))
+            module.load(cache.build(module))
+    if len(background) > 0:
+        STAGED_LOADER = StagedLoader(background)
+        STAGED_LOADER.start()
+
+def switch_language(lang):
+    """
+    Activate the grammars of lang and deactivate the others.
+
+    Resident grammars are built and loaded the first time a language
+    is activated and only disabled when it is switched away from.
+
+    Parameters
+    ----------
+    lang: str
+        profile language, e.g. nld
+
+    Raises
+    ------
+    KeyError
+        if there is no translator for lang
+
+    Returns
+    -------
+    None
+    """
+    global ACTIVE_LANGUAGE
+    set_translator(TRANSLATORS[lang])
+    if cache.ACTIVE_CACHE is not None and cache.ACTIVE_CACHE.language != lang:
+        cache.ACTIVE_CACHE = cache.GrammarCache(lang)
+    if ACTIVE_LANGUAGE is not None:
+        for grammar in GRAMMAR_SETS[ACTIVE_LANGUAGE]:
+            grammar.disable()
+    for name in GRAMMAR_MODULES:
+        if name not in RESIDENT_MODULES:
+            module = import_module('dragonfly_grammars.{}'.format(name))
+            module.unload()
+            module.load(cache.build(module))
+    if lang in GRAMMAR_SETS:
+        for grammar in GRAMMAR_SETS[lang]:
+            grammar.enable()
+    else:
+        grammars = []
+        for name in RESIDENT_MODULES:
+            module = import_module('dragonfly_grammars.{}'.format(name))
+            grammar = cache.build(module)
+            grammar.load()
+            grammars.append(grammar)
+        GRAMMAR_SETS[lang] = grammars
+        print 'grammars for {}: Loaded.'.format(lang)
+    ACTIVE_LANGUAGE = lang
+
+def _reachable(roots, stop):
+    """Return ids and sizes of objects reachable from roots."""
+    sizes = {}
+    pending = list(roots)
+    while len(pending) > 0:
+        obj = pending.pop()
+        if id(obj) in sizes or id(obj) in stop or isinstance(
+                obj, (type, types.ModuleType, types.FunctionType)):
+            continue
+        sizes[id(obj)] = sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return sizes
+
+def grammar_set_sizes():
+    """
+    Return memory held by the grammars of each language.
+
+    Objects reachable from the grammars of more than one language,
+    like the engine, classes and interned strings, are not counted.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Dict[str, int]
+        bytes per language
+    """
+    engines = set(
+        id(grammar.engine)
+        for grammars in GRAMMAR_SETS.itervalues()
+        for grammar in grammars)
+    reachable = dict(
+        (lang, _reachable(grammars, engines))
+        for lang, grammars in GRAMMAR_SETS.iteritems())
+    sizes = {}
+    for lang, objects in reachable.iteritems():
+        shared = set()
+        for other, other_objects in reachable.iteritems():
+            if other != lang:
+                shared.update(other_objects)
+        sizes[lang] = sum(
+            size for key, size in objects.iteritems() if key not in shared)
+    return sizes
+
+def unload_grammars(keep_languages=False):
+    """
+    Unregister grammars and reload grammar modules.
+
+    Parameters
+    ----------
+    keep_languages: bool
+        only disable the grammars loaded by switch_language, so
+        load_grammars(keep_languages=True) can reactivate them
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    global STAGED_LOADER, ACTIVE_LANGUAGE
+    # features that were never started are not imported
+    for name in reversed(FEATURE_MODULES):
+        module = sys.modules.get('dragonfly_grammars.{}'.format(name))
+        if module is not None:
+            module.stop_feature(loaded_grammars())
+    SNAPSHOT.observe(False)
+    if ACTIVE_LANGUAGE is not None:
+        for grammar in GRAMMAR_SETS[ACTIVE_LANGUAGE]:
+            grammar.disable()
+        ACTIVE_LANGUAGE = None
+    if not keep_languages:
+        for grammars in GRAMMAR_SETS.itervalues():
+            for grammar in grammars:
+                grammar.unload()
+        GRAMMAR_SETS.clear()
+    if STAGED_LOADER is not None:
+        STAGED_LOADER.stop()
+        STAGED_LOADER = None
+    for grammar in LAZY_GRAMMARS:
+        grammar.unload()
+    del LAZY_GRAMMARS[:]
+    # lazy grammar modules that never loaded are not imported
+    for name in GRAMMAR_MODULES:
+        module = sys.modules.get('dragonfly_grammars.{}'.format(name))
+        if module is not None:
+            module.unload()
+    # after the modules, unloading aenea_ unwatches its config
+    watch = sys.modules.get('dragonfly_grammars.watch')
+    if watch is not None:
+        watch.stop()
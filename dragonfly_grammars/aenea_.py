@@ -33,7 +33,10 @@ except ImportError:
     print 'Unable to import Aenea client-side modules.'
     raise
 
+from dragonfly_grammars import connection, focus, watch
 from dragonfly_grammars.common import _
+from dragonfly_grammars.context import SNAPSHOT
+from dragonfly_grammars.latency import timed
 
 class DisableRule(dragonfly.CompoundRule):
 
@@ -43,6 +46,7 @@ class DisableRule(dragonfly.CompoundRule):
         self.spec = _('disable proxy server')
         dragonfly.CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('recognition')
     def _process_recognition(self, _node, _extras):
         aenea.config.disable_proxy()
 
@@ -55,6 +59,7 @@ class EnableRule(dragonfly.CompoundRule):
         self.spec = _('enable proxy server')
         dragonfly.CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('recognition')
     def _process_recognition(self, _node, _extras):
         aenea.config.enable_proxy()
 
@@ -71,30 +76,53 @@ class ChangeServer(dragonfly.CompoundRule):
         self.extras = [dragonfly.DictListRef('proxy', SERVER_LIST)]
         dragonfly.CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('recognition')
     def _process_recognition(self, _node, extras):
         aenea.communications.set_server_address((
             extras['proxy']['host'],
             extras['proxy']['port']))
+        SNAPSHOT.invalidate()
+        # aenea made a new transport, pool and prewarm instead
+        connection.change_address((
+            extras['proxy']['host'],
+            extras['proxy']['port']))
+        focus.change_host(extras['proxy']['host'])
 
+    @timed('begin')
     def _process_begin(self):
-        if SERVER_LIST_WATCHER.refresh():
-            SERVER_LIST.clear()
-            for k, value in SERVER_LIST_WATCHER.conf.get(
-                    'servers', {}).iteritems():
-                SERVER_LIST[str(k)] = value
+        # config changes are detected by the watch service
+        watch.service().dispatch()
+
+def update_server_list(conf):
+    """Apply changed servers in aenea config to SERVER_LIST."""
+    servers = dict(
+        (str(key), value)
+        for key, value in conf.get('servers', {}).iteritems())
+    for key in [key for key in SERVER_LIST if key not in servers]:
+        del SERVER_LIST[key]
+    for key, value in servers.iteritems():
+        if SERVER_LIST.get(key) != value:
+            SERVER_LIST[key] = value
 
 GRAMMAR = None
 
-def load():
-    """Register grammar."""
-    global GRAMMAR
-    GRAMMAR = dragonfly.Grammar('aenea')
+def build():
+    """Build grammar."""
+    grammar = dragonfly.Grammar('aenea')
 
-    GRAMMAR.add_rule(EnableRule())
-    GRAMMAR.add_rule(DisableRule())
-    GRAMMAR.add_rule(ChangeServer())
+    grammar.add_rule(EnableRule())
+    grammar.add_rule(DisableRule())
+    grammar.add_rule(ChangeServer())
+    return grammar
 
+def load(grammar=None):
+    """Register grammar, built with build() if not given."""
+    global GRAMMAR
+    if grammar is None:
+        grammar = build()
+    GRAMMAR = grammar
     GRAMMAR.load()
+    watch.service().watch(SERVER_LIST_WATCHER, update_server_list)
 
     print 'Aenea client-side modules loaded successfully'
     print 'Settings:'
@@ -113,6 +141,7 @@ def load():
 def unload():
     """Unregister grammar."""
     global GRAMMAR
-    if GRAMMAR is None:
+    if GRAMMAR is not None:
+        watch.service().unwatch(update_server_list)
         GRAMMAR.unload()
         GRAMMAR = None
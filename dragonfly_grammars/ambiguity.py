@@ -0,0 +1,505 @@
+"""
+Grammar ambiguity report.
+
+Find phrases that more than one spec accepts: two children of an
+alternative (e.g. two specs of a MappingRule, or two choices), two
+exported rules of a grammar, or exported rules of two grammars
+whose contexts can be active at the same time. Each overlap is
+reported with a phrase both accept and, for both, the rules and
+specs it passes through with their outputs (action or choice
+value).
+
+Specs are not expanded into all their phrases, the vim grammar
+alone accepts millions. Elements are translated to word automata
+instead, and the shortest phrase two automata share is searched
+for, so one phrase is reported per overlapping pair. Dictation,
+lists and integers are single placeholder words, and repetitions
+are their smallest count (and one, if that is zero), so overlapping
+sequences of repeated phrases are not found.
+
+Grammars can be active together unless their compiled contexts
+(see context_compiler) contradict each other. Window properties
+are assumed independent, except that a property containing a
+pattern contains every part of it.
+"""
+import argparse
+import itertools
+from collections import deque, namedtuple
+from dragonfly import (
+    Alternative,
+    Compound,
+    Dictation,
+    Integer,
+    ListRef,
+    Literal,
+    Optional,
+    Repetition,
+    RuleRef,
+    Sequence)
+import dragonfly_grammars
+from dragonfly_grammars import headless
+from dragonfly_grammars.context_compiler import CompiledContexts
+
+# automaton state pairs searched per comparison before giving up
+SEARCH_LIMIT = 20000
+# contexts with more leaf conditions are assumed to co-occur
+MAX_CONDITIONS = 16
+
+# spec along a phrase: rule (or rule.choice) name, compound spec or
+# None for the rule itself, output of the spec as text or None
+Origin = namedtuple('Origin', ['rule', 'spec', 'output'])
+# phrase: words separated by spaces; origins: (grammar name, path
+# of Origins) for both sides of the overlap
+Overlap = namedtuple('Overlap', ['phrase', 'origins'])
+
+class _Automaton(object):
+
+    """
+    Word automaton of dragonfly elements.
+
+    Moves are (label, target) per state, labels are words, Origins
+    (taken without a word, marking the spec a phrase passes
+    through) or None (taken without a word).
+    """
+
+    def __init__(self):
+        self.moves = []
+
+    def _state(self):
+        self.moves.append([])
+        return len(self.moves) - 1
+
+    def _chain(self, fragments):
+        """Return fragment of fragments in sequence."""
+        start = end = self._state()
+        for fragment_start, fragment_end in fragments:
+            self.moves[end].append((None, fragment_start))
+            end = fragment_end
+        return start, end
+
+    def _words(self, words):
+        start = end = self._state()
+        for word in words:
+            state = self._state()
+            self.moves[end].append((word, state))
+            end = state
+        return start, end
+
+    def marked(self, origin, fragment):
+        """Return fragment passing origin before fragment."""
+        start = self._state()
+        self.moves[start].append((origin, fragment[0]))
+        return start, fragment[1]
+
+    def fragment(self, element, owner):
+        """
+        Add states accepting the phrases of element.
+
+        Parameters
+        ----------
+        element: dragonfly.ElementBase
+            element to translate
+        owner: str
+            name of the rule (or rule.choice) element is part of
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        Tuple[int, int]
+            start and accepting state
+        """
+        # pylint: disable=protected-access
+        if isinstance(element, Literal):
+            return self._words(element.words)
+        if isinstance(element, (Dictation, ListRef, Integer)):
+            return self._words(['<{}>'.format(
+                element.name or type(element).__name__.lower())])
+        if isinstance(element, RuleRef):
+            return self.marked(
+                Origin(element.rule.name, None, None),
+                self.fragment(element.rule.element, element.rule.name))
+        if isinstance(element, Repetition):
+            fragments = [
+                self.fragment(element._child, owner)
+                for _copy in range(element.min)]
+            if element.min == 0 and element.max > 1:
+                start, end = self.fragment(element._child, owner)
+                self.moves[start].append((None, end))
+                fragments.append((start, end))
+            return self._chain(fragments)
+        if isinstance(element, Compound):
+            fragment = self.fragment(element.children[0], owner)
+            if element._value is None:
+                return fragment
+            return self.marked(
+                Origin(owner, element._spec, str(element._value)),
+                fragment)
+        if isinstance(element, Optional):
+            start, end = self.fragment(element.children[0], owner)
+            self.moves[start].append((None, end))
+            return start, end
+        if isinstance(element, Alternative):
+            if element.name:
+                # values of a Choice are its own
+                owner = '{}.{}'.format(owner.split('.')[0], element.name)
+            start = self._state()
+            end = self._state()
+            for child in element.children:
+                child_start, child_end = self.fragment(child, owner)
+                self.moves[start].append((None, child_start))
+                self.moves[child_end].append((None, end))
+            return start, end
+        if isinstance(element, Sequence):
+            return self._chain([
+                self.fragment(child, owner) for child in element.children])
+        return self._words(['<{}>'.format(type(element).__name__.lower())])
+
+    def _closure(self, states):
+        """Return states reachable from states without words."""
+        closed = set(states)
+        todo = list(states)
+        while len(todo) > 0:
+            for label, target in self.moves[todo.pop()]:
+                if not isinstance(label, basestring) and \
+                        target not in closed:
+                    closed.add(target)
+                    todo.append(target)
+        return frozenset(closed)
+
+    def _next(self, states):
+        """Return states after each word, by word."""
+        result = {}
+        for state in states:
+            for label, target in self.moves[state]:
+                if isinstance(label, basestring):
+                    result.setdefault(label, set()).add(target)
+        return result
+
+    def shared_phrase(self, first, second):
+        """
+        Return shortest phrase accepted by two fragments.
+
+        Parameters
+        ----------
+        first: Tuple[int, int]
+            start and accepting state of one fragment
+        second: Tuple[int, int]
+            start and accepting state of the other fragment
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        List[str]
+            None if there is none, or the search gave up
+        """
+        start = (self._closure([first[0]]), self._closure([second[0]]))
+        parents = {start: None}
+        todo = deque([start])
+        while len(todo) > 0 and len(parents) < SEARCH_LIMIT:
+            pair = todo.popleft()
+            if first[1] in pair[0] and second[1] in pair[1]:
+                words = []
+                while parents[pair] is not None:
+                    pair, word = parents[pair]
+                    words.append(word)
+                return words[::-1]
+            first_next = self._next(pair[0])
+            second_next = self._next(pair[1])
+            for word in set(first_next).intersection(second_next):
+                following = (
+                    self._closure(first_next[word]),
+                    self._closure(second_next[word]))
+                if following not in parents:
+                    parents[following] = (pair, word)
+                    todo.append(following)
+        return None
+
+    def origins(self, fragment, words):
+        """
+        Return Origins passed accepting words by fragment.
+
+        Parameters
+        ----------
+        fragment: Tuple[int, int]
+            start and accepting state
+        words: List[str]
+            phrase the fragment accepts
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        Tuple[Origin]
+        """
+        start = (fragment[0], 0)
+        parents = {start: None}
+        todo = deque([start])
+        while len(todo) > 0:
+            state, index = todo.popleft()
+            if state == fragment[1] and index == len(words):
+                path = []
+                node = (state, index)
+                while parents[node] is not None:
+                    node, label = parents[node]
+                    if isinstance(label, Origin):
+                        path.append(label)
+                return tuple(path[::-1])
+            for label, target in self.moves[state]:
+                if isinstance(label, basestring):
+                    if index == len(words) or words[index] != label:
+                        continue
+                    following = (target, index + 1)
+                else:
+                    following = (target, index)
+                if following not in parents:
+                    parents[following] = ((state, index), label)
+                    todo.append(following)
+        return ()
+
+def _overlap(automaton, grammar_names, fragments, words):
+    """Return Overlap of two fragments accepting words."""
+    return Overlap(' '.join(words), [
+        (grammar_name, automaton.origins(fragment, words))
+        for grammar_name, fragment in zip(grammar_names, fragments)])
+
+def _alternatives(grammar, element, owner, seen, overlaps):
+    """Add overlaps of the children of alternatives in element."""
+    # pylint: disable=protected-access
+    if id(element) in seen:
+        return
+    seen.add(id(element))
+    if isinstance(element, RuleRef):
+        _alternatives(
+            grammar, element.rule.element, element.rule.name, seen, overlaps)
+        return
+    children = element.children
+    if isinstance(element, Repetition):
+        children = [element._child]
+    elif isinstance(element, Alternative) and \
+            not isinstance(element, Compound):
+        if element.name:
+            owner = '{}.{}'.format(owner.split('.')[0], element.name)
+        automaton = _Automaton()
+        fragments = []
+        for child in children:
+            fragment = automaton.fragment(child, owner)
+            if not isinstance(child, (Compound, RuleRef)):
+                # name the child, it has no spec of its own
+                fragment = automaton.marked(Origin(
+                    owner,
+                    '<{}>'.format(child.name) if child.name else None,
+                    None), fragment)
+            fragments.append(fragment)
+        for pair in itertools.combinations(fragments, 2):
+            words = automaton.shared_phrase(*pair)
+            if words is not None:
+                overlaps.append(_overlap(
+                    automaton, (grammar.name, grammar.name), pair, words))
+    for child in children:
+        _alternatives(grammar, child, owner, seen, overlaps)
+
+def _leaves(compiled, node_id, leaves):
+    """Add ids of the conditions node_id depends on to leaves."""
+    node = compiled.nodes[node_id]
+    if node[0] in ('and', 'or'):
+        for child in node[1]:
+            _leaves(compiled, child, leaves)
+    elif node[0] == 'not':
+        _leaves(compiled, node[1], leaves)
+    elif node[0] != 'true':
+        leaves.add(node_id)
+
+def _value(compiled, node_id, assignment):
+    node = compiled.nodes[node_id]
+    if node[0] == 'and':
+        return all(_value(compiled, child, assignment) for child in node[1])
+    if node[0] == 'or':
+        return any(_value(compiled, child, assignment) for child in node[1])
+    if node[0] == 'not':
+        return not _value(compiled, node[1], assignment)
+    if node[0] == 'true':
+        return True
+    return assignment[node_id]
+
+def _consistent(compiled, assignment):
+    """Return whether true conditions imply the ones they contain."""
+    for node_id, value in assignment.iteritems():
+        node = compiled.nodes[node_id]
+        if not value or node[0] != 'pred':
+            continue
+        for other_id, other_value in assignment.iteritems():
+            other = compiled.nodes[other_id]
+            if other_value:
+                continue
+            if other[0] == 'proxy' and node[1] == 'proxy':
+                return False
+            if other[0] == 'pred' and other[1:3] == node[1:3] and \
+                    other[3] in node[3]:
+                return False
+    return True
+
+def co_occur(compiled, first, second):
+    """
+    Return whether two compiled contexts can match one window.
+
+    Parameters
+    ----------
+    compiled: CompiledContexts
+        compiled contexts of the grammars
+    first: int
+        node id of one context
+    second: int
+        node id of the other context
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    bool
+    """
+    leaves = set()
+    _leaves(compiled, first, leaves)
+    _leaves(compiled, second, leaves)
+    if len(leaves) > MAX_CONDITIONS:
+        return True
+    leaves = sorted(leaves)
+    for values in itertools.product((False, True), repeat=len(leaves)):
+        assignment = dict(zip(leaves, values))
+        if _value(compiled, first, assignment) and \
+                _value(compiled, second, assignment) and \
+                _consistent(compiled, assignment):
+            return True
+    return False
+
+def find_overlaps(grammars):
+    """
+    Find phrases accepted by more than one spec.
+
+    Parameters
+    ----------
+    grammars: List[dragonfly.Grammar]
+        loaded grammars, so dependencies are included
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Tuple[List[Overlap], List[Tuple[str, str, str]]]
+        overlaps, and rules exported by two grammars that can be
+        active together as (rule name, grammar name, grammar name)
+    """
+    overlaps = []
+    seen = set()
+    for grammar in grammars:
+        for rule in grammar.rules:
+            _alternatives(grammar, rule.element, rule.name, seen, overlaps)
+    automaton = _Automaton()
+    exported = [
+        [(rule, automaton.marked(
+            Origin(rule.name, None, None),
+            automaton.fragment(rule.element, rule.name)))
+         for rule in grammar.rules if rule.exported]
+        for grammar in grammars]
+    compiled = CompiledContexts(grammars)
+    duplicates = []
+    for first, second in itertools.combinations_with_replacement(
+            range(len(grammars)), 2):
+        if not co_occur(
+                compiled, compiled.roots[first], compiled.roots[second]):
+            continue
+        names = (grammars[first].name, grammars[second].name)
+        for (first_rule, first_fragment), (second_rule, second_fragment) \
+                in itertools.product(exported[first], exported[second]):
+            if first == second and first_rule.name >= second_rule.name:
+                continue
+            if first_rule.name == second_rule.name:
+                duplicates.append((first_rule.name,) + names)
+                continue
+            pair = (first_fragment, second_fragment)
+            words = automaton.shared_phrase(*pair)
+            if words is not None:
+                overlaps.append(_overlap(automaton, names, pair, words))
+    # rules like SimpleCommand are in more than one grammar
+    unique = {}
+    for overlap in overlaps:
+        key = (overlap.phrase, tuple(path for _name, path in overlap.origins))
+        unique.setdefault(key, overlap)
+    return sorted(unique.itervalues()), duplicates
+
+def _describe(path):
+    """Return readable text of the specs along an origin path."""
+    parts = []
+    for index, origin in enumerate(path):
+        if origin.spec is None:
+            # a rule followed by one of its specs is named once
+            if index + 1 < len(path) and \
+                    path[index + 1].rule.split('.')[0] == origin.rule:
+                continue
+            parts.append(origin.rule)
+        elif origin.output is None:
+            parts.append('{} {}'.format(origin.rule, origin.spec))
+        else:
+            parts.append('{} "{}" -> {}'.format(
+                origin.rule, origin.spec, origin.output))
+    return ' / '.join(parts)
+
+def main():
+    """
+    Print ambiguity report from the command line.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    headless.install()
+    modules = dict(
+        (module.__name__.rsplit('.', 1)[-1], module)
+        for module in dragonfly_grammars.grammar_modules())
+    parser = argparse.ArgumentParser(
+        prog="grammarambiguity",
+        description="report phrases accepted by more than one spec")
+    parser.add_argument(
+        '--language',
+        action='append',
+        choices=headless.LANGUAGES,
+        help="profile language (default: all)")
+    parser.add_argument(
+        '--module',
+        action='append',
+        choices=sorted(modules),
+        help="grammar module (default: all)")
+    arguments = parser.parse_args()
+    for language in arguments.language or headless.LANGUAGES:
+        headless.use_language(language)
+        grammars = []
+        for name in arguments.module or sorted(modules):
+            modules[name].load()
+            grammars.extend(headless.module_grammars(modules[name]))
+        overlaps, duplicates = find_overlaps(grammars)
+        print "{}: {} ambiguous phrases".format(language, len(overlaps))
+        for overlap in overlaps:
+            print '  "{}"'.format(overlap.phrase)
+            for grammar_name, path in overlap.origins:
+                print '    {}: {}'.format(grammar_name, _describe(path))
+        for rule_name, first, second in duplicates:
+            print "  {}: exported by both {} and {}".format(
+                rule_name, first, second)
+        print
+        for grammar in grammars:
+            grammar.unload()
@@ -0,0 +1,527 @@
+"""
+Grammar build and load benchmarks.
+
+Time construction of every rule class and the load of every
+grammar module, for every language, against a stub engine.
+Allocations are counted as the growth of the number of objects
+tracked by the garbage collector.
+Translation table hits and misses are reported per language, as
+are language switch times and the memory of resident grammars.
+Context evaluation is timed per utterance, both as context trees
+and compiled (see context_compiler). Dictation formats are timed
+per text (see formatting), and --check fails when the registry adds
+overhead to a format or a format is far slower than a plain one.
+Grammar builds are measured with and
+without sharing sub-rules (see interning).
+"""
+import argparse
+import gc
+import inspect
+import sys
+import time
+from contextlib import contextmanager
+from dragonfly import Grammar, Rule
+import dragonfly_grammars
+from dragonfly_grammars import context, headless, interning
+from dragonfly_grammars.context_compiler import CompiledContexts
+from dragonfly_grammars.formatting import FORMATTERS, format_batch
+
+# local executable, local title, proxy window properties
+WINDOWS = (
+    ('c:\\putty.exe', 'user@host: ~', {}),
+    ('c:\\firefox.exe', 'Mozilla Firefox', {}),
+    ('c:\\vbox.exe', 'linux', {
+        'cls': 'Terminator',
+        'title': 'README.md (~/src) - VIM - mode:Normal [markdown] '}),
+    ('c:\\vbox.exe', 'linux', {
+        'cls': 'Terminator',
+        'title': 'common.py (~/src) - VIM - mode:Insert [python] '}),
+    ('c:\\vbox.exe', 'linux', {
+        'cls': 'Terminator', 'title': 'user@host: ~'}),
+    ('c:\\vbox.exe', 'linux', {'cls': 'Firefox', 'title': 'Mozilla Firefox'}))
+
+# dictated text, as DictationRule formats it
+DICTATIONS = (
+    'hello',
+    'parse index',
+    'get child by name',
+    'Marie went to Paris yesterday',
+    'the quick brown fox jumps over the lazy dog')
+
+class _NullWriter(object):
+
+    """File-like sink for grammar load messages."""
+
+    def write(self, _text):
+        """Discard text."""
+
+    def flush(self):
+        """Nothing to flush."""
+
+@contextmanager
+def _quiet():
+    stdout = sys.stdout
+    sys.stdout = _NullWriter()
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+
+def measure(func, repeat=1):
+    """
+    Time func and count the objects it leaves behind.
+
+    Parameters
+    ----------
+    func: Callable[[], Any]
+        function to measure
+    repeat: int
+        number of runs, the fastest one is reported
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Tuple[float, int]
+        seconds of the fastest run, objects allocated per run
+    """
+    best = None
+    allocations = 0
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            objects = len(gc.get_objects())
+            start = time.time()
+            with _quiet():
+                # keep result alive, so it is counted
+                result = func()
+            duration = time.time() - start
+            allocations = len(gc.get_objects()) - objects
+            del result
+        finally:
+            gc.enable()
+        if best is None or duration < best:
+            best = duration
+    return best, allocations
+
+def rule_classes(module):
+    """
+    Return rule classes defined in a grammar module.
+
+    Parameters
+    ----------
+    module: module
+        grammar module, e.g. dragonfly_grammars.vim
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[type]
+    """
+    return [
+        value for _name, value in inspect.getmembers(module, inspect.isclass)
+        if issubclass(value, Rule) and value.__module__ == module.__name__]
+
+def benchmark(languages, modules, repeat=1):
+    """
+    Run benchmarks.
+
+    Parameters
+    ----------
+    languages: List[str]
+        profile languages to benchmark, e.g. ['enx', 'nld']
+    modules: List[module]
+        grammar modules to benchmark
+    repeat: int
+        number of runs per measurement
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[Tuple[str, str, str, float, int]]
+        language, kind (rule or load), name, seconds, allocations
+    """
+    results = []
+    for translator in dragonfly_grammars.TRANSLATORS.itervalues():
+        translator.reset_counters()
+    for language in languages:
+        headless.install(language)
+        for module in modules:
+            module_name = module.__name__.rsplit('.', 1)[-1]
+            for cls in rule_classes(module):
+                seconds, allocations = measure(cls, repeat)
+                results.append((
+                    language,
+                    'rule',
+                    '{}.{}'.format(module_name, cls.__name__),
+                    seconds,
+                    allocations))
+
+            def load(module=module):
+                """Load and unload module's grammars."""
+                module.load()
+                for grammar in headless.module_grammars(module):
+                    grammar.unload()
+            seconds, allocations = measure(load, repeat)
+            results.append((
+                language, 'load', module_name, seconds, allocations))
+    return results
+
+def language_switches(languages, repeat=1):
+    """
+    Time switching between the resident grammars of languages.
+
+    Parameters
+    ----------
+    languages: List[str]
+        profile languages, e.g. ['enx', 'nld']
+    repeat: int
+        number of switches per language, the fastest is reported
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[Tuple[str, float, float, int]]
+        language, seconds of first activation, seconds of a
+        switch, bytes of resident grammars
+    """
+    results = []
+    firsts = {}
+    with _quiet():
+        for language in languages:
+            start = time.time()
+            dragonfly_grammars.switch_language(language)
+            firsts[language] = time.time() - start
+    for language in languages:
+        best = None
+        for _ in range(repeat):
+            with _quiet():
+                for other in languages:
+                    if other != language:
+                        dragonfly_grammars.switch_language(other)
+                start = time.time()
+                dragonfly_grammars.switch_language(language)
+                duration = time.time() - start
+            if best is None or duration < best:
+                best = duration
+        results.append((language, firsts[language], best))
+    sizes = dragonfly_grammars.grammar_set_sizes()
+    with _quiet():
+        dragonfly_grammars.unload_grammars()
+    return [
+        (language, first, switch, sizes[language])
+        for language, first, switch in results]
+
+def context_grammars():
+    """
+    Return unloaded grammars with the contexts used by this package.
+
+    These are the grammars of all grammar modules, and grammars with
+    the vim mode and file type contexts.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[dragonfly.Grammar]
+    """
+    grammars = [
+        module.build() for module in dragonfly_grammars.grammar_modules()]
+    contexts = [
+        context.terminal(),
+        context.true_vim(),
+        context.terminal_not_vim(),
+        context.vim_normal_mode(),
+        context.vim_insert_mode(),
+        context.vim_visual_mode()]
+    contexts.extend(
+        context.vim_file_type(file_type)
+        for file_type in ('python', 'markdown', 'rst', 'sh'))
+    grammars.extend(
+        Grammar('context_{}'.format(index), context=grammar_context)
+        for index, grammar_context in enumerate(contexts))
+    return grammars
+
+def context_evaluation(repeat=1, utterances=1000):
+    """
+    Time context evaluation of context_grammars for WINDOWS.
+
+    Parameters
+    ----------
+    repeat: int
+        number of runs, the fastest one is reported
+    utterances: int
+        utterances per run, cycling through WINDOWS
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Tuple[float, float, int]
+        seconds per utterance of context trees and compiled
+        contexts, windows for which their active grammars differ
+    """
+    with _quiet():
+        grammars = context_grammars()
+    compiled = CompiledContexts(grammars)
+
+    def trees(executable, title, handle):
+        """Return grammars whose context matches."""
+        # pylint: disable=protected-access
+        return [
+            grammar for grammar in grammars
+            if grammar._context is None
+            or grammar._context.matches(executable, title, handle)]
+
+    results = []
+    differences = 0
+    try:
+        for evaluate in (trees, compiled.active):
+            best = None
+            for _ in range(repeat):
+                start = time.time()
+                for index in range(utterances):
+                    executable, title, properties = WINDOWS[
+                        index % len(WINDOWS)]
+                    context.SNAPSHOT.pin(properties)
+                    evaluate(executable, title, 1)
+                duration = time.time() - start
+                if best is None or duration < best:
+                    best = duration
+            results.append(best / utterances)
+        for executable, title, properties in WINDOWS:
+            context.SNAPSHOT.pin(properties)
+            if trees(executable, title, 1) != compiled.active(
+                    executable, title, 1):
+                differences += 1
+    finally:
+        context.SNAPSHOT.pin(None)
+    return results[0], results[1], differences
+
+def formatter_timings(repeat=1, texts=1000):
+    """
+    Time every dictation format on DICTATIONS.
+
+    Parameters
+    ----------
+    repeat: int
+        number of runs, the fastest one is reported
+    texts: int
+        texts formatted per run, cycling through DICTATIONS
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[Tuple[str, float]]
+        format name and seconds per text
+    """
+    batch = [DICTATIONS[index % len(DICTATIONS)] for index in range(texts)]
+    results = []
+    for name in sorted(FORMATTERS):
+        seconds, _allocations = measure(
+            lambda name=name: format_batch(name, batch), repeat)
+        results.append((name, seconds / texts))
+    return results
+
+def formatter_regressions(repeat=5, texts=10000, max_overhead=2.0,
+                          max_factor=10.0):
+    """
+    Return formats that regressed.
+
+    A format regresses when formatting through the registry takes
+    more than max_overhead times calling its function directly, or
+    when it takes more than max_factor times lowercasing and joining
+    with underscores, which calibrates the check to the machine.
+
+    Parameters
+    ----------
+    repeat: int
+        number of runs, the fastest one is compared
+    texts: int
+        texts formatted per run, cycling through DICTATIONS
+    max_overhead: float
+        allowed ratio of registry to direct calls
+    max_factor: float
+        allowed ratio of a format to the plain one
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[str]
+        description of every regression, empty if there are none
+    """
+    batch = [DICTATIONS[index % len(DICTATIONS)] for index in range(texts)]
+    plain, _allocations = measure(
+        lambda: [text.lower().replace(' ', '_') for text in batch], repeat)
+    regressions = []
+    for name in sorted(FORMATTERS):
+        formatter = FORMATTERS[name]
+        direct, _allocations = measure(
+            lambda formatter=formatter: [formatter(text) for text in batch],
+            repeat)
+        registry, _allocations = measure(
+            lambda name=name: format_batch(name, batch), repeat)
+        if registry > direct * max_overhead:
+            regressions.append(
+                '{}: registry takes {:.1f}x a direct call'.format(
+                    name, registry / direct))
+        if registry > plain * max_factor:
+            regressions.append(
+                '{}: takes {:.1f}x a plain format'.format(
+                    name, registry / plain))
+    return regressions
+
+def interning_savings(languages, modules, repeat=1):
+    """
+    Measure grammar builds with and without rule interning.
+
+    Parameters
+    ----------
+    languages: List[str]
+        profile languages to benchmark, e.g. ['enx', 'nld']
+    modules: List[module]
+        grammar modules to benchmark
+    repeat: int
+        number of runs per measurement
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[Tuple[str, str, float, int, float, int]]
+        language, module name, seconds and allocations without
+        interning, seconds and allocations with interning
+    """
+    results = []
+    for language in languages:
+        headless.install(language)
+        for module in modules:
+            measured = []
+            for enabled in (False, True):
+                interning.ENABLED = enabled
+                try:
+                    measured.extend(measure(module.build, repeat))
+                finally:
+                    interning.ENABLED = True
+            results.append(
+                (language, module.__name__.rsplit('.', 1)[-1]) +
+                tuple(measured))
+    return results
+
+def main():
+    """
+    Benchmark grammar construction from the command line.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    headless.install()
+    modules = dict(
+        (module.__name__.rsplit('.', 1)[-1], module)
+        for module in dragonfly_grammars.grammar_modules())
+    parser = argparse.ArgumentParser(
+        prog="grammarbench",
+        description="time grammar construction and loading")
+    parser.add_argument(
+        '--language',
+        action='append',
+        choices=headless.LANGUAGES,
+        help="profile language (default: all)")
+    parser.add_argument(
+        '--module',
+        action='append',
+        choices=sorted(modules),
+        help="grammar module (default: all)")
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=5,
+        help="runs per measurement, fastest is reported")
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        help="only check dictation formats, exit 1 if one regressed")
+    arguments = parser.parse_args()
+    if arguments.check:
+        regressions = formatter_regressions(arguments.repeat)
+        for regression in regressions:
+            print regression
+        sys.exit(1 if len(regressions) > 0 else 0)
+    selected = [modules[name] for name in arguments.module or sorted(modules)]
+    results = benchmark(
+        arguments.language or headless.LANGUAGES,
+        selected,
+        arguments.repeat)
+    print "{:<5} {:<5} {:<40} {:>10} {:>10}".format(
+        'lang', 'kind', 'name', 'ms', 'objects')
+    for language, kind, name, seconds, allocations in results:
+        print "{:<5} {:<5} {:<40} {:>10.2f} {:>10}".format(
+            language, kind, name, seconds * 1000, allocations)
+    print
+    for language in arguments.language or headless.LANGUAGES:
+        translator = dragonfly_grammars.TRANSLATORS[language]
+        print "{} translations: {} hits, {} misses, {} entries".format(
+            language,
+            translator.hits,
+            translator.misses,
+            len(translator.table))
+    print
+    print "{:<5} {:>10} {:>10} {:>10}".format(
+        'lang', 'first ms', 'switch ms', 'kB')
+    for language, first, switch, size in language_switches(
+            arguments.language or headless.LANGUAGES, arguments.repeat):
+        print "{:<5} {:>10.2f} {:>10.2f} {:>10}".format(
+            language, first * 1000, switch * 1000, size // 1024)
+    trees, compiled, differences = context_evaluation(arguments.repeat)
+    print
+    print "contexts per utterance: {:.1f} us as trees, {:.1f} us compiled, " \
+        "{} windows differ".format(
+            trees * 10 ** 6, compiled * 10 ** 6, differences)
+    print
+    print "{:<10} {:>10}".format('format', 'us/text')
+    for name, seconds in formatter_timings(arguments.repeat):
+        print "{:<10} {:>10.2f}".format(name, seconds * 10 ** 6)
+    print
+    print "{:<5} {:<10} {:>10} {:>10} {:>10} {:>10}".format(
+        'lang', 'module', 'ms', 'interned', 'objects', 'interned')
+    for language, name, seconds, allocations, interned_seconds, \
+            interned_allocations in interning_savings(
+                arguments.language or headless.LANGUAGES,
+                selected,
+                arguments.repeat):
+        print "{:<5} {:<10} {:>10.2f} {:>10.2f} {:>10} {:>10}".format(
+            language,
+            name,
+            seconds * 1000,
+            interned_seconds * 1000,
+            allocations,
+            interned_allocations)
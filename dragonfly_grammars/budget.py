@@ -0,0 +1,181 @@
+"""
+Grammar size budget.
+
+Repetition bounds multiply the size of a compiled grammar, and with
+it the work of the recognizer. With a budget of compiled bytes per
+grammar module, build() searches for the largest bounds whose
+grammar fits and prints the values it chose, so chain length can be
+traded against recognizer load per machine.
+
+Bounds are scaled down together from their defaults, no bound goes
+below its smallest useful value. The bounds chosen for a module,
+budget and language are kept, so later builds of it, e.g. after a
+language switch back, build once instead of searching again.
+"""
+from dragonfly_grammars.common import get_translator
+
+# per grammar module: {bound keyword: (smallest, default)}, values are
+# Repetition max values, which are exclusive
+BOUNDS = {
+    'global_': {
+        'max_characters': (2, 80),
+        'max_modifiers': (2, 4)},
+    'cli': {'max_options': (2, 10)},
+    'i3': {'max_options': (2, 10)},
+    'vim': {
+        'max_commands': (2, 5),
+        'max_numbers': (2, 3)}}
+# steps of the search for the largest bounds that fit
+SEARCH_STEPS = 7
+
+# compiled bytes per grammar module
+BUDGETS = {}
+# module name: (bounds, compiled bytes) of the last build
+CHOSEN = {}
+# (module name, budget, translator): (bounds, compiled bytes) of fits
+FITTED = {}
+
+def set_budget(budget):
+    """
+    Set compiled grammar size budget.
+
+    Parameters
+    ----------
+    budget: Union[int, Dict[str, int]]
+        bytes for every tunable grammar module, or bytes by module
+        name, None for no budget
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    BUDGETS.clear()
+    if budget is None:
+        return
+    if isinstance(budget, dict):
+        BUDGETS.update(budget)
+    else:
+        BUDGETS.update((name, budget) for name in BOUNDS)
+
+def cache_key():
+    """Return text identifying the budget, for the grammar cache."""
+    if len(BUDGETS) == 0:
+        return ''
+    return repr(sorted(BUDGETS.items()))
+
+def compiled_size(grammar):
+    """Return compiled size of grammar in bytes, None if unknown."""
+    # imported here, headless imports the package
+    from dragonfly_grammars.headless import _natlink_compiler
+    compiler = _natlink_compiler()
+    if compiler is None:
+        return None
+    # load() adds referenced rules, compiling needs them before that
+    add_dependencies = getattr(grammar, 'add_all_dependencies', None)
+    if add_dependencies is not None:
+        add_dependencies()
+    compiled, _rule_names = compiler.compile_grammar(grammar)
+    return len(compiled)
+
+def scaled_bounds(bounds, fraction):
+    """Return bounds scaled down from their defaults by fraction."""
+    return dict(
+        (keyword, max(smallest, int(round(default * fraction))))
+        for keyword, (smallest, default) in bounds.iteritems())
+
+def fit(module, max_bytes):
+    """
+    Build grammar of module with the largest bounds that fit.
+
+    Parameters
+    ----------
+    module: module
+        grammar module with tunable bounds, e.g. dragonfly_grammars.vim
+    max_bytes: int
+        compiled size budget
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Tuple[dragonfly.Grammar, Dict[str, int], int]
+        grammar, its bounds and compiled size, which is over budget
+        if even the smallest bounds are
+    """
+    bounds = BOUNDS[module.__name__.rsplit('.', 1)[-1]]
+    # fractions that round to the same bounds are built once
+    built = {}
+
+    def build(fraction):
+        """Return grammar, bounds and size of fraction."""
+        chosen = scaled_bounds(bounds, fraction)
+        key = tuple(sorted(chosen.iteritems()))
+        if key not in built:
+            grammar = module.build(chosen)
+            built[key] = grammar, chosen, compiled_size(grammar)
+        return built[key]
+
+    best = build(1.0)
+    if best[2] is None or best[2] <= max_bytes:
+        return best
+    smallest = build(0.0)
+    if smallest[2] > max_bytes:
+        return smallest
+    best = smallest
+    low, high = 0.0, 1.0
+    for _step in range(SEARCH_STEPS):
+        middle = (low + high) / 2
+        result = build(middle)
+        if result[2] <= max_bytes:
+            best = result
+            low = middle
+        else:
+            high = middle
+    return best
+
+def build(module):
+    """
+    Build grammar of module within its budget, if it has one.
+
+    Parameters
+    ----------
+    module: module
+        grammar module, e.g. dragonfly_grammars.vim
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    dragonfly.Grammar
+    """
+    name = module.__name__.rsplit('.', 1)[-1]
+    if name not in BUDGETS or name not in BOUNDS:
+        return module.build()
+    key = (name, BUDGETS[name], get_translator())
+    if key in FITTED:
+        bounds, size = FITTED[key]
+        grammar = module.build(bounds)
+    else:
+        grammar, bounds, size = fit(module, BUDGETS[name])
+        FITTED[key] = bounds, size
+    CHOSEN[name] = bounds, size
+    if size is None:
+        print 'grammar budget: {} size unknown, default bounds'.format(name)
+    else:
+        print 'grammar budget: {} {}/{} bytes, {}{}'.format(
+            name,
+            size,
+            BUDGETS[name],
+            ', '.join(
+                '{}={}'.format(keyword, value)
+                for keyword, value in sorted(bounds.iteritems())),
+            '' if size <= BUDGETS[name] else ' (over budget)')
+    return grammar
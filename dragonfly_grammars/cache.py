@@ -0,0 +1,373 @@
+"""
+On-disk cache of built grammars.
+
+Building a grammar translates every spec and parses it into an
+element tree. The result is pickled per grammar module and profile
+language, keyed by a hash of the package sources, the mtimes of
+the compiled catalogs, the versions of dragonfly and aenea, the
+size budget and the registered spoken formats, so any change to
+these invalidates it.
+
+Pickling recurses into the nested element trees of long repetitions
+and needs a raised recursion limit, which applies to the whole
+process. Grammars are therefore only pickled on the main thread:
+grammars built on a background thread are kept pending until the
+main thread stores them (see store_pending). Unpickling does not
+recurse and is safe on any thread.
+
+Sub-rules shared within a grammar (see interning) stay shared in
+its pickle, grammars of different modules share no rules.
+
+Only grammar modules without shared module state are cached: the
+aenea and password grammars reference lists that are updated at
+runtime and must not be copied.
+
+Builds share unprotected state: the memo of the translator, the
+interning statistics and the recursion limit. Every build holds
+BUILD_LOCK, so a build on the main thread waits for one on a
+background thread (see staged) instead of interleaving with it.
+"""
+import cPickle
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from importlib import import_module
+import pkg_resources
+from pathlib2 import Path
+from dragonfly import get_engine
+from dragonfly_grammars import budget, formatting
+from dragonfly_grammars.vault import replace_file
+
+CACHEABLE_MODULES = ('cli', 'global_', 'i3', 'vim')
+# modules whose classes are pickled, with their distribution names
+DEPENDENCIES = (
+    ('dragonfly', ('dragonfly2', 'dragonfly')),
+    ('aenea', ('aenea',)))
+# bytes kept on disk, oldest entries are evicted first
+MAX_CACHE_BYTES = 32 * 1024 * 1024
+# element trees of long repetitions are deeply nested
+_RECURSION_LIMIT = 20000
+
+ACTIVE_CACHE = None
+# held for every build, reentrant for builds within imports
+BUILD_LOCK = threading.RLock()
+
+def _package_path():
+    return Path(__file__).resolve().parent
+
+def source_key():
+    """
+    Return hash of the package sources and catalog mtimes.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    str
+    """
+    package_path = _package_path()
+    digest = hashlib.sha1()
+    for path in sorted(package_path.glob('*.py')):
+        digest.update(path.name)
+        digest.update(path.read_bytes())
+    for path in sorted(package_path.glob('translations/language/*/*/*.mo')):
+        digest.update(str(path.relative_to(package_path)))
+        digest.update(repr(path.stat().st_mtime))
+    return digest.hexdigest()
+
+def dependency_key():
+    """
+    Return text identifying the versions of DEPENDENCIES.
+
+    Modules that are not installed as a distribution, like an aenea
+    client on the python path, are identified by their file mtime.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    str
+    """
+    versions = []
+    for module_name, distributions in DEPENDENCIES:
+        version = None
+        for distribution in distributions:
+            try:
+                version = pkg_resources.get_distribution(
+                    distribution).version
+                break
+            except pkg_resources.DistributionNotFound:
+                pass
+        if version is None:
+            module = import_module(module_name)
+            version = getattr(module, '__version__', None)
+        if version is None:
+            version = repr(os.path.getmtime(module.__file__))
+        versions.append('{}={}'.format(module_name, version))
+    return ' '.join(versions)
+
+def _on_main_thread():
+    return threading.current_thread().name == 'MainThread'
+
+class _RecursionLimit(object):
+
+    """Temporarily raise the recursion limit."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(self.previous, self.limit))
+
+    def __exit__(self, *_exc_info):
+        sys.setrecursionlimit(self.previous)
+
+class GrammarCache(object):
+
+    """
+    Pickled grammars for one profile language.
+
+    Parameters
+    ----------
+    language: str
+        profile language, e.g. enx
+    directory: pathlib2.Path
+        cache directory, defaults to ~/.cache/dragonfly_grammars
+    max_bytes: int
+        size bound of the cache directory
+    """
+
+    def __init__(self, language, directory=None, max_bytes=MAX_CACHE_BYTES):
+        self.language = language
+        if directory is None:
+            directory = Path().home().joinpath(
+                '.cache', 'dragonfly_grammars')
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # grammars built within a size budget have other bounds, and
+        # DictationRule offers the registered spoken formats
+        self.key = hashlib.sha1(
+            source_key() + dependency_key() + budget.cache_key() +
+            formatting.cache_key()).hexdigest()
+        self.hits = 0
+        self.misses = 0
+        # grammars built off the main thread, to be stored by it
+        self.pending = {}
+
+    def path(self, module_name):
+        """Return cache file of grammar module."""
+        return self.directory.joinpath('{}-{}-{}.pickle'.format(
+            self.language, module_name, self.key[:16]))
+
+    def load(self, module_name):
+        """
+        Return cached grammar of module_name, None if not cached.
+
+        Parameters
+        ----------
+        module_name: str
+            grammar module, e.g. vim
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        dragonfly.Grammar
+        """
+        path = self.path(module_name)
+        if not path.exists():
+            return None
+        engine = get_engine()
+        try:
+            with path.open('rb') as cache_file:
+                unpickler = cPickle.Unpickler(cache_file)
+                unpickler.persistent_load = lambda _pid: engine
+                grammar = unpickler.load()
+        except Exception:  # pylint: disable=broad-except
+            print 'grammar cache: removing unreadable {}'.format(path)
+            path.unlink()
+            return None
+        # mark as recently used for eviction
+        os.utime(str(path), None)
+        return grammar
+
+    def store(self, module_name, grammar):
+        """
+        Write grammar to cache and evict stale and old entries.
+
+        Call from the main thread only, pickling raises the
+        recursion limit of the process.
+
+        Parameters
+        ----------
+        module_name: str
+            grammar module, e.g. vim
+        grammar: dragonfly.Grammar
+            grammar that is not loaded yet
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        bool
+            False if grammar could not be pickled or written
+        """
+        engine = grammar.engine
+        temp_name = None
+        try:
+            if not self.directory.exists():
+                self.directory.mkdir(parents=True)
+            handle, temp_name = tempfile.mkstemp(
+                dir=str(self.directory), suffix='.tmp')
+            with os.fdopen(handle, 'wb') as cache_file, \
+                    _RecursionLimit(_RECURSION_LIMIT):
+                pickler = cPickle.Pickler(
+                    cache_file, cPickle.HIGHEST_PROTOCOL)
+                pickler.persistent_id = \
+                    lambda obj: 'engine' if obj is engine else None
+                pickler.dump(grammar)
+            # readers see the old or the new entry, never none
+            replace_file(temp_name, str(self.path(module_name)))
+            temp_name = None
+        except Exception as error:  # pylint: disable=broad-except
+            # e.g. unpicklable, too deep to pickle or a full disk, the
+            # grammar is still built, caching it is optional
+            print 'grammar cache: cannot cache {}: {}'.format(
+                module_name, error)
+            return False
+        finally:
+            if temp_name is not None:
+                try:
+                    os.remove(temp_name)
+                except OSError:
+                    pass
+        try:
+            self.evict()
+        except OSError as error:
+            # e.g. another process evicted the same entry
+            print 'grammar cache: cannot evict: {}'.format(error)
+        return True
+
+    def build(self, module):
+        """
+        Return grammar of module, from cache if possible.
+
+        Parameters
+        ----------
+        module: module
+            grammar module, e.g. dragonfly_grammars.vim
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        dragonfly.Grammar
+        """
+        module_name = module.__name__.rsplit('.', 1)[-1]
+        if module_name not in CACHEABLE_MODULES:
+            return budget.build(module)
+        grammar = self.load(module_name)
+        if grammar is not None:
+            self.hits += 1
+            return grammar
+        self.misses += 1
+        grammar = budget.build(module)
+        if _on_main_thread():
+            self.store(module_name, grammar)
+        else:
+            self.pending[module_name] = grammar
+        return grammar
+
+    def store_pending(self):
+        """
+        Store grammars built off the main thread, call from it only.
+
+        Call this before the grammars are loaded.
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        None
+        """
+        while len(self.pending) > 0:
+            module_name, grammar = self.pending.popitem()
+            self.store(module_name, grammar)
+
+    def evict(self):
+        """
+        Remove entries of other source versions and oldest entries.
+
+        Entries of other languages with the current source version are
+        kept until the size bound is reached.
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        None
+        """
+        entries = []
+        for path in self.directory.glob('*.pickle'):
+            if not path.stem.endswith(self.key[:16]):
+                path.unlink()
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink()
+            total -= size
+
+    def clear(self):
+        """Remove all cached grammars."""
+        if self.directory.exists():
+            for path in self.directory.glob('*.pickle'):
+                path.unlink()
+
+def build(module):
+    """
+    Build grammar of module through the active cache, if any.
+
+    Parameters
+    ----------
+    module: module
+        grammar module, e.g. dragonfly_grammars.vim
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    dragonfly.Grammar
+    """
+    with BUILD_LOCK:
+        if ACTIVE_CACHE is None:
+            return budget.build(module)
+        return ACTIVE_CACHE.build(module)
+
+def store_pending():
+    """Store grammars built off the main thread in the active cache."""
+    if ACTIVE_CACHE is not None:
+        ACTIVE_CACHE.store_pending()
@@ -3,7 +3,6 @@
 from aenea import (
     Grammar,
     MappingRule,
-    Key,
     Alternative,
     Choice,
     Repetition,
@@ -12,10 +11,15 @@ from aenea import (
 from dragonfly_grammars.common import (
     _,
     extract_values,
+    parse_index,
+    releases_parse_index,
     text_to_keystr,
     join_actions,
+    compile_actions,
     Text)
 from dragonfly_grammars.context import terminal_not_vim
+from dragonfly_grammars.interning import intern_rule, scope
+from dragonfly_grammars.latency import execute_timed, timed
 
 class SshOptions(MappingRule):
 
@@ -64,6 +68,7 @@ class SshServer(CompoundRule):
                 })]
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
         user = node.get_child_by_name('user', shallow=True)
         server = node.get_child_by_name('server', shallow=True)
@@ -77,28 +82,36 @@ class SshRule(CompoundRule):
 
     """Most common ssh use."""
 
+    # Repetition max, exclusive
+    max_options = 10
+
     def __init__(self, *args, **kwargs):
+        bounds = kwargs.pop('bounds', {})
+        self.max_options = bounds.get('max_options', self.max_options)
         self.spec = _("S S H [<ssh_options>] <server> [<command>]")
         self.extras = [
             Repetition(
                 name='ssh_options',
                 min=0,
-                max=10,
+                max=self.max_options,
                 child=RuleRef(
                     name='ssh_option',
-                    rule=SshOptions())),
-            RuleRef(name='server', rule=SshServer()),
-            RuleRef(name='command', rule=Command())]
+                    rule=intern_rule(SshOptions))),
+            RuleRef(name='server', rule=intern_rule(SshServer)),
+            RuleRef(name='command', rule=intern_rule(Command))]
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
         return join_actions(' ', [Text('ssh')] + extract_values(
             node,
             (SshOptions, SshServer, Command),
             recurse=True))
 
+    @timed('recognition')
+    @releases_parse_index
     def _process_recognition(self, node, extras):
-        self.value(node).execute()
+        execute_timed(compile_actions(self.value(node)))
 
 class SudoRule(CompoundRule):
 
@@ -109,16 +122,19 @@ class SudoRule(CompoundRule):
     def __init__(self, *args, **kwargs):
         self.spec = _("sudo <command>")
         self.extras = [
-            RuleRef(name='command', rule=Command()),
+            RuleRef(name='command', rule=intern_rule(Command)),
             ]
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
         return Text('sudo ') + node.get_child_by_name(
             'command').value()
 
+    @timed('recognition')
+    @releases_parse_index
     def _process_recognition(self, node, extras):
-        self.value(node).execute()
+        execute_timed(compile_actions(self.value(node)))
 
 class SimpleCommand(MappingRule):
 
@@ -192,22 +208,30 @@ class Command(CompoundRule):
             RuleRef(rule=SimpleCommand()),))]
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
-        return extract_values(node, (
-            SimpleCommand), recurse=True)[0]
+        return parse_index(node).first_value(node, SimpleCommand)
 
 
 GRAMMAR = None
 
-def load():
-    """Register grammar."""
-    global GRAMMAR
-    GRAMMAR = Grammar(
+def build(bounds=None):
+    """Build grammar, with repetition bounds if given (see budget)."""
+    grammar = Grammar(
         'command_line_interface',
         context=terminal_not_vim())
-    GRAMMAR.add_rule(SshRule())
-    GRAMMAR.add_rule(SimpleCommand())
-    GRAMMAR.add_rule(SudoRule())
+    with scope():
+        grammar.add_rule(SshRule(bounds=bounds or {}))
+        grammar.add_rule(SimpleCommand())
+        grammar.add_rule(SudoRule())
+    return grammar
+
+def load(grammar=None):
+    """Register grammar, built with build() if not given."""
+    global GRAMMAR
+    if grammar is None:
+        grammar = build()
+    GRAMMAR = grammar
     GRAMMAR.load()
 
     print 'cli grammar: Loaded.'
@@ -215,6 +239,6 @@ def load():
 def unload():
     """Unregister grammar."""
     global GRAMMAR
-    if GRAMMAR is None:
+    if GRAMMAR is not None:
         GRAMMAR.unload()
         GRAMMAR = None
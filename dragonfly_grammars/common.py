@@ -1,92 +1,458 @@
 """Common values and functions for dragonfly_grammars."""
+import functools
 import string
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from itertools import chain
+from collections import OrderedDict
 import aenea
+from dragonfly.actions.action_base import ActionSeries, BoundAction
+from dragonfly_grammars import stream
 
 _GETTEXT_FUNC = lambda text: text
-# pylint: disable=unnecessary-lambda
-_ = lambda text: _GETTEXT_FUNC(text)
+_TRANSLATOR_LOCK = threading.Lock()
+# translator override of threads that build grammars
+_THREAD_TRANSLATOR = threading.local()
+
+def _(text):
+    """Translate text with this thread's translator."""
+    gettext_function = getattr(_THREAD_TRANSLATOR, 'gettext_function', None)
+    if gettext_function is None:
+        gettext_function = _GETTEXT_FUNC
+    return gettext_function(text)
 
 def set_translator(gettext_function):
     """Change translatorfunc (language change)."""
     global _GETTEXT_FUNC
-    _GETTEXT_FUNC = gettext_function
+    with _TRANSLATOR_LOCK:
+        _GETTEXT_FUNC = gettext_function
+
+def get_translator():
+    """Return translatorfunc of this thread (see thread_translator)."""
+    gettext_function = getattr(_THREAD_TRANSLATOR, 'gettext_function', None)
+    if gettext_function is not None:
+        return gettext_function
+    with _TRANSLATOR_LOCK:
+        return _GETTEXT_FUNC
+
+class MemoTranslator(object):
+
+    """
+    Translator with the translation table of a catalog materialised.
+
+    Specs are looked up in a plain dict instead of going through
+    gettext for every rule instance. Strings that are not in the
+    catalog are translated once and then memoized too.
+
+    Parameters
+    ----------
+    translation: gettext.GNUTranslations
+        catalog, e.g. dragonfly_grammars.NLD
+    """
+
+    def __init__(self, translation):
+        self._gettext = translation.lgettext
+        # msgids are unicode, which matches ascii str lookups
+        self.table = dict(
+            (msgid, translation.lgettext(msgid))
+            # pylint: disable=protected-access
+            for msgid in translation._catalog
+            if isinstance(msgid, basestring) and msgid != '')
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, text):
+        try:
+            result = self.table[text]
+        except KeyError:
+            self.misses += 1
+            result = self._gettext(text)
+            self.table[text] = result
+            return result
+        self.hits += 1
+        return result
+
+    def reset_counters(self):
+        """Set hit and miss counters to zero."""
+        self.hits = 0
+        self.misses = 0
+
+@contextmanager
+def thread_translator(gettext_function):
+    """
+    Translate with gettext_function in this thread only.
+
+    Use this in threads that build grammars, so a language change
+    in the main thread does not affect a build in progress.
+
+    Parameters
+    ----------
+    gettext_function: Callable[[str], str]
+        translator for this thread
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    previous = getattr(_THREAD_TRANSLATOR, 'gettext_function', None)
+    _THREAD_TRANSLATOR.gettext_function = gettext_function
+    try:
+        yield
+    finally:
+        _THREAD_TRANSLATOR.gettext_function = previous
+
+# first_value default meaning "raise if there is no match"
+_REQUIRED = object()
+
+class ParseIndex(object):
+
+    """
+    Preorder index of a recognition parse tree.
+
+    Nodes are bucketed by actor type and by name in a single walk.
+    Lookups below any node of the tree are binary searches over the
+    subtree's range of positions, so rules that are evaluated for
+    sub-nodes do not walk their subtree again.
+
+    Parameters
+    ----------
+    root: dragonfly.grammar.state.Node
+        root of the tree to index
+    """
+
+    def __init__(self, root):
+        self._nodes = []
+        self._ends = []
+        self._positions = {}
+        self._by_type = {}
+        self._by_name = {}
+        self._type_cache = {}
+        stack = [(root, False)]
+        while len(stack) > 0:
+            node, visited = stack.pop()
+            if visited:
+                self._ends[self._positions[id(node)]] = len(self._nodes)
+                continue
+            position = len(self._nodes)
+            self._positions[id(node)] = position
+            self._nodes.append(node)
+            self._ends.append(None)
+            self._by_type.setdefault(
+                type(node.actor), []).append(position)
+            if node.name:
+                self._by_name.setdefault(node.name, []).append(position)
+            stack.append((node, True))
+            for child in reversed(node.children):
+                stack.append((child, False))
+
+    def __contains__(self, node):
+        position = self._positions.get(id(node))
+        return position is not None and self._nodes[position] is node
+
+    def _type_positions(self, types):
+        if not isinstance(types, tuple):
+            types = (types,)
+        positions = self._type_cache.get(types)
+        if positions is None:
+            buckets = [
+                bucket for actor_type, bucket in self._by_type.iteritems()
+                if issubclass(actor_type, types)]
+            if len(buckets) == 1:
+                positions = buckets[0]
+            else:
+                positions = sorted(chain.from_iterable(buckets))
+            self._type_cache[types] = positions
+        return positions
+
+    def _subtree(self, positions, node):
+        """Return slice bounds of positions that are below node."""
+        position = self._positions[id(node)]
+        begin = bisect_left(positions, position + 1)
+        end = bisect_left(positions, self._ends[position], begin)
+        return begin, end
+
+    def values(self, node, types):
+        """Return values of all nodes below node matching types."""
+        positions = self._type_positions(types)
+        begin, end = self._subtree(positions, node)
+        return [self._nodes[i].value() for i in positions[begin:end]]
+
+    def first_value(self, node, types, default=_REQUIRED):
+        """
+        Return value of first node below node matching types.
+
+        Raises IndexError if there is none and no default is given,
+        like indexing the values would.
+        """
+        positions = self._type_positions(types)
+        begin, end = self._subtree(positions, node)
+        if begin == end:
+            if default is _REQUIRED:
+                raise IndexError(
+                    'no {} below {}'.format(types, node.name))
+            return default
+        return self._nodes[positions[begin]].value()
+
+    def first_named(self, node, name):
+        """Return first node below node called name, or None."""
+        positions = self._by_name.get(name, [])
+        begin, end = self._subtree(positions, node)
+        if begin == end:
+            return None
+        return self._nodes[positions[begin]]
+
+_PARSE_INDEX = None
+
+def parse_index(node):
+    """
+    Return index of the parse tree node belongs to.
+
+    The index of the most recent tree is kept, so all rules
+    evaluated for one recognition share it, until
+    clear_parse_index() drops it.
+
+    Parameters
+    ----------
+    node: dragonfly.grammar.state.Node
+        any node of the recognition parse tree
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    ParseIndex
+    """
+    global _PARSE_INDEX
+    if _PARSE_INDEX is None or node not in _PARSE_INDEX:
+        root = node
+        while getattr(root, 'parent', None) is not None:
+            root = root.parent
+        _PARSE_INDEX = ParseIndex(root)
+    return _PARSE_INDEX
+
+def clear_parse_index():
+    """Drop the index of the last parse tree, and the tree with it."""
+    global _PARSE_INDEX
+    _PARSE_INDEX = None
+
+def releases_parse_index(method):
+    """Decorate _process_recognition to drop the parse index after it."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        """Run method, then clear the parse index."""
+        try:
+            return method(*args, **kwargs)
+        finally:
+            clear_parse_index()
+    return wrapper
 
 def extract_values(node, types, recurse=False):
     """Return list of values from children matching types."""
+    if recurse:
+        return parse_index(node).values(node, types)
     matches = []
     for child in node.children:
         if isinstance(child.actor, types):
             matches.append(child.value())
-        if recurse:
-            matches.extend(extract_values(child, types, True))
     return matches
 
-def text_to_keystr(text):
-    """Translate string to keynames for Key."""
+_CHARNAMES = {
+    '<': 'langle',
+    '{': 'lbrace',
+    '[': 'lbracket',
+    '(': 'lparen',
+    '>': 'rangle',
+    '}': 'rbrace',
+    ']': 'rbracket',
+    ')': 'rparen',
+    '&': 'ampersand',
+    "'": 'apostrophe',
+    '*': 'asterisk',
+    '@': 'at',
+    '\\': 'backslash',
+    '`': 'backtick',
+    '|': 'bar',
+    '^': 'caret',
+    ':': 'colon',
+    ',': 'comma',
+    '$': 'dollar',
+    '.': 'dot',
+    '"': 'dquote',
+    '=': 'equal',
+    '!': 'exclamation',
+    '#': 'hash',
+    '-': 'hyphen',
+    '%': 'percent',
+    '+': 'plus',
+    '?': 'question',
+    ';': 'semicolon',
+    '/': 'slash',
+    '~': 'tilde',
+    '_': 'underscore',
+    ' ': 'space',
+    '\n': 'enter',
+    '\r\n': 'enter',
+    '\t': 'tab',
+}
+_CHARNAMES.update(
+    (character, character)
+    for character in string.lowercase + string.digits)
+_CHARNAMES.update(
+    (character, 's-{}'.format(character))
+    for character in string.uppercase)
+
+class LRUCache(object):
+
+    """
+    Bounded mapping that discards the least recently used entry.
+
+    Safe to use from several threads.
+
+    Parameters
+    ----------
+    maxsize: int
+        maximum number of entries kept
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return cached value for key and mark it as recently used."""
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def put(self, key, value):
+        """Store value, evicting the oldest entry when full."""
+        with self._lock:
+            self._data.pop(key, None)
+            if len(self._data) >= self.maxsize:
+                self._data.popitem(last=False)
+            self._data[key] = value
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+_KEYSTR_CACHE = LRUCache(maxsize=512)
+
+def text_to_keystr(text, cache=True):
+    """
+    Translate string to keynames for Key.
+
+    Translations are cached, so repeated dictation does not walk
+    the string again. Characters without a keyname are skipped
+    with a warning instead of raising; the warning does not show
+    the character, which may be part of a password.
+
+    Parameters
+    ----------
+    text: str
+        text to translate
+    cache: bool
+        look up and keep the translation in the cache, pass False
+        for secrets
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    str
+        comma separated keynames, or None if text is None
+    """
     if text is None:
         return None
-    charnames = {
-        '<': 'langle',
-        '{': 'lbrace',
-        '[': 'lbracket',
-        '(': 'lparen',
-        '>': 'rangle',
-        '}': 'rbrace',
-        ']': 'rbracket',
-        ')': 'rparen',
-        '&': 'ampersand',
-        "'": 'apostrophe',
-        '*': 'asterisk',
-        '@': 'at',
-        '\\': 'backslash',
-        '`': 'backtick',
-        '|': 'bar',
-        '^': 'caret',
-        ':': 'colon',
-        ',': 'comma',
-        '$': 'dollar',
-        '.': 'dot',
-        '"': 'dquote',
-        '=': 'equal',
-        '!': 'exclamation',
-        '#': 'hash',
-        '-': 'hyphen',
-        '%': 'percent',
-        '+': 'plus',
-        '?': 'question',
-        ';': 'semicolon',
-        '/': 'slash',
-        '~': 'tilde',
-        '_': 'underscore',
-        ' ': 'space',
-        '\n': 'enter',
-        '\r\n': 'enter',
-        '\t': 'tab',
-    }
-    for character in string.lowercase + string.digits:
-        charnames[character] = character
-    for character in string.uppercase:
-        charnames[character] = 's-{}'.format(character)
-    return ','.join(
-        [charnames[character] for character in str(text)])
+    text = str(text)
+    if cache:
+        keystr = _KEYSTR_CACHE.get(text)
+        if keystr is not None:
+            return keystr
+    keynames = []
+    skipped = 0
+    for character in text:
+        keyname = _CHARNAMES.get(character)
+        if keyname is None:
+            skipped += 1
+            continue
+        keynames.append(keyname)
+    if skipped > 0:
+        print "{} character(s) without keyname skipped".format(skipped)
+    keystr = ','.join(keynames)
+    if cache:
+        _KEYSTR_CACHE.put(text, keystr)
+    return keystr
+
+def _text_chunks(text):
+    """Yield callables typing text in chunks, converted on call."""
+    for start in range(0, len(text), stream.CHUNK_CHARACTERS):
+        part = text[start:start + stream.CHUNK_CHARACTERS]
+        yield lambda part=part: Key(text_to_keystr(part)).execute()
 
 class Text(aenea.Text):
 
-    """Text object that works with any Xdo version."""
+    """
+    Text object that works with any Xdo version.
+
+    Long text is typed in chunks by the action stream, if started.
+    """
 
     def _execute_events(self, events):
-        return Key(text_to_keystr(events[0])).execute()
+        text = events[0]
+        action_stream = stream.STREAM
+        if action_stream is not None and not action_stream.on_sender() \
+                and (len(text) > stream.CHUNK_CHARACTERS
+                     or action_stream.busy()):
+            # False makes dragonfly report the action as failed
+            return action_stream.submit(_text_chunks(text))
+        return Key(text_to_keystr(text)).execute()
 
     def __str__(self):
         return self._spec
 
+    def __reduce__(self):
+        # parsed events are not picklable, parse again instead
+        return (self.__class__, (self._spec,))
+
 class Key(aenea.Key):
 
-    """Key with useful str method."""
+    """Key with useful str method, queued behind streamed text."""
+
+    def _execute_events(self, events):
+        action_stream = stream.deferred()
+        if action_stream is not None:
+            # never refused, and "stop typing" does not drop keys
+            return action_stream.submit(
+                [lambda: aenea.Key._execute_events(self, events)],
+                cancellable=False)
+        return aenea.Key._execute_events(self, events)
 
     def __str__(self):
         return self._spec
 
+    def __reduce__(self):
+        # parsed events are not picklable, parse again instead
+        return (self.__class__, (self._spec,))
+
 def join_actions(joiner, values):
     """
     Join Action objects with a text.
@@ -144,6 +510,75 @@ def sum_actions(actions):
         result += action
     return result
 
+def _leaf_actions(action):
+    """Yield the actions of (nested) action series in execution order."""
+    children = getattr(action, '_actions', None)
+    if children is None:
+        yield action
+        return
+    for child in children:
+        for leaf in _leaf_actions(child):
+            yield leaf
+
+def _action_keystr(action):
+    """Return Key spec that types the same as action, or None."""
+    data = None
+    if isinstance(action, BoundAction):
+        data = action._data
+        action = action._action
+    if not isinstance(action, (aenea.Key, Text)):
+        return None
+    spec = action._spec
+    if data and not action._static:
+        try:
+            spec = spec % data
+        except (KeyError, TypeError, ValueError):
+            return None
+    if isinstance(action, Text):
+        return text_to_keystr(spec)
+    return spec
+
+def compile_actions(action):
+    """
+    Merge consecutive Key and Text actions into a single Key.
+
+    The merged Key is executed as one batch, which aenea sends
+    as a single request when USE_MULTIPLE_ACTIONS is enabled.
+    Any other action type is kept as is and ends the current batch.
+
+    Parameters
+    ----------
+    action: dragonfly.ActionBase
+        action or (nested) action series, e.g. from sum_actions
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    dragonfly.ActionBase
+        None if action is None
+    """
+    if action is None:
+        return None
+    compiled = []
+    keystrs = []
+    for leaf in _leaf_actions(action):
+        keystr = _action_keystr(leaf)
+        if keystr is None:
+            if len(keystrs) > 0:
+                compiled.append(Key(','.join(keystrs)))
+                keystrs = []
+            compiled.append(leaf)
+        elif keystr != '':
+            keystrs.append(keystr)
+    if len(keystrs) > 0:
+        compiled.append(Key(','.join(keystrs)))
+    if len(compiled) == 1:
+        return compiled[0]
+    return ActionSeries(*compiled)
+
 def execute_keystr(text):
     """Type out text."""
     Key(text_to_keystr(text)).execute()
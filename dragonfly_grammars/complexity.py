@@ -0,0 +1,194 @@
+"""
+Grammar complexity report.
+
+Measure how big grammars are: element count, distinct words,
+Repetition/Alternative nesting depth and a bounded estimate of
+the number of phrases each rule accepts. Dictation and list
+references count as a single phrase.
+"""
+import argparse
+from collections import namedtuple
+from dragonfly import (
+    Alternative,
+    Compound,
+    Dictation,
+    ListRef,
+    Literal,
+    Optional,
+    Repetition,
+    RuleRef,
+    Sequence)
+import dragonfly_grammars
+from dragonfly_grammars import headless
+
+# expansion estimates saturate at this value
+EXPANSION_LIMIT = 10 ** 12
+
+Complexity = namedtuple(
+    'Complexity', ['elements', 'words', 'depth', 'expansions'])
+
+def _bounded(value):
+    return min(value, EXPANSION_LIMIT)
+
+def _repetitions(expansions, minimum, maximum):
+    """Return number of sequences of minimum up to maximum phrases."""
+    total = 0
+    power = _bounded(expansions ** minimum)
+    # like dragonfly, maximum is exclusive
+    for _ in range(minimum, maximum):
+        total = _bounded(total + power)
+        power = _bounded(power * expansions)
+    return total
+
+def element_complexity(element, memo=None):
+    """
+    Measure element and everything it references.
+
+    Parameters
+    ----------
+    element: dragonfly.ElementBase
+        element to measure, e.g. rule.element
+    memo: Dict[int, Complexity]
+        results of elements measured before, keyed by id
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Complexity
+    """
+    if memo is None:
+        memo = {}
+    key = id(element)
+    if key in memo:
+        return memo[key]
+    if isinstance(element, Literal):
+        result = Complexity(1, frozenset(element.words), 0, 1)
+    elif isinstance(element, RuleRef):
+        child = element_complexity(element.rule.element, memo)
+        result = child._replace(elements=child.elements + 1)
+    elif isinstance(element, ListRef):
+        words = frozenset(
+            word for item in element.list for word in str(item).split())
+        result = Complexity(1, words, 0, max(1, len(element.list)))
+    elif isinstance(element, Dictation):
+        result = Complexity(1, frozenset(), 0, 1)
+    elif isinstance(element, Repetition):
+        # children are nested optionals of the same child
+        child = element_complexity(element._child, memo)
+        result = Complexity(
+            child.elements + 1,
+            child.words,
+            child.depth + 1,
+            _repetitions(child.expansions, element.min, element.max))
+    else:
+        children = [
+            element_complexity(child, memo) for child in element.children]
+        words = frozenset().union(*[child.words for child in children])
+        elements = 1 + sum(child.elements for child in children)
+        depth = max([0] + [child.depth for child in children])
+        if isinstance(element, Alternative):
+            expansions = _bounded(
+                sum(child.expansions for child in children))
+            # compounds only wrap a parsed spec
+            if not isinstance(element, Compound):
+                depth += 1
+        elif isinstance(element, Optional):
+            expansions = _bounded(children[0].expansions + 1)
+        elif isinstance(element, Sequence):
+            expansions = 1
+            for child in children:
+                expansions = _bounded(expansions * child.expansions)
+        else:
+            expansions = max([1] + [child.expansions for child in children])
+        result = Complexity(elements, words, depth, expansions)
+    memo[key] = result
+    return result
+
+def grammar_complexity(grammar):
+    """
+    Measure grammar and each of its rules.
+
+    Parameters
+    ----------
+    grammar: dragonfly.Grammar
+        loaded grammar, so dependencies are included
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Tuple[Complexity, List[Tuple[dragonfly.Rule, Complexity]]]
+        totals (expansions of exported rules only), per rule
+    """
+    memo = {}
+    rules = [
+        (rule, element_complexity(rule.element, memo))
+        for rule in grammar.rules]
+    total = Complexity(
+        sum(result.elements for _rule, result in rules),
+        frozenset().union(*[result.words for _rule, result in rules]),
+        max([0] + [result.depth for _rule, result in rules]),
+        _bounded(sum(
+            result.expansions for rule, result in rules if rule.exported)))
+    return total, rules
+
+def _format_row(name, result):
+    expansions = str(result.expansions)
+    if result.expansions >= EXPANSION_LIMIT:
+        expansions = '>=' + expansions
+    return "{:<45} {:>9} {:>7} {:>6} {:>16}".format(
+        name, result.elements, len(result.words), result.depth, expansions)
+
+def main():
+    """
+    Print complexity report from the command line.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    engine = headless.install()
+    modules = dict(
+        (module.__name__.rsplit('.', 1)[-1], module)
+        for module in dragonfly_grammars.grammar_modules())
+    parser = argparse.ArgumentParser(
+        prog="grammarcomplexity",
+        description="report grammar size and complexity")
+    parser.add_argument(
+        '--language',
+        action='append',
+        choices=headless.LANGUAGES,
+        help="profile language (default: all)")
+    parser.add_argument(
+        '--module',
+        action='append',
+        choices=sorted(modules),
+        help="grammar module (default: all)")
+    arguments = parser.parse_args()
+    for language in arguments.language or headless.LANGUAGES:
+        headless.use_language(language)
+        for name in arguments.module or sorted(modules):
+            module = modules[name]
+            module.load()
+            for grammar in headless.module_grammars(module):
+                total, rules = grammar_complexity(grammar)
+                print "{} grammar {} ({} compiled bytes)".format(
+                    language,
+                    grammar.name,
+                    engine.compiled_sizes.get(grammar.name, '?'))
+                print "{:<45} {:>9} {:>7} {:>6} {:>16}".format(
+                    'rule', 'elements', 'words', 'depth', 'expansions')
+                for rule, result in rules:
+                    print _format_row(rule.name, result)
+                print _format_row('total', total)
+                print
+                grammar.unload()
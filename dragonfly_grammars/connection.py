@@ -0,0 +1,424 @@
+"""
+Persistent connections to the aenea server.
+
+aenea sends every key press, text and context query as a JSON-RPC
+request over a new HTTP connection. The pool keeps connections to
+the active server open and reuses them, and connects ahead of
+time on a background thread after a server change, so an
+unreachable server does not hold up recognition. Time spent
+connecting is reported separately from time spent on requests.
+
+A server that speaks HTTP/1.0, like the stock aenea server, closes
+the connection after every response. Such connections are not kept,
+and idle connections the server closed are dropped before use, so
+every new connection counts as a connect. A request on a reused
+connection is only sent again when it failed before any byte of a
+response arrived, and never after a timeout.
+
+StandInServer in tests/stand_ins.py is a local JSON-RPC server that
+answers every method, to try the pool without an aenea server.
+"""
+import Queue
+import errno
+import httplib
+import itertools
+import json
+import select
+import socket
+import threading
+import time
+import aenea.communications
+import aenea.config
+from dragonfly_grammars import latency
+
+class RPCError(Exception):
+
+    """Server answered a request with an error."""
+
+class _Unanswered(Exception):
+
+    """Request failed before any byte of a response arrived."""
+
+    def __init__(self, error):
+        Exception.__init__(self, error)
+        self.error = error
+
+# errors of sending on a connection the server closed
+_CLOSED_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+def _closed_by_server(connection):
+    """Return whether the server closed an idle connection."""
+    sock = connection.sock
+    if sock is None:
+        return True
+    try:
+        readable, _writable, _errors = select.select([sock], [], [], 0)
+    except (select.error, socket.error):
+        return True
+    # nothing is due on an idle connection, so data means end of file,
+    # a reset or a stray response, none of which leave it usable
+    return len(readable) > 0
+
+class ConnectionPool(object):
+
+    """
+    Reusable HTTP connections to a JSON-RPC server.
+
+    Parameters
+    ----------
+    address: Tuple[str, int]
+        host and port of the server
+    size: int
+        number of idle connections kept open
+    timeout: float
+        socket timeout in seconds
+    """
+
+    def __init__(self, address, size=2, timeout=2.0):
+        self.address = address
+        self.size = size
+        self.timeout = timeout
+        self.connects = 0
+        self.connect_seconds = 0.0
+        self.requests = 0
+        self.request_seconds = 0.0
+        self.reconnects = 0
+        self.closed = 0
+        self._idle = Queue.LifoQueue()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _connect(self, address=None):
+        if address is None:
+            address = self.address
+        start = time.time()
+        connection = httplib.HTTPConnection(
+            address[0], address[1], timeout=self.timeout)
+        connection.connect()
+        # headers and body are sent separately, do not wait for acks
+        connection.sock.setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self._lock:
+            self.connects += 1
+            self.connect_seconds += time.time() - start
+        return connection
+
+    def _acquire(self):
+        """Return a connection and whether it was idle."""
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except Queue.Empty:
+                return self._connect(), False
+            if not _closed_by_server(connection):
+                return connection, True
+            connection.close()
+            with self._lock:
+                self.closed += 1
+
+    def _release(self, connection):
+        # httplib closes connections the response says will close
+        if connection.sock is None or \
+                connection.host != self.address[0] or \
+                connection.port != self.address[1] or \
+                self._idle.qsize() >= self.size:
+            connection.close()
+        else:
+            self._idle.put(connection)
+
+    def prewarm(self):
+        """Open connections up to size ahead of use, waits for them."""
+        address = self.address
+        try:
+            while self._idle.qsize() < self.size:
+                connection = self._connect(address)
+                if address != self.address or \
+                        self._idle.qsize() >= self.size:
+                    # the server changed, or requests filled the pool
+                    connection.close()
+                    return
+                self._idle.put(connection)
+        except socket.error as error:
+            print 'connection pool: cannot connect to {}:{}: {}'.format(
+                address[0], address[1], error)
+
+    def prewarm_later(self):
+        """Run prewarm on a background thread, return the thread."""
+        thread = threading.Thread(
+            target=self.prewarm, name='connection_prewarm')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def change_address(self, address):
+        """Close connections and connect to a different server ahead."""
+        self.address = address
+        self.close()
+        self.prewarm_later()
+
+    def close(self):
+        """Close idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Queue.Empty:
+                return
+
+    def _request(self, connection, body):
+        """Return response data, raise _Unanswered if none arrived."""
+        try:
+            connection.request(
+                'POST', '/', body, {'Content-Type': 'application/json'})
+        except socket.timeout:
+            raise
+        except socket.error as error:
+            if error.errno in _CLOSED_ERRNOS:
+                raise _Unanswered(error)
+            raise
+        try:
+            response = connection.getresponse()
+        except httplib.BadStatusLine as error:
+            # the message for an empty status line differs between
+            # python 2.7 releases
+            if error.line in ('', "''") or error.line.startswith(
+                    'No status line'):
+                raise _Unanswered(error)
+            raise
+        data = response.read()
+        if response.status != 200:
+            raise RPCError('HTTP {} {}'.format(
+                response.status, response.reason))
+        return data
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call method on the server.
+
+        Parameters
+        ----------
+        method: str
+            name of remote method, e.g. key_press
+        args: List[Any]
+            positional parameters
+        kwargs: Dict[str, Any]
+            named parameters, JSON-RPC allows no positional ones then
+
+        Raises
+        ------
+        RPCError
+            if the server returned an error
+        socket.error
+            if the server can not be reached or did not answer in time
+        httplib.HTTPException
+            if the server sent no valid response
+
+        Returns
+        -------
+        Any
+        """
+        body = json.dumps({
+            'jsonrpc': '2.0',
+            'method': method,
+            'params': kwargs if len(kwargs) > 0 else list(args),
+            'id': next(self._ids)})
+        connection, reused = self._acquire()
+        start = time.time()
+        try:
+            data = self._request(connection, body)
+        except _Unanswered as unanswered:
+            connection.close()
+            if not reused:
+                raise unanswered.error
+            # the server closed the idle connection while it was
+            # handed out, nothing was answered, try a fresh one
+            with self._lock:
+                self.reconnects += 1
+            connection = self._connect()
+            start = time.time()
+            try:
+                data = self._request(connection, body)
+            except _Unanswered as unanswered:
+                connection.close()
+                raise unanswered.error
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+                raise
+        except (socket.error, httplib.HTTPException):
+            connection.close()
+            raise
+        duration = time.time() - start
+        with self._lock:
+            self.requests += 1
+            self.request_seconds += duration
+        latency.record_current('transport', duration)
+        self._release(connection)
+        response = json.loads(data)
+        if response.get('error') is not None:
+            raise RPCError(response['error'])
+        return response.get('result')
+
+    def report(self):
+        """Return connection and request times as text."""
+        return (
+            '{} connects in {:.1f} ms ({} reconnects, {} closed by '
+            'server), {} requests in {:.1f} ms').format(
+                self.connects,
+                self.connect_seconds * 1000,
+                self.reconnects,
+                self.closed,
+                self.requests,
+                self.request_seconds * 1000)
+
+class PooledServerProxy(object):
+
+    """Stand-in for a jsonrpclib server proxy that calls through a pool."""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *args, **kwargs: self._pool.call(
+            method, *args, **kwargs)
+
+class LocalProxy(object):
+
+    """
+    Stand-in for a jsonrpclib server proxy that answers in-process.
+
+    Parameters
+    ----------
+    results: Dict[str, Any]
+        result by method name, e.g. {'get_context': {...}}, others
+        return None
+    """
+
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.calls = []
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        def call(*args, **kwargs):
+            self.calls.append((method, kwargs if len(kwargs) > 0 else args))
+            return self.results.get(method)
+        return call
+
+POOL = None
+_ORIGINAL = None
+
+def _supported(server):
+    """
+    Return whether aenea's server proxy has the known layout.
+
+    aenea has no version to check, so the private transport of its
+    Proxy is only replaced when it is a jsonrpclib server proxy, or
+    one of ours.
+    """
+    try:
+        from jsonrpclib.jsonrpc import ServerProxy
+    except ImportError:
+        return False
+    # pylint: disable=protected-access
+    return type(server) is getattr(aenea.communications, 'Proxy', None) \
+        and isinstance(getattr(server, '_server', None), (
+            ServerProxy, PooledServerProxy, LocalProxy))
+
+def _swap(proxy):
+    """Replace aenea's transport with proxy, return False if unsupported."""
+    global _ORIGINAL
+    server = getattr(aenea.communications, 'server', None)
+    if not _supported(server):
+        print 'connection pool: unsupported aenea version, not installed'
+        return False
+    # pylint: disable=protected-access
+    if not isinstance(server._server, (PooledServerProxy, LocalProxy)):
+        _ORIGINAL = server._server
+    server._server = proxy
+    return True
+
+def install(address=None):
+    """
+    Send aenea requests through a connection pool.
+
+    Parameters
+    ----------
+    address: Tuple[str, int]
+        server address, defaults to the aenea server
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    ConnectionPool
+        None if aenea's server proxy can not be replaced
+    """
+    global POOL
+    server = getattr(aenea.communications, 'server', None)
+    if not _supported(server):
+        print 'connection pool: unsupported aenea version, not installed'
+        return None
+    if address is None:
+        address = getattr(
+            server, '_address', aenea.config.DEFAULT_SERVER_ADDRESS)
+    if POOL is None:
+        POOL = ConnectionPool(address)
+    POOL.change_address(address)
+    _swap(PooledServerProxy(POOL))
+    return POOL
+
+def install_local(results=None):
+    """
+    Answer aenea requests in-process, e.g. to replay recognitions.
+
+    Parameters
+    ----------
+    results: Dict[str, Any]
+        result by method name, see LocalProxy
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    LocalProxy
+        None if aenea's server proxy can not be replaced
+    """
+    uninstall()
+    proxy = LocalProxy(results)
+    if not _swap(proxy):
+        return None
+    return proxy
+
+def change_address(address):
+    """Follow an aenea server change, if installed."""
+    if POOL is not None:
+        install(address)
+
+def uninstall():
+    """Close pooled connections and give aenea its own transport back."""
+    global POOL, _ORIGINAL
+    if POOL is not None:
+        POOL.close()
+        POOL = None
+    server = getattr(aenea.communications, 'server', None)
+    # pylint: disable=protected-access
+    if server is not None and isinstance(
+            getattr(server, '_server', None),
+            (PooledServerProxy, LocalProxy)):
+        server._server = _ORIGINAL
+    _ORIGINAL = None
+
+def start_feature(options, language, grammars):
+    """Install the pool if options.pooled_connections, see load_grammars."""
+    if options.pooled_connections:
+        install()
+
+def stop_feature(grammars):
+    """Uninstall the pool, see unload_grammars."""
+    uninstall()
@@ -4,8 +4,191 @@
 Context generators
 
 Easily generate context instances.
+
+Proxy window contexts match against a snapshot of the proxy's
+foreground window, which is fetched once per utterance and shared
+by the contexts of all grammars.
 """
-from aenea import AppContext, ProxyAppContext, ProxyPlatformContext
+import time
+from dragonfly import Context, RecognitionObserver, get_engine
+import aenea.config
+import aenea.proxy_contexts
+from aenea import AppContext
+
+class WindowSnapshot(object):
+
+    """
+    Proxy foreground window properties, shared within an utterance.
+
+    Every grammar evaluates its context at recognition begin with
+    the same local window, so a snapshot taken for that window is
+    reused for the whole utterance. While observing (see observe)
+    the snapshot is invalidated when an utterance begins, otherwise
+    it is reused until it is older than ttl. While a focus
+    subscription (see focus) has a connection, its window state is
+    used instead.
+
+    Parameters
+    ----------
+    ttl: float
+        seconds a snapshot is reused for the same local window
+    """
+
+    def __init__(self, ttl=0.2):
+        self.ttl = ttl
+        self.fetches = 0
+        self.saved = 0
+        self._key = None
+        self._time = 0
+        self._properties = None
+        self._pinned = None
+        self.subscription = None
+        self.observer = None
+
+    def get(self, executable, title, handle):
+        """
+        Return proxy window properties, None if the proxy is disabled.
+
+        Parameters
+        ----------
+        executable: str
+            local foreground executable
+        title: str
+            local foreground window title
+        handle: int
+            local foreground window handle
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        Dict[str, str]
+        """
+        if self._pinned is not None:
+            return self._pinned
+        if not aenea.config.proxy_active():
+            return None
+        if self.subscription is not None:
+            properties = self.subscription.properties
+            if properties is not None:
+                self.saved += 1
+                return properties
+        key = (executable, title, handle)
+        now = time.time()
+        if key == self._key and (
+                self.observer is not None or now - self._time < self.ttl):
+            self.saved += 1
+            return self._properties
+        self.fetches += 1
+        # pylint: disable=protected-access
+        self._properties = aenea.proxy_contexts._get_context() or {}
+        self._key = key
+        self._time = now
+        return self._properties
+
+    def invalidate(self):
+        """Fetch again on next use."""
+        self._key = None
+
+    def observe(self, enabled=True):
+        """
+        Invalidate the snapshot whenever an utterance begins.
+
+        Call this before loading grammars, so the observer's begin
+        callback comes before their contexts are evaluated. Engines
+        without recognition observers keep using ttl.
+
+        Parameters
+        ----------
+        enabled: bool
+            False to stop observing and use ttl again
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        None
+        """
+        if self.observer is not None:
+            self.observer.unregister()
+            self.observer = None
+        if enabled and hasattr(
+                get_engine(), 'register_recognition_observer'):
+            self.observer = _SnapshotObserver(self)
+            self.observer.register()
+
+    def pin(self, properties):
+        """
+        Use properties instead of the proxy, e.g. for benchmarks.
+
+        Parameters
+        ----------
+        properties: Dict[str, str]
+            proxy window properties, None to use the proxy again
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self._pinned = properties
+
+class _SnapshotObserver(RecognitionObserver):
+
+    """Invalidate a window snapshot when an utterance begins."""
+
+    def __init__(self, snapshot):
+        RecognitionObserver.__init__(self)
+        self.snapshot = snapshot
+
+    def on_begin(self):
+        self.snapshot.invalidate()
+
+SNAPSHOT = WindowSnapshot()
+
+class ProxySnapshotContext(Context):
+
+    """
+    Case insensitive substring match on the proxy window snapshot.
+
+    Parameters
+    ----------
+    title: str
+        part of window title
+    cls: str
+        part of window class
+    executable: str
+        part of executable name
+    platform: str
+        part of proxy platform, e.g. linux
+    """
+
+    def __init__(self, title=None, cls=None, executable=None, platform=None):
+        Context.__init__(self)
+        self.query = dict(
+            (key, value.lower()) for key, value in (
+                ('title', title), ('cls', cls), ('executable', executable),
+                ('platform', platform))
+            if value is not None)
+        self._str = ', '.join(
+            '{}={!r}'.format(key, value)
+            for key, value in sorted(self.query.iteritems()))
+
+    def matches(self, executable, title, handle):
+        properties = SNAPSHOT.get(executable, title, handle)
+        if properties is None:
+            return False
+        for key, value in self.query.iteritems():
+            if value not in (properties.get(key) or '').lower():
+                return False
+        return True
 
 def linux():
     """
@@ -17,7 +200,7 @@ def linux():
 
     Returns
     -------
-    aenea.ProxyPlatformContext
+    ProxySnapshotContext
 
     Examples
     --------
@@ -25,7 +208,7 @@ def linux():
 
         >>> TODO
     """
-    return ProxyPlatformContext('linux')
+    return ProxySnapshotContext(platform='linux')
 
 def cross_platform_title_match(title):
     """
@@ -51,7 +234,7 @@ def cross_platform_title_match(title):
         >>> TODO
     """
     return AppContext(title=title) | \
-            ProxyAppContext(title=title)
+            ProxySnapshotContext(title=title)
 
 def terminal():
     """
@@ -75,7 +258,7 @@ def terminal():
         LogicOrContext(...)
     """
     return AppContext('putty') | \
-            ProxyAppContext(cls='terminator')
+            ProxySnapshotContext(cls='terminator')
 
 def true_vim():
     """
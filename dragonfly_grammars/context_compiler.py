@@ -0,0 +1,314 @@
+"""
+Compiled grammar contexts.
+
+The contexts of all grammars are compiled into one table of
+substring predicates and a graph of logic nodes, in which equal
+subexpressions (e.g. terminal() in every vim context) are shared.
+Per utterance every window property is scanned by a single regular
+expression that finds all predicate patterns at once, and every
+logic node is evaluated once.
+
+Contexts other than logic, app and proxy snapshot contexts are
+kept as they are and evaluated with their own matches().
+"""
+import re
+from dragonfly.grammar.context import (
+    AppContext,
+    Context,
+    LogicAndContext,
+    LogicNotContext,
+    LogicOrContext)
+from dragonfly_grammars.context import SNAPSHOT, ProxySnapshotContext
+
+LOCAL = 'local'
+PROXY = 'proxy'
+
+def _pattern_matcher(patterns):
+    """
+    Return function that finds which patterns occur in a text.
+
+    Every pattern is a lookahead from the start of the text, so a
+    single match reports all of them, overlapping or not.
+    """
+    regex = re.compile(
+        ''.join('(?=.*?({}))?'.format(re.escape(pattern))
+                for pattern in patterns),
+        re.DOTALL)
+
+    def find(text):
+        """Return indices of patterns in text."""
+        return [
+            index for index, group in enumerate(regex.match(text).groups())
+            if group is not None]
+    return find
+
+def _lower_list(value):
+    if value is None:
+        return []
+    if isinstance(value, basestring):
+        return [value.lower()]
+    return [item.lower() for item in value]
+
+class CompiledContexts(object):
+
+    """
+    Contexts of grammars compiled for evaluation in one pass.
+
+    Nodes are tuples, children are node ids, and children are
+    always added before their parents:
+
+    * ('true',)
+    * ('proxy',): proxy is active
+    * ('pred', source, field, pattern): case insensitive substring
+    * ('and', ids), ('or', ids), ('not', id)
+    * ('opaque', index): context in opaque, evaluated as is
+
+    Parameters
+    ----------
+    grammars: List[dragonfly.Grammar]
+        grammars whose contexts to compile
+    """
+
+    def __init__(self, grammars):
+        self.grammars = list(grammars)
+        self.nodes = []
+        self.opaque = []
+        self._node_ids = {}
+        # node ids of the predicates of each (source, field)
+        self._predicates = {}
+        self.roots = [
+            self.add(grammar._context)  # pylint: disable=protected-access
+            for grammar in self.grammars]
+        self._matchers = []
+        for (source, field), node_ids in sorted(
+                self._predicates.iteritems()):
+            self._matchers.append((
+                source,
+                field,
+                node_ids,
+                _pattern_matcher([self.nodes[i][3] for i in node_ids])))
+        self._uses_proxy = any(node[0] == 'proxy' for node in self.nodes)
+        self._last_key = None
+        self._last_properties = None
+        self._last_values = None
+
+    def _node(self, node):
+        node_id = self._node_ids.get(node)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.nodes.append(node)
+            self._node_ids[node] = node_id
+            if node[0] == 'pred':
+                self._predicates.setdefault(
+                    (node[1], node[2]), []).append(node_id)
+        return node_id
+
+    def _logic(self, operator, children):
+        # and/or are commutative, so sorting shares reordered copies
+        children = tuple(sorted(set(children)))
+        if len(children) == 1:
+            return children[0]
+        return self._node((operator, children))
+
+    def _predicates_or(self, source, field, patterns):
+        return self._logic('or', [
+            self._node(('pred', source, field, pattern))
+            for pattern in patterns])
+
+    def add(self, context):
+        """
+        Compile context and return its node id.
+
+        Parameters
+        ----------
+        context: dragonfly.Context
+            context to compile, None for always
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        int
+        """
+        # pylint: disable=protected-access
+        if context is None:
+            return self._node(('true',))
+        if isinstance(context, CompiledContext):
+            return self.add(context.original)
+        if isinstance(context, LogicAndContext):
+            return self._logic(
+                'and', [self.add(child) for child in context._children])
+        if isinstance(context, LogicOrContext):
+            return self._logic(
+                'or', [self.add(child) for child in context._children])
+        if isinstance(context, LogicNotContext):
+            return self._node(('not', self.add(context._child)))
+        if isinstance(context, ProxySnapshotContext):
+            return self._logic('and', [self._node(('proxy',))] + [
+                self._node(('pred', PROXY, field, pattern))
+                for field, pattern in context.query.iteritems()])
+        if type(context) is AppContext and not getattr(
+                context, '_kwargs', None):
+            conditions = []
+            for field, patterns in (
+                    ('executable', _lower_list(context._executable)),
+                    ('title', _lower_list(context._title))):
+                if len(patterns) > 0:
+                    condition = self._predicates_or(LOCAL, field, patterns)
+                    if context._exclude:
+                        condition = self._node(('not', condition))
+                    conditions.append(condition)
+            if len(conditions) == 0:
+                return self._node(('true',))
+            return self._logic('and', conditions)
+        self.opaque.append(context)
+        return self._node(('opaque', len(self.opaque) - 1))
+
+    def evaluate(self, executable, title, handle):
+        """
+        Evaluate every node for a window.
+
+        Parameters
+        ----------
+        executable: str
+            local foreground executable
+        title: str
+            local foreground window title
+        handle: int
+            local foreground window handle
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        List[bool]
+            value per node id
+        """
+        properties = None
+        if self._uses_proxy:
+            properties = SNAPSHOT.get(executable, title, handle)
+        key = (executable, title, handle)
+        if key == self._last_key and properties is self._last_properties:
+            return self._last_values
+        texts = {
+            (LOCAL, 'executable'): (executable or '').lower(),
+            (LOCAL, 'title'): (title or '').lower()}
+        found = set()
+        for source, field, node_ids, find in self._matchers:
+            if source == LOCAL:
+                text = texts[(source, field)]
+            elif properties is None:
+                continue
+            else:
+                text = (properties.get(field) or '').lower()
+            found.update(node_ids[index] for index in find(text))
+        values = []
+        for node_id, node in enumerate(self.nodes):
+            kind = node[0]
+            if kind == 'pred':
+                value = node_id in found
+            elif kind == 'and':
+                value = all(values[child] for child in node[1])
+            elif kind == 'or':
+                value = any(values[child] for child in node[1])
+            elif kind == 'not':
+                value = not values[node[1]]
+            elif kind == 'proxy':
+                value = properties is not None
+            elif kind == 'true':
+                value = True
+            else:
+                value = self.opaque[node[1]].matches(executable, title, handle)
+            values.append(value)
+        self._last_key = key
+        self._last_properties = properties
+        self._last_values = values
+        return values
+
+    def active(self, executable, title, handle):
+        """
+        Return grammars whose context matches a window.
+
+        Parameters
+        ----------
+        executable: str
+            local foreground executable
+        title: str
+            local foreground window title
+        handle: int
+            local foreground window handle
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        List[dragonfly.Grammar]
+        """
+        values = self.evaluate(executable, title, handle)
+        return [
+            grammar for grammar, root in zip(self.grammars, self.roots)
+            if values[root]]
+
+class CompiledContext(Context):
+
+    """
+    Context of one grammar, evaluated by its CompiledContexts.
+
+    Parameters
+    ----------
+    compiled: CompiledContexts
+        compiled contexts of all grammars
+    root: int
+        node id of this context
+    original: dragonfly.Context
+        context that was compiled
+    """
+
+    def __init__(self, compiled, root, original):
+        Context.__init__(self)
+        self.compiled = compiled
+        self.root = root
+        self.original = original
+        self._str = str(original)
+
+    def matches(self, executable, title, handle):
+        return self.compiled.evaluate(executable, title, handle)[self.root]
+
+def compile_contexts(grammars):
+    """
+    Replace contexts of grammars by one compiled matcher.
+
+    Parameters
+    ----------
+    grammars: List[dragonfly.Grammar]
+        grammars whose contexts to compile
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    CompiledContexts
+    """
+    compiled = CompiledContexts(grammars)
+    for grammar, root in zip(compiled.grammars, compiled.roots):
+        # pylint: disable=protected-access
+        if grammar._context is not None:
+            grammar._context = CompiledContext(
+                compiled, root, grammar._context)
+    return compiled
+
+def start_feature(options, language, grammars):
+    """Compile contexts if options.compiled_contexts, see load_grammars."""
+    if options.compiled_contexts:
+        compile_contexts(grammars)
+
+def stop_feature(grammars):
+    """Nothing to stop, compiled contexts go with their grammars."""
@@ -0,0 +1,305 @@
+"""
+Password decryption off the recognition thread.
+
+simplecrypt stretches the passphrase with PBKDF2 for every decryption,
+which stalls the speech engine when done while processing a
+recognition. Decryption is done by a worker thread instead, and the
+plaintext is handed back to the main thread, which executes actions:
+from an engine timer when the engine has them, and otherwise at the
+start of the next utterance (see deliver).
+
+Optionally the derived keys are cached for a short time, so unlocking
+the same password again skips the key derivation. Keys are derived
+from the passphrase and the salt of a crypt text, so they are cached
+per salt, along with a tag of the passphrase to check it against.
+Expired keys are overwritten before they are dropped, which bounds
+how long the cache holds them. That does not clear them from memory:
+keys are immutable str while in use, and so are the passphrase, the
+plaintext and the key names typed for it, which stay in memory until
+python reuses it.
+"""
+import Queue
+import hmac
+import threading
+import time
+from hashlib import sha256
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+from dragonfly import get_engine
+import simplecrypt
+# pylint: disable=protected-access
+
+KEY_CACHE = None
+WORKER = None
+
+def _wipe(buf):
+    buf[:] = '\x00' * len(buf)
+
+class KeyCache(object):
+
+    """
+    Derived keys by salt, overwritten when they expire.
+
+    Parameters
+    ----------
+    ttl: float
+        seconds keys are kept after their last use
+    """
+
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _tag(hmac_key, passphrase):
+        return hmac.new(
+            str(hmac_key), simplecrypt._str_to_bytes(passphrase),
+            sha256).digest()
+
+    def get(self, passphrase, salt):
+        """
+        Return keys of passphrase and salt, None if not cached.
+
+        Parameters
+        ----------
+        passphrase: str
+            spoken passphrase
+        salt: str
+            salt of the crypt text
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        Tuple[bytearray, bytearray]
+            hmac key, cipher key
+        """
+        self.expire()
+        with self._lock:
+            entry = self._entries.get(salt)
+            if entry is None or not hmac.compare_digest(
+                    entry[0], self._tag(entry[1], passphrase)):
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry[3] = time.time() + self.ttl
+            return entry[1], entry[2]
+
+    def put(self, passphrase, salt, hmac_key, cipher_key):
+        """Cache keys of passphrase and salt."""
+        hmac_key = bytearray(hmac_key)
+        cipher_key = bytearray(cipher_key)
+        with self._lock:
+            previous = self._entries.get(salt)
+            if previous is not None:
+                _wipe(previous[1])
+                _wipe(previous[2])
+            self._entries[salt] = [
+                self._tag(hmac_key, passphrase),
+                hmac_key,
+                cipher_key,
+                time.time() + self.ttl]
+
+    def expire(self):
+        """Overwrite and drop expired keys."""
+        now = time.time()
+        with self._lock:
+            for salt, entry in self._entries.items():
+                if entry[3] <= now:
+                    _wipe(entry[1])
+                    _wipe(entry[2])
+                    del self._entries[salt]
+
+    def clear(self):
+        """Overwrite and drop all keys."""
+        with self._lock:
+            for entry in self._entries.itervalues():
+                _wipe(entry[1])
+                _wipe(entry[2])
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+def decrypt(passphrase, data, key_cache=None):
+    """
+    Decrypt simplecrypt crypt text, with keys from key_cache if given.
+
+    Parameters
+    ----------
+    passphrase: str
+        spoken passphrase
+    data: str
+        crypt text
+    key_cache: KeyCache
+        cache of derived keys
+
+    Raises
+    ------
+    simplecrypt.DecryptionException
+        if passphrase is wrong or data is damaged
+
+    Returns
+    -------
+    str
+    """
+    if key_cache is None:
+        return simplecrypt.decrypt(passphrase, data)
+    # same steps as simplecrypt.decrypt, apart from the key cache
+    simplecrypt._assert_not_unicode(data)
+    simplecrypt._assert_header_prefix(data)
+    version = simplecrypt._assert_header_version(data)
+    simplecrypt._assert_decrypt_length(data, version)
+    raw = data[simplecrypt.HEADER_LEN:]
+    salt = raw[:simplecrypt.SALT_LEN[version] // 8]
+    keys = key_cache.get(passphrase, salt)
+    if keys is None:
+        hmac_key, cipher_key = simplecrypt._expand_keys(
+            passphrase, salt, simplecrypt.EXPANSION_COUNT[version])
+    else:
+        hmac_key, cipher_key = str(keys[0]), str(keys[1])
+    digest = raw[-simplecrypt.HASH.digest_size:]
+    digest2 = simplecrypt._hmac(
+        hmac_key, data[:-simplecrypt.HASH.digest_size])
+    simplecrypt._assert_hmac(hmac_key, digest, digest2)
+    if keys is None:
+        key_cache.put(passphrase, salt, hmac_key, cipher_key)
+    counter = Counter.new(
+        simplecrypt.HALF_BLOCK,
+        prefix=salt[:simplecrypt.HALF_BLOCK // 8])
+    cipher = AES.new(cipher_key, AES.MODE_CTR, counter=counter)
+    return cipher.decrypt(
+        raw[simplecrypt.SALT_LEN[version] // 8:
+            -simplecrypt.HASH.digest_size])
+
+class DecryptionWorker(object):
+
+    """
+    Thread that decrypts, plaintexts are handed to callbacks by deliver.
+
+    While idle it expires KEY_CACHE, so keys are overwritten even when
+    no password is unlocked anymore. Create it on the main thread.
+    """
+
+    # seconds between expiry checks while idle
+    idle_interval = 1.0
+    # seconds between checks for plaintexts to deliver
+    deliver_interval = 0.05
+
+    def __init__(self):
+        self._jobs = Queue.Queue()
+        self._done = Queue.Queue()
+        self._timer = None
+        engine = get_engine()
+        if hasattr(engine, 'create_timer'):
+            self._timer = engine.create_timer(
+                self.deliver, self.deliver_interval)
+        self._thread = threading.Thread(
+            target=self._run, name='decryption_worker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, passphrase, data, callback):
+        """
+        Decrypt data and call callback with the plaintext.
+
+        Parameters
+        ----------
+        passphrase: str
+            spoken passphrase
+        data: str
+            crypt text
+        callback: Callable[[str], None]
+            called on the main thread, see deliver
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        None
+        """
+        self._jobs.put((passphrase, data, callback))
+
+    def _run(self):
+        while True:
+            try:
+                job = self._jobs.get(timeout=self.idle_interval)
+            except Queue.Empty:
+                key_cache = KEY_CACHE
+                if key_cache is not None:
+                    key_cache.expire()
+                continue
+            passphrase, data, callback = job
+            try:
+                plaintext = decrypt(passphrase, data, KEY_CACHE)
+            except simplecrypt.DecryptionException:
+                print "incorrect passphrase"
+                continue
+            except Exception as error:  # pylint: disable=broad-except
+                # e.g. simplecrypt refuses an empty passphrase
+                print "could not decrypt password: {}".format(error)
+                continue
+            self._done.put((callback, plaintext))
+
+    def deliver(self):
+        """Call callbacks of decrypted jobs, call from the main thread only."""
+        while True:
+            try:
+                callback, plaintext = self._done.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                callback(plaintext)
+            except Exception as error:  # pylint: disable=broad-except
+                # a traceback could show the plaintext
+                print "could not use password: {}".format(
+                    type(error).__name__)
+
+def submit(passphrase, data, callback):
+    """Decrypt on the shared worker, see DecryptionWorker.submit."""
+    global WORKER
+    if WORKER is None:
+        WORKER = DecryptionWorker()
+    WORKER.submit(passphrase, data, callback)
+
+def deliver():
+    """Deliver decrypted passwords, see DecryptionWorker.deliver."""
+    if WORKER is not None:
+        WORKER.deliver()
+
+def use_key_cache(ttl):
+    """
+    Cache derived keys for ttl seconds, 0 or None to stop.
+
+    Parameters
+    ----------
+    ttl: float
+        seconds keys are kept after their last use
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    global KEY_CACHE
+    if KEY_CACHE is not None:
+        KEY_CACHE.clear()
+    KEY_CACHE = KeyCache(ttl) if ttl else None
+
+def start_feature(options, language, grammars):
+    """Cache keys for options.password_key_ttl, see load_grammars."""
+    use_key_cache(options.password_key_ttl)
+
+def stop_feature(grammars):
+    """Overwrite and drop cached keys, see unload_grammars."""
+    use_key_cache(None)
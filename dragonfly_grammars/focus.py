@@ -0,0 +1,220 @@
+"""
+Focus events pushed by the proxy.
+
+Instead of asking the aenea server for the window state at the start
+of every utterance, subscribe to focus and title change events and
+keep the window state locally. Contexts then evaluate without any
+network round trip (see context.WindowSnapshot).
+
+Events are newline delimited json objects:
+
+* {"event": "focus", "window": {"title": ..., "cls": ..., ...}}
+  replaces the window state
+* {"event": "title", "title": ...} updates the title only
+
+FocusEventServer in tests/stand_ins.py emits these events, it stands
+in for the proxy side, e.g. to try subscriptions without a proxy.
+"""
+import json
+import socket
+import threading
+import aenea.config
+from dragonfly_grammars.context import SNAPSHOT
+
+FOCUS_PORT = 8241
+# bytes of an incomplete event, a longer one drops the connection
+MAX_EVENT_BYTES = 64 * 1024
+
+class FocusSubscription(object):
+
+    """
+    Window state kept up to date by focus events.
+
+    Parameters
+    ----------
+    address: Tuple[str, int]
+        host and port of the focus event server
+    reconnect_delay: float
+        seconds between connection attempts
+    """
+
+    # seconds a blocking receive waits before checking for stop
+    poll_interval = 0.5
+
+    def __init__(self, address, reconnect_delay=1.0):
+        self.address = address
+        self.reconnect_delay = reconnect_delay
+        # None while there is no connection, so the state is not
+        # trusted and contexts fetch it from the proxy instead
+        self.properties = None
+        self.events = 0
+        self._socket = None
+        # a disconnect starts a new generation, events received on
+        # the connection of an older one are dropped
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='focus_subscription')
+        self._thread.daemon = True
+
+    def start(self):
+        """Connect in the background."""
+        self._thread.start()
+
+    def stop(self):
+        """Disconnect and stop."""
+        self._stop.set()
+        self._disconnect()
+        self._thread.join(self.poll_interval * 2)
+
+    def change_address(self, address):
+        """Reconnect to a different focus event server."""
+        with self._lock:
+            self.address = address
+        self._disconnect()
+
+    def _disconnect(self):
+        with self._lock:
+            self._generation += 1
+            self.properties = None
+        sock = self._socket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                address = self.address
+                generation = self._generation
+            try:
+                self._socket = socket.create_connection(
+                    address, self.reconnect_delay)
+            except socket.error:
+                self._stop.wait(self.reconnect_delay)
+                continue
+            try:
+                self._socket.settimeout(self.poll_interval)
+                self._receive(self._socket, generation)
+            except socket.error:
+                pass
+            finally:
+                with self._lock:
+                    if generation == self._generation:
+                        self.properties = None
+                self._socket.close()
+                self._socket = None
+
+    def _receive(self, sock, generation):
+        buffered = ''
+        while not self._stop.is_set():
+            try:
+                data = sock.recv(4096)
+            except socket.timeout:
+                continue
+            if data == '':
+                return
+            buffered += data
+            lines = buffered.split('\n')
+            buffered = lines.pop()
+            for line in lines + [buffered]:
+                if len(line) > MAX_EVENT_BYTES:
+                    print 'focus subscription: event too long, reconnecting'
+                    return
+            for line in lines:
+                self.handle(line, generation)
+
+    def handle(self, line, generation=None):
+        """
+        Apply one event to the window state.
+
+        Parameters
+        ----------
+        line: str
+            json encoded event
+        generation: int
+            generation of the connection the event was received on,
+            None for the current one
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        None
+        """
+        try:
+            event = json.loads(line)
+        except ValueError:
+            print 'focus subscription: ignoring malformed event'
+            return
+        kind = event.get('event')
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if kind == 'focus':
+                # replaced as a whole, readers never see a partial update
+                self.properties = dict(event.get('window', {}))
+            elif kind == 'title' and self.properties is not None:
+                properties = dict(self.properties)
+                properties['title'] = event.get('title', '')
+                self.properties = properties
+            else:
+                return
+            self.events += 1
+
+SUBSCRIPTION = None
+
+def subscribe(port=FOCUS_PORT, host=None):
+    """
+    Keep window state from focus events for all contexts.
+
+    Parameters
+    ----------
+    port: int
+        port of the focus event server
+    host: str
+        host of the focus event server, defaults to the aenea server
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    FocusSubscription
+    """
+    global SUBSCRIPTION
+    unsubscribe()
+    if host is None:
+        host = aenea.config.DEFAULT_SERVER_ADDRESS[0]
+    SUBSCRIPTION = FocusSubscription((host, port))
+    SUBSCRIPTION.start()
+    SNAPSHOT.subscription = SUBSCRIPTION
+    return SUBSCRIPTION
+
+def unsubscribe():
+    """Stop focus events, contexts fetch the window state again."""
+    global SUBSCRIPTION
+    if SUBSCRIPTION is not None:
+        SNAPSHOT.subscription = None
+        SUBSCRIPTION.stop()
+        SUBSCRIPTION = None
+
+def start_feature(options, language, grammars):
+    """Subscribe to options.focus_port if set, see load_grammars."""
+    if options.focus_port is not None:
+        subscribe(options.focus_port)
+
+def stop_feature(grammars):
+    """Unsubscribe, see unload_grammars."""
+    unsubscribe()
+
+def change_host(host):
+    """Follow an aenea server change, if subscribed."""
+    if SUBSCRIPTION is not None:
+        SUBSCRIPTION.change_address((host, SUBSCRIPTION.address[1]))
@@ -0,0 +1,123 @@
+"""
+Dictation formatters.
+
+Each format is a function of dictated text, looked up by name once
+per utterance. Formats registered with a spoken form are offered by
+DictationRule next to the built-in ones:
+
+    formatting.register('screaming', lambda text: text.upper() + '!',
+                        spoken='scream')
+"""
+from operator import methodcaller
+
+_LOWER = methodcaller('lower')
+_UPPER = methodcaller('upper')
+FORMATTERS = {}
+# spoken form by format name, of formats added with register()
+SPOKEN_FORMATS = {}
+
+def register(name, formatter, spoken=None):
+    """
+    Add or replace a format.
+
+    Parameters
+    ----------
+    name: str
+        format name, e.g. kebab
+    formatter: Callable[[str], str]
+        returns formatted text of dictated words separated by spaces
+    spoken: str
+        spoken form for DictationRule, rules built before
+        registering do not offer it
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    FORMATTERS[name] = formatter
+    if spoken is not None:
+        SPOKEN_FORMATS[name] = spoken
+
+def cache_key():
+    """Return text identifying the spoken formats, for the grammar cache."""
+    return repr(sorted(SPOKEN_FORMATS.items()))
+
+def _joined(joiner, transform):
+    """Return formatter joining transformed text with joiner."""
+    def formatter(text):
+        """Format text."""
+        return transform(text).replace(' ', joiner)
+    return formatter
+
+def _camel(text):
+    return ''.join([word.capitalize() for word in text.split(' ')])
+
+def _mixed(text):
+    first, _space, rest = text.partition(' ')
+    return first.lower() + _camel(rest)
+
+def _sentence(text):
+    return text[:1].upper() + text[1:]
+
+def _raw(text):
+    return text
+
+register('snake', _joined('_', _LOWER))  # snake_case
+register('camel', _camel)  # CamelCase
+register('mixed', _mixed)  # mixedCase
+register('upper', _joined('_', _UPPER))  # UPPERCASE_STUFF
+register('nocase', _LOWER)  # lowercase text
+register('sentence', _sentence)  # Cap first letter
+register('raw', _raw)  # raw dictation
+register('kebab', _joined('-', _LOWER))  # kebab-case
+register('dotted', _joined('.', _LOWER))  # dotted.name
+register('path', _joined('/', _LOWER))  # path/to/file
+
+def format_text(name, text):
+    """
+    Format dictated text.
+
+    Parameters
+    ----------
+    name: str
+        format name
+    text: str
+        dictated words separated by spaces
+
+    Raises
+    ------
+    KeyError
+        if there is no such format
+
+    Returns
+    -------
+    str
+    """
+    return FORMATTERS[name](text)
+
+def format_batch(name, texts):
+    """
+    Format many dictated texts with one format.
+
+    Parameters
+    ----------
+    name: str
+        format name
+    texts: List[str]
+        dictated words separated by spaces
+
+    Raises
+    ------
+    KeyError
+        if there is no such format
+
+    Returns
+    -------
+    List[str]
+    """
+    formatter = FORMATTERS[name]
+    return [formatter(text) for text in texts]
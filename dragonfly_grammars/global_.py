@@ -9,13 +9,21 @@ from aenea import (
     Choice,
     Repetition,
     IntegerRef,
-    Dictation)
+    Dictation,
+    Function)
+from dragonfly_grammars import stream
 from dragonfly_grammars.common import (
     _,
     extract_values,
+    parse_index,
+    releases_parse_index,
     Text,
     Key,
-    sum_actions)
+    sum_actions,
+    compile_actions)
+from dragonfly_grammars.formatting import FORMATTERS, SPOKEN_FORMATS
+from dragonfly_grammars.interning import intern_rule, scope
+from dragonfly_grammars.latency import dump_now, execute_timed, timed
 
 class Symbol(MappingRule):
 
@@ -132,12 +140,13 @@ class UppercaseCharacter(CompoundRule):
         self.spec = _('cap <lowercase_letter>')
         self.extras = [RuleRef(
             name='lowercase_letter',
-            rule=LowercaseCharacter())]
+            rule=intern_rule(LowercaseCharacter))]
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
-        return Key('s-{}'.format(str(extract_values(
-            node, LowercaseCharacter, recurse=True)[0]._action)))
+        return Key('s-{}'.format(str(parse_index(node).first_value(
+            node, LowercaseCharacter)._action)))
 
 class AnyCharacter(CompoundRule):
 
@@ -148,47 +157,62 @@ class AnyCharacter(CompoundRule):
     def __init__(self, *args, **kwargs):
         self.spec = '<character>'
         self.extras = [Alternative(name='character', children=(
-            RuleRef(rule=UppercaseCharacter()),
-            RuleRef(rule=LowercaseCharacter()),
-            RuleRef(rule=Number()),
-            RuleRef(rule=Symbol())))]
+            RuleRef(rule=intern_rule(UppercaseCharacter)),
+            RuleRef(rule=intern_rule(LowercaseCharacter)),
+            RuleRef(rule=intern_rule(Number)),
+            RuleRef(rule=intern_rule(Symbol))))]
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
         # try if uppercase first, because uppercase
         # contains lowercase
-        uppercase = extract_values(
-            node, UppercaseCharacter, recurse=True)
-        if len(uppercase) > 0:
-            return uppercase[0]
-        return extract_values(
-            node, (LowercaseCharacter, Symbol, Number), recurse=True)[0]
+        index = parse_index(node)
+        uppercase = index.first_value(node, UppercaseCharacter, None)
+        if uppercase is not None:
+            return uppercase
+        return index.first_value(
+            node, (LowercaseCharacter, Symbol, Number))
 
 class SpellingRule(CompoundRule):
 
     """Our very own spelling rule."""
 
+    # Repetition max, exclusive
+    max_characters = 80
+
     def __init__(self, *args, **kwargs):
+        bounds = kwargs.pop('bounds', {})
+        self.max_characters = bounds.get(
+            'max_characters', self.max_characters)
         self.spec = _('spell <characters>')
         self.extras = [Repetition(
             name='characters',
-            child=RuleRef(rule=AnyCharacter()),
+            child=RuleRef(rule=intern_rule(AnyCharacter)),
             min=1,
-            max=80)]
+            max=self.max_characters)]
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
         return sum_actions(extract_values(
             node, AnyCharacter, recurse=True))
 
+    @timed('recognition')
+    @releases_parse_index
     def _process_recognition(self, node, extras):
-        self.value(node).execute()
+        execute_timed(compile_actions(self.value(node)))
 
 class PressRule(CompoundRule):
 
     """Press keycombos."""
 
+    # Repetition max, exclusive
+    max_modifiers = 4
+
     def __init__(self, *args, **kwargs):
+        bounds = kwargs.pop('bounds', {})
+        self.max_modifiers = bounds.get('max_modifiers', self.max_modifiers)
         # technically we should not accept uppercase chars here
         self.spec = _('press [<modifiers>] <character>')
         self.extras = [
@@ -201,20 +225,23 @@ class PressRule(CompoundRule):
                     _('(command|super)'): 'w',
                     }),
                 min=0,
-                max=4),
-            RuleRef(name='character', rule=AnyCharacter())]
+                max=self.max_modifiers),
+            RuleRef(name='character', rule=intern_rule(AnyCharacter))]
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
-        char = extract_values(node, AnyCharacter, recurse=True)[0]
+        char = parse_index(node).first_value(node, AnyCharacter)
         mods = [mod.value() for mod in \
                 node.get_children_by_name('modifier')]
         if len(mods) == 0:
             return char
         return Key("{}-{}".format("".join(mods), str(char._action)))
 
+    @timed('recognition')
+    @releases_parse_index
     def _process_recognition(self, node, extras):
-        self.value(node).execute()
+        execute_timed(self.value(node))
 
 class BasicKeyboardRule(MappingRule):
 
@@ -236,6 +263,8 @@ class BasicKeyboardRule(MappingRule):
         _('go [to] end'): Key('end'),
         _('go [<n>] page[s] up'): Key('pgup:%(n)d'),
         _('go [<n>] page[s] down'): Key('pgdown:%(n)d'),
+        _('stop typing'): Function(stream.cancel),
+        _('dump latency'): Function(dump_now),
     }
     extras = [Dictation('text'), IntegerRef('n', 1, 100)]
     defaults = {
@@ -264,16 +293,22 @@ class DictationRule(CompoundRule):
         else:
             self.default_formatting = default_formatting
             self.spec = "[<formatting>] <dictation>"
+        choices = {
+            _("snake [case]"): "snake",  # snake_case
+            _("camel [case]"): "camel",  # CamelCase
+            _("mixed [case]"): "mixed",  # mixedCase
+            _("upper[case]"): "upper",  # UPPERCASE_STUFF
+            _("no case"): "nocase",  # lowercase text
+            _("sentence"): "sentence",  # Cap first letter
+            _("dictate"): "raw",  # raw dictation
+            _("kebab [case]"): "kebab",  # kebab-case
+            _("dotted"): "dotted",  # dotted.name
+            _("path"): "path",  # path/to/file
+            }
+        for format_name, spoken in SPOKEN_FORMATS.iteritems():
+            choices[spoken] = format_name
         self.extras = [
-            Choice(name='formatting', choices={
-                _("snake [case]"): "snake",  # snake_case
-                _("camel [case]"): "camel",  # CamelCase
-                _("mixed [case]"): "mixed",  # mixedCase
-                _("upper[case]"): "upper",  # UPPERCASE_STUFF
-                _("no case"): "nocase",  # lowercase text
-                _("sentence"): "sentence",  # Cap first letter
-                _("dictate"): "raw",  # raw dictation
-                }),
+            Choice(name='formatting', choices=choices),
             Dictation(name='dictation'),
             ]
         CompoundRule.__init__(
@@ -285,61 +320,43 @@ class DictationRule(CompoundRule):
             exported=exported,
             context=context)
 
+    @timed('value')
     def value(self, node):
         formatting = self.default_formatting
         if node.has_child_with_name('formatting'):
             formatting = node.get_child_by_name(
                 'formatting').value()
-        raw_dictation = str(node.get_child_by_name(
-            'dictation').value())
-        joiner = ' '
-        words = raw_dictation.split(' ')
-        formatted_tokens = []
-        if formatting == 'snake':
-            joiner = '_'
-            for word in words:
-                formatted_tokens.append(word.lower())
-        elif formatting == 'camel':
-            joiner = ''
-            for word in words:
-                formatted_tokens.append(word.lower().capitalize())
-        elif formatting == 'mixed':
-            joiner = ''
-            formatted_tokens.append(words[0].lower())
-            if len(words) > 1:
-                for word in words[1:]:
-                    formatted_tokens.append(word.lower().capitalize())
-        elif formatting == 'upper':
-            joiner = '_'
-            for word in words:
-                formatted_tokens.append(word.upper())
-        elif formatting == 'nocase':
-            for word in words:
-                formatted_tokens.append(word.lower())
-        elif formatting == 'sentence':
-            joiner = ' '
-            formatted_tokens.extend(words)
-            formatted_tokens[0].capitalize()
-        elif formatting == 'raw':
-            formatted_tokens.extend(words)
-        else:
+        formatter = FORMATTERS.get(formatting)
+        if formatter is None:
             print "unknown formatting: %s" % formatting
+            return Text('')
+        return Text(formatter(str(node.get_child_by_name(
+            'dictation').value())))
 
-        return Text(joiner.join(formatted_tokens))
-
+    @timed('recognition')
+    @releases_parse_index
     def _process_recognition(self, node, extras):
-        self.value(node).execute()
+        execute_timed(self.value(node))
 
 GRAMMAR = None
 
-def load():
-    """Register grammar."""
+def build(bounds=None):
+    """Build grammar, with repetition bounds if given (see budget)."""
+    bounds = bounds or {}
+    grammar = Grammar('global')
+    with scope():
+        grammar.add_rule(BasicKeyboardRule())
+        grammar.add_rule(SpellingRule(bounds=bounds))
+        grammar.add_rule(PressRule(bounds=bounds))
+        grammar.add_rule(DictationRule(exported=True))
+    return grammar
+
+def load(grammar=None):
+    """Register grammar, built with build() if not given."""
     global GRAMMAR
-    GRAMMAR = Grammar('global')
-    GRAMMAR.add_rule(BasicKeyboardRule())
-    GRAMMAR.add_rule(SpellingRule())
-    GRAMMAR.add_rule(PressRule())
-    GRAMMAR.add_rule(DictationRule(exported=True))
+    if grammar is None:
+        grammar = build()
+    GRAMMAR = grammar
     GRAMMAR.load()
 
     print 'global grammar: Loaded.'
@@ -347,6 +364,6 @@ def load():
 def unload():
     """Unregister grammar."""
     global GRAMMAR
-    if GRAMMAR is None:
+    if GRAMMAR is not None:
         GRAMMAR.unload()
         GRAMMAR = None
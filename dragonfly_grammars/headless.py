@@ -0,0 +1,161 @@
+"""
+Headless grammar environment.
+
+Build and load grammars without natlink or Dragon, e.g. for
+benchmarks and offline analysis on a linux box.
+"""
+import sys
+import types
+import dragonfly.engines
+from dragonfly import Grammar
+from dragonfly.engines.base import DictationContainerBase
+import dragonfly_grammars
+from dragonfly_grammars.common import set_translator
+
+LANGUAGES = ('enx', 'nld')
+# dragonfly language codes
+_ENGINE_LANGUAGES = {'enx': 'en', 'nld': 'nl'}
+
+def _natlink_compiler():
+    """Return natlink grammar compiler, None if dragonfly lacks it."""
+    try:
+        from dragonfly.engines.backend_natlink.compiler import \
+            NatlinkCompiler
+    except ImportError:
+        return None
+    return NatlinkCompiler()
+
+class StubEngine(object):
+
+    """
+    Engine that accepts grammars without a recognizer.
+
+    Grammars are compiled with dragonfly's natlink compiler when
+    available, so loading costs about as much as it does with natlink.
+    """
+
+    name = 'stub'
+    # decode recognized words as they are, see replay
+    quoted_words_support = False
+    # dictated words are formatted without a recognizer
+    DictationContainer = DictationContainerBase
+
+    def __init__(self, language='en'):
+        self.language = language
+        self.grammars = []
+        self.compiled_sizes = {}
+        self._compiler = _natlink_compiler()
+
+    def load_grammar(self, grammar):
+        """Compile and register grammar."""
+        if self._compiler is not None:
+            compiled, _rule_names = self._compiler.compile_grammar(grammar)
+            self.compiled_sizes[grammar.name] = len(compiled)
+        self.grammars.append(grammar)
+
+    def unload_grammar(self, grammar):
+        """Unregister grammar."""
+        if grammar in self.grammars:
+            self.grammars.remove(grammar)
+
+    def activate_grammar(self, grammar):
+        """Nothing to activate without a recognizer."""
+
+    def deactivate_grammar(self, grammar):
+        """Nothing to deactivate without a recognizer."""
+
+    def activate_rule(self, rule, grammar):
+        """Nothing to activate without a recognizer."""
+
+    def deactivate_rule(self, rule, grammar):
+        """Nothing to deactivate without a recognizer."""
+
+    def update_list(self, lst, grammar):
+        """Nothing to update without a recognizer."""
+
+    def set_exclusiveness(self, grammar, exclusive):
+        """Nothing to set without a recognizer."""
+
+class _NatlinkStatus(object):
+
+    """Stand-in for natlinkstatus.NatlinkStatus."""
+
+    language = 'enx'
+
+    def getLanguage(self):  # pylint: disable=invalid-name
+        """Return profile language."""
+        return _NatlinkStatus.language
+
+ENGINE = None
+
+def install(language='enx'):
+    """
+    Install stub engine and stub natlinkstatus module.
+
+    Call this before dragonfly_grammars.grammar_modules(), rules
+    need an engine when they are defined.
+
+    Parameters
+    ----------
+    language: str
+        profile language, enx or nld
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    StubEngine
+    """
+    global ENGINE
+    if ENGINE is None:
+        ENGINE = StubEngine(_ENGINE_LANGUAGES[language])
+        dragonfly.engines._default_engine = ENGINE
+        natlinkstatus = types.ModuleType('natlinkstatus')
+        natlinkstatus.NatlinkStatus = _NatlinkStatus
+        sys.modules['natlinkstatus'] = natlinkstatus
+    use_language(language)
+    return ENGINE
+
+def use_language(language):
+    """
+    Switch stub profile language and translator.
+
+    Parameters
+    ----------
+    language: str
+        profile language, enx or nld
+
+    Raises
+    ------
+    KeyError
+        if there is no translator for language
+
+    Returns
+    -------
+    None
+    """
+    set_translator(dragonfly_grammars.TRANSLATORS[language])
+    _NatlinkStatus.language = language
+
+def module_grammars(module):
+    """
+    Return grammars a grammar module has registered.
+
+    Parameters
+    ----------
+    module: module
+        grammar module, e.g. dragonfly_grammars.vim
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[dragonfly.Grammar]
+    """
+    return [
+        value for name, value in sorted(vars(module).items())
+        if name.endswith('GRAMMAR') and isinstance(value, Grammar)]
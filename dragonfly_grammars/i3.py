@@ -3,14 +3,19 @@ from aenea import (
     Grammar,
     MappingRule,
     CompoundRule,
-    Key,
     Function,
     Choice,
     Alternative,
     IntegerRef,
     RuleRef)
-from dragonfly_grammars.common import _
+from dragonfly_grammars.common import (
+    _,
+    Key,
+    compile_actions,
+    releases_parse_index)
 from dragonfly_grammars.context import linux
+from dragonfly_grammars.interning import intern_rule, scope
+from dragonfly_grammars.latency import execute_timed, timed
 from dragonfly_grammars.cli import Command, SshRule
 
 class OpenProcessRule(CompoundRule):
@@ -18,14 +23,16 @@ class OpenProcessRule(CompoundRule):
     """Rules for opening process."""
 
     def __init__(self, *args, **kwargs):
+        bounds = kwargs.pop('bounds', {})
         self.spec = _('open process [<cmd>]')
         self.extras = [
             Alternative(name='cmd', children=(
-                RuleRef(name='ssh', rule=SshRule()),
-                RuleRef(name='command', rule=Command()),
+                RuleRef(name='ssh', rule=intern_rule(SshRule, bounds=bounds)),
+                RuleRef(name='command', rule=intern_rule(Command)),
                 )),]
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
         cmd = Key('w-m')
         if node.has_child_with_name('ssh'):
@@ -34,8 +41,10 @@ class OpenProcessRule(CompoundRule):
             cmd += node.get_child_by_name('command').value()
         return cmd
 
+    @timed('recognition')
+    @releases_parse_index
     def _process_recognition(self, node, extras):
-        self.value(node).execute()
+        execute_timed(compile_actions(self.value(node)))
 
 def n_to_key(n):
     """Convert number to workspace keysym."""
@@ -98,12 +107,20 @@ class WorkspaceRules(MappingRule):
 
 GRAMMAR = None
 
-def load():
-    """Register grammar."""
+def build(bounds=None):
+    """Build grammar, with repetition bounds if given (see budget)."""
+    grammar = Grammar('i3', context=linux())
+    with scope():
+        grammar.add_rule(OpenProcessRule(bounds=bounds or {}))
+        grammar.add_rule(WorkspaceRules())
+    return grammar
+
+def load(grammar=None):
+    """Register grammar, built with build() if not given."""
     global GRAMMAR
-    GRAMMAR = Grammar('i3', context=linux())
-    GRAMMAR.add_rule(OpenProcessRule())
-    GRAMMAR.add_rule(WorkspaceRules())
+    if grammar is None:
+        grammar = build()
+    GRAMMAR = grammar
     GRAMMAR.load()
 
     print 'i3 grammar: Loaded.'
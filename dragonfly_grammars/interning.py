@@ -0,0 +1,131 @@
+"""
+Rule interning.
+
+Sub-rules like AnyCharacter and Number are referenced by several
+rules of a grammar, and every reference used to build its own
+instance, translating and parsing the same specs again. Within a
+scope, intern_rule() hands out one instance per rule class and
+arguments instead.
+
+A scope is one grammar build. Dragonfly rules belong to a single
+grammar, so instances are never shared between grammars, nor
+between languages, which are built separately. Exported rules are
+not interned, they are recognized on their own.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+ENABLED = True
+# totals of all scopes
+STATS = {'hits': 0, 'misses': 0, 'seconds': 0.0, 'saved': 0.0}
+# scopes of background builds end on other threads
+STATS_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+def _freeze(value):
+    """Return hashable equivalent of value."""
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, _freeze(item)) for key, item in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+class RuleRegistry(object):
+
+    """Shared instances of non-exported rules of one grammar build."""
+
+    def __init__(self):
+        self.rules = {}
+        self.seconds = {}
+        self.hits = 0
+        self.misses = 0
+        self.saved = 0.0
+
+    def get(self, rule_class, kwargs):
+        """
+        Return instance of rule_class built with kwargs, shared.
+
+        Parameters
+        ----------
+        rule_class: type
+            non-exported dragonfly rule class
+        kwargs: Dict[str, Any]
+            constructor arguments
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        dragonfly.Rule
+        """
+        key = (rule_class, _freeze(kwargs))
+        rule = self.rules.get(key)
+        if rule is not None:
+            self.hits += 1
+            self.saved += self.seconds[key]
+            return rule
+        self.misses += 1
+        start = time.time()
+        rule = rule_class(**kwargs)
+        self.seconds[key] = time.time() - start
+        self.rules[key] = rule
+        return rule
+
+@contextmanager
+def scope():
+    """Share non-exported rules built on this thread within the block."""
+    registry = getattr(_LOCAL, 'registry', None)
+    if registry is not None:
+        # nested builds share the outer scope
+        yield registry
+        return
+    registry = _LOCAL.registry = RuleRegistry()
+    try:
+        yield registry
+    finally:
+        _LOCAL.registry = None
+        with STATS_LOCK:
+            STATS['hits'] += registry.hits
+            STATS['misses'] += registry.misses
+            STATS['seconds'] += sum(registry.seconds.itervalues())
+            STATS['saved'] += registry.saved
+
+def intern_rule(rule_class, **kwargs):
+    """
+    Return shared instance of rule_class in the current scope.
+
+    Outside a scope, for exported rules or when interning is
+    disabled, a new instance is returned.
+
+    Parameters
+    ----------
+    rule_class: type
+        dragonfly rule class
+    kwargs: Dict[str, Any]
+        constructor arguments
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    dragonfly.Rule
+    """
+    registry = getattr(_LOCAL, 'registry', None)
+    if registry is None or not ENABLED or rule_class.exported:
+        return rule_class(**kwargs)
+    return registry.get(rule_class, kwargs)
+
+def report():
+    """Return interning totals as text."""
+    with STATS_LOCK:
+        stats = dict(STATS)
+    return (
+        '{hits} rules shared, {misses} built, '
+        '{saved_ms:.1f} ms of building saved').format(
+            saved_ms=stats['saved'] * 1000, **stats)
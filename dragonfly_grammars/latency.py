@@ -0,0 +1,340 @@
+"""
+Recognition latency histograms.
+
+Time the phases between recognition and keystrokes per rule:
+
+* context: context evaluation of a grammar, per utterance
+* begin: _process_begin of a rule
+* value: building the action of a rule
+* execution: executing the action of a rule (see execute_timed)
+* transport: requests to the aenea server (pooled connections only)
+* recognition: _process_recognition, value and execution together
+
+Durations are counted in fixed log2 buckets of microseconds, so
+recording is a few operations and memory does not grow. Recording
+is off until enable() is called. dump() writes the histograms to a
+file, which grammarlatency prints as a table. Saying "dump latency"
+writes them while recording goes on (see dump_now).
+"""
+import argparse
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from dragonfly.grammar.context import Context
+from pathlib2 import Path
+
+# bucket i counts durations below 2 ** i microseconds,
+# the last one everything longer
+BUCKETS = 26
+
+class Histogram(object):
+
+    """Counts of durations in log2 buckets of microseconds."""
+
+    __slots__ = ('buckets', 'count', 'total', 'maximum')
+
+    def __init__(self, buckets=None, count=0, total=0.0, maximum=0.0):
+        self.buckets = buckets or [0] * BUCKETS
+        self.count = count
+        self.total = total
+        self.maximum = maximum
+
+    def record(self, seconds):
+        """Count a duration in seconds."""
+        bucket = int(seconds * 1000000).bit_length()
+        self.buckets[min(bucket, BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def percentile(self, fraction):
+        """
+        Return upper bound in seconds of the bucket of a percentile.
+
+        Parameters
+        ----------
+        fraction: float
+            e.g. 0.95 for the 95th percentile
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        float
+        """
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= fraction * self.count and seen > 0:
+                return min(2 ** bucket / 1000000., self.maximum)
+        return 0.0
+
+    def to_dict(self):
+        """Return histogram as json compatible dict."""
+        return {
+            'buckets': list(self.buckets),
+            'count': self.count,
+            'total': self.total,
+            'max': self.maximum}
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return histogram of to_dict() output."""
+        return cls(
+            list(data['buckets']), data['count'], data['total'], data['max'])
+
+HISTOGRAMS = {}
+ENABLED = False
+_LOCAL = threading.local()
+# durations are recorded from the engine, sender and pool threads
+_LOCK = threading.Lock()
+
+def enable(enabled=True):
+    """Start or stop recording."""
+    global ENABLED
+    ENABLED = enabled
+
+def reset():
+    """Forget recorded durations."""
+    with _LOCK:
+        HISTOGRAMS.clear()
+
+def record(name, phase, seconds):
+    """Count duration of phase of rule or grammar name."""
+    key = (name, phase)
+    with _LOCK:
+        histogram = HISTOGRAMS.get(key)
+        if histogram is None:
+            histogram = HISTOGRAMS[key] = Histogram()
+        histogram.record(seconds)
+
+def record_current(phase, seconds):
+    """Count duration for the rule being processed on this thread."""
+    name = getattr(_LOCAL, 'rule', None)
+    if ENABLED and name is not None:
+        record(name, phase, seconds)
+
+def timed(phase):
+    """
+    Decorate rule method to record its duration as phase.
+
+    The duration is recorded under the rule name. Requests sent
+    during the method are recorded as transport of the rule.
+
+    Parameters
+    ----------
+    phase: str
+        name of phase, e.g. value
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Callable
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not ENABLED:
+                return method(self, *args, **kwargs)
+            outer = getattr(_LOCAL, 'rule', None)
+            _LOCAL.rule = self.name
+            start = time.time()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                record(self.name, phase, time.time() - start)
+                _LOCAL.rule = outer
+        return wrapper
+    return decorator
+
+def execute_timed(action):
+    """
+    Execute action, recording its duration as execution of the rule.
+
+    Parameters
+    ----------
+    action: dragonfly.ActionBase
+        action of the rule being processed on this thread
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Any
+        result of action.execute()
+    """
+    if not ENABLED:
+        return action.execute()
+    start = time.time()
+    try:
+        return action.execute()
+    finally:
+        record_current('execution', time.time() - start)
+
+class TimedContext(Context):
+
+    """
+    Context that records how long evaluating another one takes.
+
+    Parameters
+    ----------
+    original: dragonfly.Context
+        context to evaluate
+    name: str
+        name to record under, the grammar name
+    """
+
+    def __init__(self, original, name):
+        Context.__init__(self)
+        self.original = original
+        self.name = name
+        self._str = str(original)
+
+    def matches(self, executable, title, handle):
+        if not ENABLED:
+            return self.original.matches(executable, title, handle)
+        start = time.time()
+        try:
+            return self.original.matches(executable, title, handle)
+        finally:
+            record(self.name, 'context', time.time() - start)
+
+def time_contexts(grammars):
+    """Record context evaluation of grammars."""
+    for grammar in grammars:
+        # pylint: disable=protected-access
+        if grammar._context is not None and not isinstance(
+                grammar._context, TimedContext):
+            grammar._context = TimedContext(grammar._context, grammar.name)
+
+def default_path():
+    """Return default histogram file."""
+    return Path().home().joinpath(
+        '.cache', 'dragonfly_grammars', 'latency.json')
+
+def dump(path=None):
+    """
+    Write histograms to a file, replacing it.
+
+    Parameters
+    ----------
+    path: pathlib2.Path
+        histogram file, defaults to default_path()
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    pathlib2.Path
+    """
+    if path is None:
+        path = default_path()
+    path = Path(str(path))
+    if not path.parent.exists():
+        path.parent.mkdir(parents=True)
+    with _LOCK:
+        data = [
+            [name, phase, histogram.to_dict()]
+            for (name, phase), histogram in sorted(HISTOGRAMS.items())]
+    handle, temp_name = tempfile.mkstemp(dir=str(path.parent), suffix='.tmp')
+    with os.fdopen(handle, 'wb') as histogram_file:
+        json.dump(data, histogram_file)
+    # rename does not replace files on windows
+    if path.exists():
+        path.unlink()
+    os.rename(temp_name, str(path))
+    return path
+
+def dump_now():
+    """Write histograms to default_path() if recording, e.g. by voice."""
+    if not ENABLED:
+        print 'latency recording is off, see load_grammars(record_latency)'
+        return
+    print 'latency histograms written to {}'.format(dump())
+
+def start_feature(options, language, grammars):
+    """Record grammars if options.record_latency, see load_grammars."""
+    if options.record_latency:
+        time_contexts(grammars)
+        enable()
+
+def stop_feature(grammars):
+    """Write histograms and stop recording, see unload_grammars."""
+    if ENABLED:
+        dump_now()
+        enable(False)
+
+def load(path=None):
+    """Return histograms by (name, phase) of a dump() file."""
+    if path is None:
+        path = default_path()
+    with open(str(path), 'rb') as histogram_file:
+        data = json.load(histogram_file)
+    return dict(
+        ((str(name), str(phase)), Histogram.from_dict(histogram))
+        for name, phase, histogram in data)
+
+def report(histograms):
+    """Return histograms as table, slowest 95th percentile first."""
+    lines = ["{:<32} {:<12} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        'rule', 'phase', 'count', 'mean ms', 'p50 ms', 'p95 ms', 'max ms')]
+    for (name, phase), histogram in sorted(
+            histograms.iteritems(),
+            key=lambda item: -item[1].percentile(0.95)):
+        lines.append(
+            "{:<32} {:<12} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}"
+            .format(
+                name,
+                phase,
+                histogram.count,
+                histogram.total / max(histogram.count, 1) * 1000,
+                histogram.percentile(0.5) * 1000,
+                histogram.percentile(0.95) * 1000,
+                histogram.maximum * 1000))
+    return '\n'.join(lines)
+
+def main():
+    """
+    Print latency report from the command line.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    parser = argparse.ArgumentParser(
+        prog="grammarlatency",
+        description="report recognition latency per rule and phase")
+    parser.add_argument(
+        'path',
+        nargs='?',
+        default=str(default_path()),
+        help="histogram file written by latency.dump() "
+        "(default: %(default)s)")
+    parser.add_argument(
+        '--rule',
+        action='append',
+        help="only report this rule or grammar (default: all)")
+    arguments = parser.parse_args()
+    histograms = load(arguments.path)
+    if arguments.rule is not None:
+        histograms = dict(
+            (key, histogram) for key, histogram in histograms.iteritems()
+            if key[0] in arguments.rule)
+    print report(histograms)
@@ -0,0 +1,59 @@
+"""
+Lazily loaded grammars.
+
+A lazy grammar stands in for a grammar module that only applies in
+a certain context. It holds a single rule that never matches, and
+loads the real grammar module the first time its context matches.
+
+Grammar modules whose context never matches are not even built.
+The first match starts building the real grammar on a background
+thread (see staged), and it is loaded on the main thread when it is
+ready, so the utterance that first enters the context, and the ones
+spoken while the grammar builds, are not recognized by it.
+"""
+from dragonfly import Grammar, Rule, Impossible
+from dragonfly_grammars.staged import StagedLoader
+
+class LazyGrammar(Grammar):
+
+    """
+    Stand-in that loads a grammar module on first context match.
+
+    Parameters
+    ----------
+    module_name: str
+        name of grammar module in dragonfly_grammars, e.g. vim
+    context: dragonfly.Context
+        context in which the grammar module applies
+    """
+
+    def __init__(self, module_name, context):
+        Grammar.__init__(
+            self, '{}_lazy'.format(module_name), context=context)
+        self.module_name = module_name
+        self.module = None
+        self.built = None
+        self.loader = None
+        self.add_rule(Rule(
+            name='placeholder', element=Impossible(), exported=True))
+
+    def enter_context(self):
+        if self.loader is not None:
+            return
+        self.loader = StagedLoader(
+            [self.module_name], {self.module_name: self._ready})
+        self.loader.start()
+
+    def _ready(self, module, grammar):
+        """Load the real grammar, called on the main thread."""
+        self.module = module
+        self.built = grammar
+        module.load(grammar)
+        # the real grammar takes over, it stays loaded
+        self.disable()
+
+    def unload(self):
+        if self.loader is not None:
+            self.loader.stop()
+            self.loader = None
+        Grammar.unload(self)
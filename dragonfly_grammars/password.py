@@ -3,31 +3,42 @@
 """
 Passwords for speech recognition.
 
-Provide encrypted password storage.
+Provide encrypted password storage. Passwords are read from the
+vault of the profile language if there is one (see vault), and from
+a directory with a file per password otherwise.
 """
 import string
-from pathlib2 import Path
-from simplecrypt import decrypt, DecryptionException
-import natlinkstatus
+from simplecrypt import DecryptionException
 from aenea import Grammar, Key, CompoundRule, ListRef, Dictation
 from dragonfly import List
+from dragonfly_grammars import decryption
 from dragonfly_grammars.common import _, text_to_keystr
+from dragonfly_grammars.latency import timed
+from dragonfly_grammars.vault import (
+    Vault, VaultError, data_path, vault_path)
 
 class PasswordRule(CompoundRule):
 
     """Retrieve stored password."""
 
     def __init__(self, *args, **kwargs):
+        # imported here, so the grammar can be built without natlink
+        import natlinkstatus
         self.spec = _("password <name> <passphrase>")
         self.names = List(name='names')
-        self.data_path = Path().home().joinpath(
-            'speechpass')
+        self.data_path = data_path()
         self.data_path.mkdir(exist_ok=True)
-        self.language_path = self.data_path.joinpath(
-            natlinkstatus.NatlinkStatus().getLanguage())
-        self.language_path.mkdir(exist_ok=True)
-        for name in self.language_path.iterdir():
-            self.names.append(string.replace(name.name, '_', ' '))
+        language = natlinkstatus.NatlinkStatus().getLanguage()
+        self.vault = None
+        if vault_path(language).exists():
+            self.vault = Vault(vault_path(language))
+            self._refresh_vault()
+            self.names.set(self.vault.names())
+        else:
+            self.language_path = self.data_path.joinpath(language)
+            self.language_path.mkdir(exist_ok=True)
+            for name in self.language_path.iterdir():
+                self.names.append(string.replace(name.name, '_', ' '))
         self.extras = [
             ListRef(name='name', list=self.names),
             Dictation(name='passphrase'),
@@ -35,43 +46,90 @@ class PasswordRule(CompoundRule):
 
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
-        name = node.get_child_by_name('name').value()
-        name = string.replace(name, ' ', '_')
-        password_file = self.language_path.joinpath(name)
-        if not password_file.exists():
-            print "file does not exist, could not decrypt password"
+        secret = self._secret(node)
+        if secret is None:
             return None
-        passphrase = str(node.get_child_by_name(
-            'passphrase').value()).strip().lower()
-        crypt_text = password_file.read_bytes()
         try:
-            plaintext = decrypt(passphrase, crypt_text)
+            plaintext = decryption.decrypt(
+                *secret, key_cache=decryption.KEY_CACHE)
         except DecryptionException:
             print "incorrect passphrase"
             return None
-        return text_to_keystr(plaintext.decode('utf8'))
+        except ValueError as error:
+            # e.g. simplecrypt refuses an empty passphrase
+            print "could not decrypt password: {}".format(error)
+            return None
+        return text_to_keystr(plaintext.decode('utf8'), cache=False)
 
+    def _secret(self, node):
+        name = node.get_child_by_name('name').value()
+        crypt_text = self._crypt_text(name)
+        if crypt_text is None:
+            print "password does not exist, could not decrypt password"
+            return None
+        passphrase = str(node.get_child_by_name(
+            'passphrase').value()).strip().lower()
+        return passphrase, crypt_text
+
+    def _crypt_text(self, name):
+        if self.vault is not None:
+            return self.vault.read(name)
+        password_file = self.language_path.joinpath(
+            string.replace(name, ' ', '_'))
+        if not password_file.exists():
+            return None
+        return password_file.read_bytes()
+
+    def _refresh_vault(self):
+        # a damaged vault is reported once, refresh only reads it
+        # again when it changes, and the last good index is kept
+        try:
+            return self.vault.refresh()
+        except VaultError as error:
+            print 'password vault: {}, keeping previous names'.format(error)
+            return False
+
+    @timed('begin')
     def _process_begin(self):
+        # for engines without timers
+        decryption.deliver()
+        if self.vault is not None:
+            if self._refresh_vault():
+                self.names.set(self.vault.names())
+            return
         for name in self.language_path.iterdir():
             name = string.replace(name.name, '_', ' ')
             if name not in self.names:
                 self.names.append(name)
 
+    @timed('recognition')
     def _process_recognition(self, node, extras):
-        value = self.value(node)
-        if value is None:
+        # key derivation is slow, decrypt without blocking the engine
+        secret = self._secret(node)
+        if secret is None:
             return
-        Key(value).execute()
+        decryption.submit(secret[0], secret[1], _type_plaintext)
+
+def _type_plaintext(plaintext):
+    Key(text_to_keystr(plaintext.decode('utf8'), cache=False)).execute()
 
 
 GRAMMAR = None
 
-def load():
-    """Register grammar."""
+def build():
+    """Build grammar."""
+    grammar = Grammar('password')
+    grammar.add_rule(PasswordRule())
+    return grammar
+
+def load(grammar=None):
+    """Register grammar, built with build() if not given."""
     global GRAMMAR
-    GRAMMAR = Grammar('command_line_interface')
-    GRAMMAR.add_rule(PasswordRule())
+    if grammar is None:
+        grammar = build()
+    GRAMMAR = grammar
     GRAMMAR.load()
 
     print 'password grammar: Loaded.'
@@ -79,6 +137,6 @@ def load():
 def unload():
     """Unregister grammar."""
     global GRAMMAR
-    if GRAMMAR is None:
+    if GRAMMAR is not None:
         GRAMMAR.unload()
         GRAMMAR = None
@@ -0,0 +1,404 @@
+"""
+Record recognitions and replay them as a benchmark.
+
+The recorder appends a json line per recognition to a file:
+
+    [time, language, grammar, rule, words, dictated, seconds]
+
+where dictated holds the indices of words recognized as dictation
+and seconds is how long processing took. The password grammar is
+never recorded, its words are passphrases.
+
+The replayer decodes the recorded words with the rules of the
+grammar modules again, with a stub engine, and times decoding,
+value() and optionally execution with aenea requests answered
+in-process (see connection.install_local), so rule processing can
+be compared between branches on real traffic.
+"""
+import argparse
+import json
+import time
+from collections import defaultdict
+from dragonfly import Dictation
+from dragonfly.grammar.state import State
+from pathlib2 import Path
+import dragonfly_grammars
+from dragonfly_grammars import headless
+
+# grammars whose recognitions are not recorded
+EXCLUDED_GRAMMARS = ('password',)
+# grammar modules replayed by default
+REPLAY_MODULES = ('global_', 'vim', 'cli', 'i3')
+# rule id natlink gives to dictated words
+DICTATION_RULE_ID = 1000000
+
+def default_path():
+    """Return default recording file."""
+    return Path().home().joinpath(
+        '.cache', 'dragonfly_grammars', 'recognitions.jsonl')
+
+def _dictated(node):
+    """Return indices of words below Dictation elements of node."""
+    if isinstance(node.actor, Dictation):
+        return range(node.begin, node.end)
+    indices = []
+    for child in node.children:
+        indices.extend(_dictated(child))
+    return indices
+
+class Recorder(object):
+
+    """
+    Append recognitions of grammars to a file.
+
+    Parameters
+    ----------
+    path: pathlib2.Path
+        recording file, appended to
+    language: str
+        language recorded with each recognition
+    """
+
+    def __init__(self, path, language='enx'):
+        self.path = Path(str(path))
+        self.language = language
+        self.recorded = 0
+        self._file = None
+
+    def attach(self, grammars):
+        """Record recognitions of exported rules of grammars."""
+        for grammar in grammars:
+            if grammar.name in EXCLUDED_GRAMMARS:
+                continue
+            for rule in grammar.rules:
+                if rule.exported and 'process_recognition' not in vars(rule):
+                    rule.process_recognition = self._recording(
+                        grammar.name, rule)
+
+    @staticmethod
+    def detach(grammars):
+        """Stop recording recognitions of grammars."""
+        for grammar in grammars:
+            for rule in grammar.rules:
+                if 'process_recognition' in vars(rule):
+                    del rule.process_recognition
+
+    def _recording(self, grammar_name, rule):
+        process_recognition = rule.process_recognition
+
+        def recording(node):
+            """Process recognition and record it."""
+            start = time.time()
+            try:
+                return process_recognition(node)
+            finally:
+                self.write(
+                    grammar_name,
+                    rule.name,
+                    node.words(),
+                    _dictated(node),
+                    time.time() - start)
+        return recording
+
+    def write(self, grammar_name, rule_name, words, dictated, seconds):
+        """Append a recognition to the recording file."""
+        if self._file is None:
+            if not self.path.parent.exists():
+                self.path.parent.mkdir(parents=True)
+            self._file = open(str(self.path), 'ab')
+        self._file.write(json.dumps(
+            [round(time.time(), 3), self.language, grammar_name,
+             rule_name, words, dictated, round(seconds, 6)],
+            separators=(',', ':')) + '\n')
+        self._file.flush()
+        self.recorded += 1
+
+    def close(self):
+        """Close recording file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+RECORDER = None
+
+def start_recording(grammars, language, path=None):
+    """Record recognitions of grammars to path, default_path() if None."""
+    global RECORDER
+    if RECORDER is None:
+        RECORDER = Recorder(path or default_path(), language)
+    RECORDER.language = language
+    RECORDER.attach(grammars)
+
+def stop_recording(grammars):
+    """Stop recording grammars and close the recording file."""
+    global RECORDER
+    if RECORDER is not None:
+        RECORDER.detach(grammars)
+        RECORDER.close()
+        print '{} recognitions recorded to {}'.format(
+            RECORDER.recorded, RECORDER.path)
+        RECORDER = None
+
+def start_feature(options, language, grammars):
+    """Record if options.record_recognitions, see load_grammars."""
+    if options.record_recognitions:
+        start_recording(grammars, language)
+
+def stop_feature(grammars):
+    """Stop recording, see unload_grammars."""
+    stop_recording(grammars)
+
+def read_recording(path):
+    """
+    Return recognitions in a recording file.
+
+    A damaged line, e.g. the last one after a crash, is skipped.
+
+    Parameters
+    ----------
+    path: pathlib2.Path
+        recording file
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    List[list]
+    """
+    entries = []
+    with open(str(path), 'rb') as recording_file:
+        for number, line in enumerate(recording_file, 1):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                print 'skip: line {} is damaged'.format(number)
+    return entries
+
+def decode(grammar, rule, words, dictated=()):
+    """
+    Return parse tree of words by rule, None if it does not match.
+
+    Parameters
+    ----------
+    grammar: dragonfly.Grammar
+        grammar of rule
+    rule: dragonfly.Rule
+        rule to decode with
+    words: List[str]
+        recognized words
+    dictated: List[int]
+        indices of dictated words
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    dragonfly.grammar.state.Node
+    """
+    dictated = set(dictated)
+    results = [
+        (word, DICTATION_RULE_ID if index in dictated else 0)
+        for index, word in enumerate(words)]
+    state = State(results, [rule.name], grammar.engine)
+    state.initialize_decoding()
+    for _result in rule.decode(state):
+        if state.finished():
+            return state.build_parse_tree()
+    return None
+
+class ReplayStats(object):
+
+    """Replay counts and durations of one rule."""
+
+    __slots__ = ('count', 'failed', 'decode', 'value', 'process')
+
+    def __init__(self):
+        self.count = 0
+        self.failed = 0
+        self.decode = 0.0
+        self.value = 0.0
+        self.process = 0.0
+
+def replay(entries, modules=REPLAY_MODULES, repeat=1, execute=False):
+    """
+    Replay recognitions through the rules of grammar modules.
+
+    Call headless.install() first.
+
+    Parameters
+    ----------
+    entries: List[list]
+        recognitions, see read_recording()
+    modules: List[str]
+        names of grammar modules to replay
+    repeat: int
+        number of times to replay every recognition
+    execute: bool
+        also process recognitions, answering aenea requests in-process
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    Dict[Tuple[str, str], ReplayStats]
+        stats by (grammar, rule), rules that are gone from the
+        grammars count as failed
+    """
+    stats = defaultdict(ReplayStats)
+    proxy = None
+    if execute:
+        # imported here, connection needs aenea
+        from dragonfly_grammars import connection
+        proxy = connection.install_local(results={'get_context': {}})
+        if proxy is None:
+            # actions would go to the real aenea server
+            print 'replay: not executing actions'
+            execute = False
+    by_language = defaultdict(list)
+    for entry in entries:
+        by_language[entry[1]].append(entry)
+    try:
+        for language, language_entries in sorted(by_language.iteritems()):
+            headless.use_language(language)
+            loaded = [
+                module for module in dragonfly_grammars.grammar_modules()
+                if module.__name__.rsplit('.', 1)[-1] in modules]
+            rules = {}
+            for module in loaded:
+                module.load()
+                for grammar in headless.module_grammars(module):
+                    for rule in grammar.rules:
+                        rules[grammar.name, rule.name] = grammar, rule
+            for _round in range(repeat):
+                for entry in language_entries:
+                    _replay_entry(entry, rules, stats[entry[2], entry[3]],
+                                  execute)
+            for module in loaded:
+                module.unload()
+    finally:
+        if proxy is not None:
+            connection.uninstall()
+    return dict(stats)
+
+def _replay_entry(entry, rules, stats, execute):
+    """Decode and process one recognition, adding to stats."""
+    _time, _language, grammar_name, rule_name, words, dictated = entry[:6]
+    stats.count += 1
+    if (grammar_name, rule_name) not in rules:
+        stats.failed += 1
+        return
+    grammar, rule = rules[grammar_name, rule_name]
+    start = time.time()
+    node = decode(grammar, rule, words, dictated)
+    stats.decode += time.time() - start
+    if node is None:
+        stats.failed += 1
+        return
+    start = time.time()
+    rule.value(node)
+    stats.value += time.time() - start
+    if execute:
+        start = time.time()
+        rule.process_recognition(node)
+        stats.process += time.time() - start
+
+def summary(stats):
+    """Return mean milliseconds per (grammar, rule) as json compatible."""
+    result = {}
+    for (grammar_name, rule_name), rule_stats in stats.iteritems():
+        succeeded = max(rule_stats.count - rule_stats.failed, 1)
+        result['{} {}'.format(grammar_name, rule_name)] = {
+            'count': rule_stats.count,
+            'failed': rule_stats.failed,
+            'decode': rule_stats.decode / succeeded * 1000,
+            'value': rule_stats.value / succeeded * 1000,
+            'process': rule_stats.process / succeeded * 1000}
+    return result
+
+def _change(value, baseline):
+    if baseline is None or baseline == 0:
+        return ''
+    return '{:+.0f}%'.format((value - baseline) / baseline * 100)
+
+def report(result, baseline=None):
+    """Return summary() as table, with change against a baseline."""
+    baseline = baseline or {}
+    lines = ["{:<50} {:>6} {:>6} {:>10} {:>10} {:>10} {:>7}".format(
+        'grammar rule', 'count', 'failed', 'decode ms', 'value ms',
+        'process ms', 'change')]
+    for name, row in sorted(result.iteritems()):
+        total = row['decode'] + row['value'] + row['process']
+        base = baseline.get(name)
+        lines.append(
+            "{:<50} {:>6} {:>6} {:>10.3f} {:>10.3f} {:>10.3f} {:>7}".format(
+                name, row['count'], row['failed'], row['decode'],
+                row['value'], row['process'],
+                _change(total, None if base is None else
+                        base['decode'] + base['value'] + base['process'])))
+    return '\n'.join(lines)
+
+def main():
+    """
+    Replay a recording from the command line.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    headless.install()
+    parser = argparse.ArgumentParser(
+        prog="grammarreplay",
+        description="replay recorded recognitions as a benchmark")
+    parser.add_argument(
+        'path',
+        nargs='?',
+        default=str(default_path()),
+        help="recording (default: %(default)s)")
+    parser.add_argument(
+        '--module',
+        action='append',
+        choices=REPLAY_MODULES,
+        help="grammar module (default: all)")
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        help="number of times to replay the recording")
+    parser.add_argument(
+        '--execute',
+        action='store_true',
+        help="execute actions, aenea requests are answered in-process")
+    parser.add_argument(
+        '--save',
+        help="write mean times to this file, for --baseline")
+    parser.add_argument(
+        '--baseline',
+        help="compare with mean times saved by --save, e.g. on master")
+    arguments = parser.parse_args()
+    entries = read_recording(arguments.path)
+    start = time.time()
+    result = summary(replay(
+        entries,
+        arguments.module or REPLAY_MODULES,
+        arguments.repeat,
+        arguments.execute))
+    print "{} recognitions replayed {} times in {:.1f}s".format(
+        len(entries), arguments.repeat, time.time() - start)
+    baseline = None
+    if arguments.baseline is not None:
+        with open(arguments.baseline, 'rb') as baseline_file:
+            baseline = json.load(baseline_file)
+    print report(result, baseline)
+    if arguments.save is not None:
+        with open(arguments.save, 'wb') as save_file:
+            json.dump(result, save_file, indent=1, sort_keys=True)
@@ -0,0 +1,116 @@
+"""
+Staged grammar loading.
+
+Build grammar modules on a background thread, so the microphone is
+usable before the big grammars are ready. Natlink is not thread safe,
+so finished grammars are registered with the engine on the main
+thread: from an engine timer when the engine has them, and otherwise
+at the start of the next utterance. Builds hold cache.BUILD_LOCK, so
+a grammar built on the main thread meanwhile waits for them.
+"""
+import Queue
+import threading
+import traceback
+from importlib import import_module
+from dragonfly import Grammar, Rule, Impossible, get_engine
+from dragonfly_grammars import cache
+from dragonfly_grammars.common import get_translator, thread_translator
+
+class StagedLoader(Grammar):
+
+    """
+    Build grammar modules off-thread and register them when ready.
+
+    Parameters
+    ----------
+    module_names: List[str]
+        names of grammar modules in dragonfly_grammars, e.g. vim
+    handlers: Dict[str, Callable[[module, dragonfly.Grammar], None]]
+        called with module and grammar when a grammar is ready,
+        instead of loading it, per module name
+    """
+
+    # seconds between checks for finished grammars
+    interval = 0.1
+
+    def __init__(self, module_names, handlers=None):
+        Grammar.__init__(self, 'staged_loader')
+        self.add_rule(Rule(
+            name='placeholder', element=Impossible(), exported=True))
+        self.module_names = list(module_names)
+        self.handlers = {} if handlers is None else dict(handlers)
+        self._ready = Queue.Queue()
+        self._cancelled = threading.Event()
+        self._finished = False
+        self._timer = None
+        self._thread = threading.Thread(
+            target=self._build,
+            args=(get_translator(),),
+            name='staged_loader')
+        self._thread.daemon = True
+
+    def start(self):
+        """Load this grammar and start building in the background."""
+        self.load()
+        self._thread.start()
+        engine = get_engine()
+        if hasattr(engine, 'create_timer'):
+            self._timer = engine.create_timer(
+                self.register_ready, self.interval)
+
+    def stop(self):
+        """Drop grammars that are not registered yet."""
+        self._cancelled.set()
+        self._stop_timer()
+        # a module that is being imported is only partly initialised
+        if self._thread.is_alive():
+            self._thread.join()
+        self.unload()
+
+    def _stop_timer(self):
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+
+    def _build(self, gettext_function):
+        # the translator is captured at start, so a language change
+        # on the main thread does not mix languages in one build
+        with thread_translator(gettext_function):
+            for name in self.module_names:
+                if self._cancelled.is_set():
+                    break
+                try:
+                    # importing evaluates module level specs too
+                    with cache.BUILD_LOCK:
+                        module = import_module(
+                            'dragonfly_grammars.{}'.format(name))
+                        grammar = cache.build(module)
+                    self._ready.put((module, grammar))
+                except Exception:  # pylint: disable=broad-except
+                    print 'staged loader: could not build {}'.format(name)
+                    traceback.print_exc()
+        self._ready.put(None)
+
+    def register_ready(self):
+        """Register finished grammars, call from the main thread only."""
+        while not self._finished:
+            try:
+                item = self._ready.get_nowait()
+            except Queue.Empty:
+                return
+            if item is None:
+                self._finished = True
+                self._stop_timer()
+            elif not self._cancelled.is_set():
+                # pickled before they are loaded, on this thread
+                cache.store_pending()
+                module, grammar = item
+                name = module.__name__.rsplit('.', 1)[-1]
+                handler = self.handlers.get(name)
+                if handler is None:
+                    module.load(grammar)
+                else:
+                    handler(module, grammar)
+
+    def _process_begin(self, executable, title, handle):
+        self.register_ready()
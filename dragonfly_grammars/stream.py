@@ -0,0 +1,202 @@
+"""
+Streaming action execution.
+
+Long text is typed in chunks from a sender thread: the first chunk
+goes out as soon as it is converted, every next one after the proxy
+finished the previous request, so the first characters appear after
+the same delay however long the text is. Recognition is not blocked
+while text is typed, so typing can be cancelled by voice.
+
+Actions executed while the stream is busy are queued behind it, so
+keys still arrive in the order they were spoken. Cancelling drops
+queued and running text, queued keys are still pressed.
+
+The sender thread and the main thread both send requests to the
+aenea server, which is only safe with the connection pool, so
+start() installs it. Submitting never blocks the main thread: text
+beyond MAX_PENDING queued jobs is refused, key presses are always
+queued, so none are lost or pressed out of order.
+"""
+import Queue
+import threading
+import traceback
+from dragonfly_grammars import connection
+
+# characters per typing request
+CHUNK_CHARACTERS = 32
+# queued jobs before submit() refuses text
+MAX_PENDING = 16
+
+class ActionStream(object):
+
+    """
+    Run jobs of chunks on a sender thread, in order.
+
+    Parameters
+    ----------
+    max_pending: int
+        queued jobs before submit() refuses cancellable jobs
+    """
+
+    # seconds stop() waits for the running chunk
+    stop_timeout = 5.0
+
+    def __init__(self, max_pending=MAX_PENDING):
+        self.max_pending = max_pending
+        self.sent = 0
+        self.cancelled = 0
+        self.dropped = 0
+        # unbounded, submit() keeps count, so put never blocks
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._generation = 0
+        self._thread = threading.Thread(
+            target=self._run, name='action_stream')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, chunks, cancellable=True):
+        """
+        Queue a job, an iterable of callables run in order.
+
+        The iterable is consumed on the sender thread, so a generator
+        can do its conversion work there. Does not block: a
+        cancellable job is refused if max_pending jobs are queued
+        already, other jobs are always queued.
+
+        Parameters
+        ----------
+        chunks: Iterable[Callable[[], Any]]
+            parts of one action
+        cancellable: bool
+            whether cancel() drops the job, False for key presses,
+            which are never refused
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        bool
+            False if the job was refused
+        """
+        with self._lock:
+            if cancellable and self._pending >= self.max_pending:
+                self.dropped += 1
+                print 'action stream: {} actions queued, text refused'.format(
+                    self._pending)
+                return False
+            self._pending += 1
+            # None is never cancelled
+            generation = self._generation if cancellable else None
+        self._queue.put_nowait((generation, chunks))
+        return True
+
+    def busy(self):
+        """Return whether jobs are queued or running."""
+        return self._pending > 0
+
+    def on_sender(self):
+        """Return whether the caller is the sender thread."""
+        return threading.current_thread() is self._thread
+
+    def cancel(self):
+        """Drop the rest of the running text and queued text, not keys."""
+        with self._lock:
+            self._generation += 1
+
+    def join(self, timeout=None):
+        """Wait until all jobs are done, return whether they are."""
+        done = threading.Event()
+        with self._lock:
+            self._pending += 1
+        self._queue.put_nowait((None, [done.set]))
+        return done.wait(timeout)
+
+    def stop(self):
+        """Drop all queued jobs and stop the sender thread."""
+        self.cancel()
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if job is not None:
+                with self._lock:
+                    self._pending -= 1
+        self._queue.put_nowait(None)
+        self._thread.join(self.stop_timeout)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            generation, chunks = job
+            try:
+                for chunk in chunks:
+                    if generation is not None and \
+                            generation != self._generation:
+                        self.cancelled += 1
+                        break
+                    chunk()
+                    self.sent += 1
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+STREAM = None
+
+def start():
+    """
+    Start the shared action stream, with the connection pool.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    bool
+        False if the pool can not be installed, text is then typed
+        on the main thread
+    """
+    global STREAM
+    if STREAM is None:
+        if connection.POOL is None and connection.install() is None:
+            print 'action stream: needs the connection pool, not started'
+            return False
+        STREAM = ActionStream()
+    return True
+
+def stop():
+    """Stop the shared action stream, queued actions are dropped."""
+    global STREAM
+    if STREAM is not None:
+        STREAM.stop()
+        STREAM = None
+
+def start_feature(options, language, grammars):
+    """Start the stream if options.stream_text, see load_grammars."""
+    if options.stream_text:
+        start()
+
+def stop_feature(grammars):
+    """Stop the stream, see unload_grammars."""
+    stop()
+
+def cancel():
+    """Stop typing, if the shared action stream is running."""
+    if STREAM is not None:
+        STREAM.cancel()
+
+def deferred():
+    """Return stream to queue actions on, None to execute them now."""
+    stream = STREAM
+    if stream is None or stream.on_sender() or not stream.busy():
+        return None
+    return stream
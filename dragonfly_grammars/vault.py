@@ -0,0 +1,247 @@
+"""
+Single file password vault.
+
+All encrypted passwords of a language are stored in one file, which
+starts with an index of the spoken names:
+
+    SPEECHVAULT 1
+    {"name": [offset, length], ...}
+    <crypt texts>
+
+Offsets are relative to the end of the index line. Whether the vault
+changed is a single stat, and the index is only read again when it
+did, the stat signature includes the inode, which every write
+replaces. Spoken names are unicode, names given as str are utf8.
+"""
+import json
+import os
+import sys
+import tempfile
+from pathlib2 import Path
+
+MAGIC = 'SPEECHVAULT 1\n'
+# MoveFileEx flags
+_MOVEFILE_REPLACE_EXISTING = 0x1
+_MOVEFILE_WRITE_THROUGH = 0x8
+
+def data_path():
+    """Return directory of password storage."""
+    return Path().home().joinpath('speechpass')
+
+def vault_path(language):
+    """Return path of the vault of a language."""
+    return data_path().joinpath('{}.vault'.format(language))
+
+def _text(name):
+    """Return name as unicode, str is decoded as utf8."""
+    if isinstance(name, str):
+        return name.decode('utf8')
+    return name
+
+def replace_file(source, destination):
+    """
+    Move file source over destination in one step.
+
+    Rename does not replace files on windows, MoveFileEx does.
+    Readers see either the old or the new file, never none.
+
+    Parameters
+    ----------
+    source: str
+        path of new file
+    destination: str
+        path of file to replace, does not need to exist
+
+    Raises
+    ------
+    OSError
+        if the file could not be moved
+
+    Returns
+    -------
+    None
+    """
+    if os.name != 'nt':
+        os.rename(source, destination)
+        return
+    import ctypes
+    encoding = sys.getfilesystemencoding()
+    # pylint: disable=no-member
+    if not ctypes.windll.kernel32.MoveFileExW(
+            _text_path(source, encoding),
+            _text_path(destination, encoding),
+            _MOVEFILE_REPLACE_EXISTING | _MOVEFILE_WRITE_THROUGH):
+        raise ctypes.WinError()
+
+def _text_path(path, encoding):
+    if isinstance(path, str):
+        return path.decode(encoding)
+    return path
+
+class VaultError(Exception):
+
+    """Vault file is damaged or not a vault."""
+
+class Vault(object):
+
+    """
+    Encrypted passwords of one language, indexed by spoken name.
+
+    Parameters
+    ----------
+    path: pathlib2.Path
+        vault file, does not need to exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        self._data_start = 0
+        self._signature = None
+
+    def refresh(self):
+        """
+        Read index again if the vault file changed.
+
+        Raises
+        ------
+        VaultError
+            if the file is not a vault
+
+        Returns
+        -------
+        bool
+            True if the index changed
+        """
+        try:
+            stat = os.stat(str(self.path))
+        except OSError:
+            signature = None
+        else:
+            # writes replace the file, so a rewrite of the same size
+            # within mtime granularity still has another inode
+            signature = (stat.st_ino, stat.st_mtime, stat.st_size)
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        if signature is None:
+            changed = len(self.index) > 0
+            self.index = {}
+            return changed
+        with self.path.open('rb') as vault_file:
+            if vault_file.readline() != MAGIC:
+                raise VaultError('{} is not a vault'.format(self.path))
+            try:
+                index = json.loads(vault_file.readline())
+            except ValueError:
+                raise VaultError('{} has a damaged index'.format(self.path))
+            self._data_start = vault_file.tell()
+        # json names are unicode already
+        index = dict(
+            (name, tuple(entry)) for name, entry in index.iteritems())
+        changed = index != self.index
+        self.index = index
+        return changed
+
+    def names(self):
+        """Return spoken names in vault."""
+        return sorted(self.index)
+
+    def __contains__(self, name):
+        return _text(name) in self.index
+
+    def read(self, name):
+        """
+        Return crypt text of name, None if it is not in the vault.
+
+        Parameters
+        ----------
+        name: Union[unicode, str]
+            spoken name
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        str
+        """
+        entry = self.index.get(_text(name))
+        if entry is None:
+            return None
+        offset, length = entry
+        with self.path.open('rb') as vault_file:
+            vault_file.seek(self._data_start + offset)
+            return vault_file.read(length)
+
+    def write(self, entries):
+        """
+        Replace vault contents.
+
+        Parameters
+        ----------
+        entries: Dict[Union[unicode, str], str]
+            crypt text by spoken name
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        None
+        """
+        entries = dict(
+            (_text(name), crypt_text)
+            for name, crypt_text in entries.iteritems())
+        index = {}
+        offset = 0
+        for name in sorted(entries):
+            index[name] = (offset, len(entries[name]))
+            offset += len(entries[name])
+        directory = self.path.parent
+        if not directory.exists():
+            directory.mkdir(parents=True)
+        handle, temp_name = tempfile.mkstemp(
+            dir=str(directory), suffix='.tmp')
+        with os.fdopen(handle, 'wb') as vault_file:
+            vault_file.write(MAGIC)
+            vault_file.write(json.dumps(index, sort_keys=True) + '\n')
+            for name in sorted(entries):
+                vault_file.write(entries[name])
+        replace_file(temp_name, str(self.path))
+        # read again on next refresh, so that reports the change
+        self._signature = None
+
+    def entries(self):
+        """Return crypt text by spoken name of every entry."""
+        self.refresh()
+        return dict((name, self.read(name)) for name in self.index)
+
+    def add(self, name, crypt_text):
+        """
+        Store crypt text under spoken name.
+
+        Parameters
+        ----------
+        name: Union[unicode, str]
+            spoken name
+        crypt_text: str
+            encrypted password
+
+        Raises
+        ------
+        KeyError
+            if name is in the vault already
+
+        Returns
+        -------
+        None
+        """
+        name = _text(name)
+        entries = self.entries()
+        if name in entries:
+            raise KeyError(name)
+        entries[name] = crypt_text
+        self.write(entries)
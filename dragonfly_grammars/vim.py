@@ -18,12 +18,17 @@ from aenea import (
     Literal,
     Choice,
     Alternative,
-    Repetition,
-    Key)
-from dragonfly_grammars.common import sum_actions
-
-from dragonfly_grammars.common import _, extract_values
+    Repetition)
+from dragonfly_grammars.common import Key, sum_actions, compile_actions
+
+from dragonfly_grammars.common import (
+    _,
+    extract_values,
+    parse_index,
+    releases_parse_index)
 from dragonfly_grammars.context import vim_normal_mode
+from dragonfly_grammars.interning import intern_rule, scope
+from dragonfly_grammars.latency import execute_timed, timed
 from dragonfly_grammars.global_ import Number, AnyCharacter
 
 ##################################
@@ -135,7 +140,7 @@ class MotionRule(MappingRule):
             _("line from bottom"): Key("s-l"),
             }
         self.extras = [
-            RuleRef(name='char', rule=AnyCharacter())]
+            RuleRef(name='char', rule=intern_rule(AnyCharacter))]
 
         MappingRule.__init__(self, *args, **kwargs)
 
@@ -178,8 +183,12 @@ class MotionOperatorRule(CompoundRule):
     """Commands with motion component."""
 
     exported = False
+    # Repetition max, exclusive
+    max_numbers = 3
 
     def __init__(self, *args, **kwargs):
+        bounds = kwargs.pop('bounds', {})
+        self.max_numbers = bounds.get('max_numbers', self.max_numbers)
         self.spec = _(
             "<operator> "
             "(<line>|[to] "
@@ -205,11 +214,13 @@ class MotionOperatorRule(CompoundRule):
             Literal(name='line', text=_('line')),
             Repetition(
                 name='numbers',
-                child=RuleRef(rule=Number()),
+                child=RuleRef(rule=intern_rule(Number)),
                 min=0,
-                max=3),
-            RuleRef(name='motion', rule=MotionRule()),
-            RuleRef(name='operatormotion', rule=VisualMotionRule()),
+                max=self.max_numbers),
+            RuleRef(name='motion', rule=intern_rule(MotionRule)),
+            RuleRef(
+                name='operatormotion',
+                rule=intern_rule(VisualMotionRule)),
             Choice(name='mode', choices={
                 _("character"): Key("v"),
                 _("line"): Key("s-v"),
@@ -219,28 +230,30 @@ class MotionOperatorRule(CompoundRule):
 
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
+        index = parse_index(node)
         cmd_elements = []
 
         ######################################
         #  buffer to place affected text in  #
         ######################################
-        if node.has_child_with_name('buffer'):
+        buffer_node = index.first_named(node, 'buffer')
+        if buffer_node is not None:
             cmd_elements.append("dquote")
-            cmd_elements.append(
-                node.get_child_by_name('buffer').value())
+            cmd_elements.append(buffer_node.value())
 
         #####################
         #  motion operator  #
         #####################
         cmd_elements.append(
-            node.get_child_by_name('operator').value())
+            index.first_named(node, 'operator').value())
 
         #########################
         #  operator repetition  #
         #########################
         # e.g: delete line : dd
-        if node.has_child_with_name('line'):
+        if index.first_named(node, 'line') is not None:
             cmd_elements.append(cmd_elements[-1])
 
         ##########
@@ -248,33 +261,34 @@ class MotionOperatorRule(CompoundRule):
         ##########
         # overwrites operator's default mode
         # think blockwise, linewise, charwise
-        if node.has_child_with_name('mode'):
-            cmd_elements.append(
-                node.get_child_by_name('mode').value())
+        mode = index.first_named(node, 'mode')
+        if mode is not None:
+            cmd_elements.append(mode.value())
 
         ##########################
         #  numerator for motion  #
         ##########################
         # is multiplied with any numbers preceding
         # this command by vim
-        cmd_elements.extend(extract_values(node, Number, recurse=True))
+        cmd_elements.extend(index.values(node, Number))
 
         ###################
         #  actual motion  #
         ###################
         # think w
-        if node.has_child_with_name('motion'):
-            cmd_elements.append(
-                node.get_child_by_name('motion').value())
-        if node.has_child_with_name('operatormotion'):
-            cmd_elements.append(
-                node.get_child_by_name(
-                    'operatormotion').value())
+        motion = index.first_named(node, 'motion')
+        if motion is not None:
+            cmd_elements.append(motion.value())
+        operatormotion = index.first_named(node, 'operatormotion')
+        if operatormotion is not None:
+            cmd_elements.append(operatormotion.value())
 
         return sum_actions(cmd_elements)
 
+    @timed('recognition')
+    @releases_parse_index
     def _process_recognition(self, node, extras):
-        self.value(node).execute()
+        execute_timed(compile_actions(self.value(node)))
 
 class VimNormalRule(MappingRule):
 
@@ -431,8 +445,8 @@ class VimNormalRule(MappingRule):
             }
         self.extras = [
             # TODO: tighten register to [a-zA-Zs-9.%#:-"]
-            RuleRef(name='register', rule=AnyCharacter()),
-            RuleRef(name='char', rule=AnyCharacter())]
+            RuleRef(name='register', rule=intern_rule(AnyCharacter)),
+            RuleRef(name='char', rule=intern_rule(AnyCharacter))]
 
         MappingRule.__init__(self, *args, **kwargs)
 
@@ -447,84 +461,95 @@ class TrueVimNormalRule(CompoundRule):
     exported = False
 
     def __init__(self, *args, **kwargs):
+        bounds = kwargs.pop('bounds', {})
         self.spec = _("<cmd>")
         self.extras = [
             Alternative(name='cmd', children=(
                 RuleRef(
                     name='motion_operator',
-                    rule=MotionOperatorRule()),
+                    rule=intern_rule(MotionOperatorRule, bounds=bounds)),
                 RuleRef(
-                    name='motion', rule=MotionRule()),
+                    name='motion', rule=intern_rule(MotionRule)),
                 RuleRef(
-                    name='normal', rule=VimNormalRule()),
-                RuleRef(name='number', rule=Number()),
+                    name='normal', rule=intern_rule(VimNormalRule)),
+                RuleRef(name='number', rule=intern_rule(Number)),
                 ))
             ]
 
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
-        if node.has_child_with_name('motion_operator'):
-            return node.get_child_by_name(
-                'motion_operator').value()
-        elif node.has_child_with_name('motion'):
-            return node.get_child_by_name(
-                'motion').value()
-        elif node.has_child_with_name('normal'):
-            return node.get_child_by_name(
-                'normal').value()
-        elif node.has_child_with_name('number'):
-            return node.get_child_by_name(
-                'number').value()
-        else:
-            pass
-
+        index = parse_index(node)
+        for name in ('motion_operator', 'motion', 'normal', 'number'):
+            cmd = index.first_named(node, name)
+            if cmd is not None:
+                return cmd.value()
+
+    @timed('recognition')
+    @releases_parse_index
     def _process_recognition(self, node, extras):
-        self.value(node).execute()
+        execute_timed(compile_actions(self.value(node)))
 
 class TrueVimNormalRepetitionRule(CompoundRule):
 
     """Repeat TrueVimNormalRule."""
 
+    # Repetition max, exclusive
+    max_commands = 5
+
     def __init__(self, *args, **kwargs):
+        bounds = kwargs.pop('bounds', {})
+        self.max_commands = bounds.get('max_commands', self.max_commands)
         self.spec = _("<cmds>")
         self.extras = [
             Repetition(
                 name='cmds',
-                child=RuleRef(rule=TrueVimNormalRule()),
+                child=RuleRef(rule=intern_rule(
+                    TrueVimNormalRule, bounds=bounds)),
                 min=1,
-                max=5)
+                max=self.max_commands)
             ]
 
         CompoundRule.__init__(self, *args, **kwargs)
 
+    @timed('value')
     def value(self, node):
         extras = extract_values(node, (
             TrueVimNormalRule), recurse=True)
         return sum_actions(extras)
 
+    @timed('recognition')
+    @releases_parse_index
     def _process_recognition(self, node, extras):
-        self.value(node).execute()
+        execute_timed(compile_actions(self.value(node)))
 
 
 TRUE_VIM_NORMAL_GRAMMAR = None
 
-def load():
-    """Register grammar."""
-    global TRUE_VIM_NORMAL_GRAMMAR
-    TRUE_VIM_NORMAL_GRAMMAR = Grammar(
+def build(bounds=None):
+    """Build grammar, with repetition bounds if given (see budget)."""
+    grammar = Grammar(
         'true_vim_normal_mode',
         context=vim_normal_mode())
-    TRUE_VIM_NORMAL_GRAMMAR.add_rule(
-        TrueVimNormalRepetitionRule())
+    with scope():
+        grammar.add_rule(
+            TrueVimNormalRepetitionRule(bounds=bounds or {}))
+    return grammar
+
+def load(grammar=None):
+    """Register grammar, built with build() if not given."""
+    global TRUE_VIM_NORMAL_GRAMMAR
+    if grammar is None:
+        grammar = build()
+    TRUE_VIM_NORMAL_GRAMMAR = grammar
     TRUE_VIM_NORMAL_GRAMMAR.load()
 
     print 'vim grammars: Loaded.'
-    # print TRUE_VIM_NORMAL_GRAMMAR.get_complexity_string()
 
 def unload():
     """Unregister grammar."""
     global TRUE_VIM_NORMAL_GRAMMAR
-    if TRUE_VIM_NORMAL_GRAMMAR is None:
+    if TRUE_VIM_NORMAL_GRAMMAR is not None:
         TRUE_VIM_NORMAL_GRAMMAR.unload()
         TRUE_VIM_NORMAL_GRAMMAR = None
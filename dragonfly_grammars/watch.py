@@ -0,0 +1,225 @@
+"""
+Config watch service.
+
+Watch aenea config files on a background thread, with inotify when
+pyinotify is available and by polling at a fixed interval otherwise.
+Files in a directory that does not exist yet are polled until it
+does, inotify can only watch existing directories.
+Changes are queued, and handed to callbacks on the main thread by
+dispatch(), which does no filesystem access. Natlink is not thread
+safe, so grammar lists must only be changed from the main thread.
+"""
+import Queue
+import os
+import threading
+import traceback
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+class ConfigWatchService(object):
+
+    """
+    Refresh aenea ConfigWatchers in the background.
+
+    Parameters
+    ----------
+    interval: float
+        seconds between polls of config files inotify does not watch
+    """
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.refreshes = 0
+        self._watches = []
+        self._lock = threading.Lock()
+        self._changes = Queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, watcher, callback):
+        """
+        Call callback with the config of watcher now and on changes.
+
+        Parameters
+        ----------
+        watcher: aenea.configuration.ConfigWatcher
+            config file to watch
+        callback: Callable[[dict], None]
+            called with the config from dispatch()
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        None
+        """
+        with self._lock:
+            self._watches.append((watcher, callback))
+        self._changes.put((callback, dict(watcher.conf)))
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='config_watch')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def unwatch(self, callback):
+        """Stop watching for callback."""
+        with self._lock:
+            self._watches = [
+                (watcher, registered)
+                for watcher, registered in self._watches
+                if registered is not callback]
+
+    def stop(self):
+        """Stop the watch thread and wait for it."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(self.interval * 2)
+        self._thread = None
+
+    def dispatch(self):
+        """Hand queued changes to their callbacks, on the main thread."""
+        while True:
+            try:
+                callback, conf = self._changes.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                callback(conf)
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc()
+
+    def _refresh(self, paths=None):
+        """Refresh watchers, only those of paths if given."""
+        with self._lock:
+            watches = list(self._watches)
+        for watcher, callback in watches:
+            if paths is not None and _watcher_path(watcher) not in paths:
+                continue
+            self.refreshes += 1
+            if watcher.refresh():
+                self._changes.put((callback, dict(watcher.conf)))
+
+    def _run(self):
+        notifier = None
+        if pyinotify is not None:
+            notifier = _Notifier(self)
+        try:
+            while not self._stop.is_set():
+                if notifier is None:
+                    self._stop.wait(self.interval)
+                    self._refresh()
+                else:
+                    polled = notifier.wait(self.interval)
+                    # files inotify does not watch are still polled
+                    self._refresh(paths=[None] + polled)
+        finally:
+            if notifier is not None:
+                notifier.close()
+
+def _watcher_path(watcher):
+    """Return path of watcher's config file, None if unknown."""
+    # aenea's ConfigWatcher has no public attribute for it
+    path = getattr(watcher, '_path', None)
+    if path is None:
+        return None
+    return os.path.abspath(path)
+
+class _Notifier(object):
+
+    """Refresh watchers on inotify events in their directories."""
+
+    mask = 0 if pyinotify is None else (
+        pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO |
+        pyinotify.IN_CREATE | pyinotify.IN_DELETE)
+
+    def __init__(self, service):
+        self.service = service
+        self._manager = pyinotify.WatchManager()
+        self._directories = set()
+        self._changed = set()
+        self._notifier = pyinotify.Notifier(
+            self._manager, default_proc_fun=self._event)
+
+    def _event(self, event):
+        self._changed.add(os.path.abspath(event.pathname))
+
+    def _add_directories(self):
+        """
+        Watch directories of watched files, return paths to poll.
+
+        Files are polled while their directory does not exist, and
+        once more when it is watched, for changes before that.
+        """
+        # pylint: disable=protected-access
+        with self.service._lock:
+            watches = list(self.service._watches)
+        polled = []
+        for watcher, _callback in watches:
+            path = _watcher_path(watcher)
+            if path is None:
+                continue
+            directory = os.path.dirname(path)
+            if directory in self._directories:
+                continue
+            polled.append(path)
+            if os.path.isdir(directory):
+                self._manager.add_watch(directory, self.mask)
+                self._directories.add(directory)
+        return polled
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for events and refresh.
+
+        Parameters
+        ----------
+        timeout: float
+            seconds to wait for events
+
+        Raises
+        ------
+        None
+
+        Returns
+        -------
+        List[str]
+            paths of files to poll, see _add_directories
+        """
+        polled = self._add_directories()
+        if self._notifier.check_events(timeout=int(timeout * 1000)):
+            self._notifier.read_events()
+            self._notifier.process_events()
+        if len(self._changed) > 0:
+            changed = self._changed
+            self._changed = set()
+            # pylint: disable=protected-access
+            self.service._refresh(paths=changed)
+        return polled
+
+    def close(self):
+        """Release the inotify instance."""
+        self._notifier.stop()
+
+SERVICE = None
+
+def service():
+    """Return the shared config watch service."""
+    global SERVICE
+    if SERVICE is None:
+        SERVICE = ConfigWatchService()
+    return SERVICE
+
+def stop():
+    """Stop the shared config watch service, if started."""
+    global SERVICE
+    if SERVICE is not None:
+        SERVICE.stop()
+        SERVICE = None
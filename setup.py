@@ -8,7 +8,7 @@ setup(
     author='nihlaeth',
     author_email='info@nihlaeth.nl',
     python_requires='>=2.7,<3',
-    packages=find_packages(),
+    packages=find_packages(exclude=['tests']),
     install_requires=[
         # 'dragonfly>=0.6.6',
         'dragonfly',
@@ -17,6 +17,13 @@ setup(
         'simple-crypt'],
     entry_points={
         'console_scripts': [
-            'speechpass = speechpass:encrypt_password']},
+            'speechpass = speechpass:encrypt_password',
+            'speechpass-migrate = speechpass:migrate_vault',
+            'speechpass-bulk = speechpass:bulk_encrypt',
+            'grammarambiguity = dragonfly_grammars.ambiguity:main',
+            'grammarbench = dragonfly_grammars.benchmark:main',
+            'grammarcomplexity = dragonfly_grammars.complexity:main',
+            'grammarlatency = dragonfly_grammars.latency:main',
+            'grammarreplay = dragonfly_grammars.replay:main']},
     package_data={'dragonfly_grammars': ['translations/*']},
     message_extractors={'dragonfly_grammars': [("**.py", 'python', None)]})
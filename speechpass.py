@@ -7,15 +7,23 @@ This part encrypt passwords with a passphrase,
 so you can unlock them using speech recognition.
 """
 import argparse
+import os
+import string
+import sys
+import tempfile
+import time
 from getpass import getpass
+from multiprocessing import Pool, cpu_count
 from pathlib2 import Path
-from simplecrypt import encrypt
+from simplecrypt import encrypt, decrypt, DecryptionException
+from dragonfly_grammars.vault import Vault, _text, replace_file, vault_path
 
 def encrypt_password():
     """
     Encrypt password with passphrase provided on command line.
 
-    Store crypt text in files in user directory.
+    Store crypt text in the vault of the language if there is one,
+    in files in user directory otherwise.
 
     Raises
     ------
@@ -53,13 +61,23 @@ def encrypt_password():
     data_path = Path().home().joinpath(
         'speechpass')
     data_path.mkdir(exist_ok=True)
-    language_path = data_path.joinpath(arguments.language)
-    language_path.mkdir(exist_ok=True)
-    file_path = language_path.joinpath(arguments.name)
-    if file_path.exists():
-        print "abort: file {} already exists".format(
-            file_path)
-        return
+    vault = None
+    if vault_path(arguments.language).exists():
+        vault = Vault(vault_path(arguments.language))
+        vault.refresh()
+        spoken_name = string.replace(arguments.name, '_', ' ')
+        if spoken_name in vault:
+            print "abort: {} already exists in {}".format(
+                spoken_name, vault.path)
+            return
+    else:
+        language_path = data_path.joinpath(arguments.language)
+        language_path.mkdir(exist_ok=True)
+        file_path = language_path.joinpath(arguments.name)
+        if file_path.exists():
+            print "abort: file {} already exists".format(
+                file_path)
+            return
     #############
     #  secrets  #
     #############
@@ -80,5 +98,206 @@ def encrypt_password():
     ################
     #  encryption  #
     ################
-    file_path.write_bytes(encrypt(passphrase, secret))
+    if vault is not None:
+        vault.add(spoken_name, encrypt(passphrase, secret))
+    else:
+        file_path.write_bytes(encrypt(passphrase, secret))
     print "password encrypted and stored"
+
+def migrate_vault():
+    """
+    Move password files of a language into its vault.
+
+    The password files are left in place, the password grammar
+    ignores them once the vault exists.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    parser = argparse.ArgumentParser(
+        prog="speechpass-migrate",
+        description="move password files of a language into one vault")
+    parser.add_argument(
+        'language',
+        help="speech language of the passwords")
+    arguments = parser.parse_args()
+    language_path = Path().home().joinpath(
+        'speechpass', arguments.language)
+    vault = Vault(vault_path(arguments.language))
+    entries = vault.entries()
+    migrated = 0
+    if language_path.exists():
+        for file_path in sorted(language_path.iterdir()):
+            # vault names are unicode
+            spoken_name = _text(string.replace(file_path.name, '_', ' '))
+            if spoken_name in entries:
+                print "skip: {} already exists in vault".format(
+                    spoken_name.encode('utf8'))
+                continue
+            entries[spoken_name] = file_path.read_bytes()
+            migrated += 1
+    vault.write(entries)
+    print "{} passwords moved to {}, you can remove {}".format(
+        migrated, vault.path, language_path)
+
+
+def _write_atomic(path, data):
+    """Write data to path through a temporary file."""
+    handle, temp_name = tempfile.mkstemp(
+        dir=str(path.parent), suffix='.tmp')
+    with os.fdopen(handle, 'wb') as temp_file:
+        temp_file.write(data)
+    replace_file(temp_name, str(path))
+
+def _encrypt_entry(job):
+    """Encrypt (name, passphrase, secret) in a pool process."""
+    name, passphrase, secret = job
+    return name, encrypt(passphrase, secret)
+
+def _rotate_entry(job):
+    """Encrypt (name, old, new, crypt text) again in a pool process."""
+    name, old_passphrase, new_passphrase, crypt_text = job
+    try:
+        secret = decrypt(old_passphrase, crypt_text)
+    except DecryptionException:
+        return name, None
+    return name, encrypt(new_passphrase, secret)
+
+def _read_pairs(input_file):
+    """Return (spoken name, secret) of tab separated lines."""
+    pairs = []
+    for number, line in enumerate(input_file, 1):
+        line = line.rstrip('\r\n')
+        if line.strip() == '' or line.startswith('#'):
+            continue
+        if '\t' not in line:
+            print "skip: line {} has no tab".format(number)
+            continue
+        name, secret = line.split('\t', 1)
+        # unicode like vault names, so existing names are found
+        pairs.append(
+            (_text(string.replace(name.strip(), '_', ' ')), secret))
+    return pairs
+
+def _ask_passphrase(prompt):
+    """Return passphrase typed twice, None if they differ."""
+    print prompt
+    passphrase = getpass()
+    print "repeat to be sure"
+    if getpass() != passphrase:
+        print "passphrases do not match"
+        return None
+    return passphrase
+
+def bulk_encrypt():
+    """
+    Encrypt many passwords at once, in parallel.
+
+    Read tab separated name and password lines from a file or stdin
+    and encrypt them with one passphrase, or encrypt all stored
+    passwords of a language again with a new passphrase. Names that
+    are stored already are skipped. Passwords go to the vault of the
+    language if there is one, to files in user directory otherwise.
+
+    Raises
+    ------
+    None
+
+    Returns
+    -------
+    None
+    """
+    parser = argparse.ArgumentParser(
+        prog="speechpass-bulk",
+        description="encrypt many passwords for use with speech recognition")
+    parser.add_argument(
+        'language',
+        help="speech language for passphrase")
+    parser.add_argument(
+        '--input',
+        help="file with a name, a tab and a password per line "
+        "(default: stdin)")
+    parser.add_argument(
+        '--rotate',
+        action='store_true',
+        help="encrypt stored passwords again with a new passphrase")
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=cpu_count(),
+        help="number of encryption processes (default: cpu count)")
+    arguments = parser.parse_args()
+    language_path = Path().home().joinpath('speechpass', arguments.language)
+    vault = None
+    if vault_path(arguments.language).exists():
+        vault = Vault(vault_path(arguments.language))
+        stored = vault.entries()
+    else:
+        language_path.mkdir(parents=True, exist_ok=True)
+        stored = dict(
+            (_text(string.replace(path.name, '_', ' ')), path.read_bytes())
+            for path in language_path.iterdir()
+            if not path.name.endswith('.tmp'))
+    if arguments.rotate:
+        old_passphrase = getpass("current passphrase: ")
+        new_passphrase = _ask_passphrase("provide new passphrase")
+        if new_passphrase is None:
+            return
+        jobs = [
+            (name, old_passphrase, new_passphrase, crypt_text)
+            for name, crypt_text in sorted(stored.iteritems())]
+        work = _rotate_entry
+    else:
+        if arguments.input is None:
+            pairs = _read_pairs(sys.stdin)
+        else:
+            with open(arguments.input, 'rb') as input_file:
+                pairs = _read_pairs(input_file)
+        # passwords come from the input, so ask on the terminal
+        passphrase = _ask_passphrase(
+            "provide passphrase you want to speak to access your passwords")
+        if passphrase is None:
+            return
+        jobs = []
+        names = set(stored)
+        for name, secret in pairs:
+            if name in names:
+                print "skip: {} already exists".format(name.encode('utf8'))
+                continue
+            names.add(name)
+            jobs.append((name, passphrase, secret))
+        work = _encrypt_entry
+    start = time.time()
+    pool = Pool(max(1, arguments.processes))
+    try:
+        results = pool.map(work, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    duration = time.time() - start
+    encrypted = dict(
+        (name, crypt_text) for name, crypt_text in results
+        if crypt_text is not None)
+    for name, crypt_text in results:
+        if crypt_text is None:
+            print "skip: {} has a different passphrase".format(
+                name.encode('utf8'))
+    if vault is not None:
+        # one atomic write with every entry
+        stored.update(encrypted)
+        vault.write(stored)
+    else:
+        for name, crypt_text in sorted(encrypted.iteritems()):
+            _write_atomic(
+                language_path.joinpath(
+                    string.replace(name, ' ', '_').encode('utf8')),
+                crypt_text)
+    print "{} passwords encrypted in {:.1f}s ({:.2f} per second)".format(
+        len(encrypted),
+        duration,
+        len(encrypted) / duration if duration > 0 else 0)
@@ -0,0 +1,159 @@
+"""
+Local stand-ins for the proxy side, for tests and trying things out.
+"""
+import BaseHTTPServer
+import SocketServer
+import json
+import socket
+import threading
+
+class FocusEventServer(object):
+
+    """
+    Stand-in for the proxy side, emits focus events to subscribers.
+
+    Parameters
+    ----------
+    address: Tuple[str, int]
+        address to listen on, port 0 picks a free port
+    """
+
+    def __init__(self, address=('127.0.0.1', 0)):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        self._server.listen(5)
+        self.address = self._server.getsockname()
+        self.window = {}
+        self._clients = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._accept, name='focus_event_server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _address = self._server.accept()
+            except socket.error:
+                return
+            with self._lock:
+                self._clients.append(client)
+                if len(self.window) > 0:
+                    self._send(
+                        client, {'event': 'focus', 'window': self.window})
+
+    def _send(self, client, event):
+        try:
+            client.sendall(json.dumps(event) + '\n')
+        except socket.error:
+            self._clients.remove(client)
+            client.close()
+
+    def publish(self, event):
+        """Send event to every subscriber."""
+        with self._lock:
+            for client in list(self._clients):
+                self._send(client, event)
+
+    def focus(self, **window):
+        """Emit focus change to a window with properties window."""
+        self.window = window
+        self.publish({'event': 'focus', 'window': window})
+
+    def title(self, title):
+        """Emit title change of the focused window."""
+        self.window = dict(self.window, title=title)
+        self.publish({'event': 'title', 'title': title})
+
+    def close(self):
+        """Disconnect subscribers and stop listening."""
+        with self._lock:
+            for client in self._clients:
+                try:
+                    client.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+                client.close()
+            del self._clients[:]
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._server.close()
+        self._thread.join(1)
+
+class _StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    disable_nagle_algorithm = True
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer a JSON-RPC request."""
+        request = json.loads(
+            self.rfile.read(int(self.headers['Content-Length'])))
+        server = self.server
+        with server.lock:
+            server.calls.append((request['method'], request['params']))
+        result = server.results.get(request['method'])
+        body = json.dumps({
+            'jsonrpc': '2.0', 'result': result, 'id': request['id']})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.protocol_version = self.server.protocol_version
+        with self.server.lock:
+            self.server.connections += 1
+            self.server.sockets.append(self.connection)
+
+    def log_message(self, *_args):
+        """Do not log requests."""
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """
+    Local JSON-RPC server answering every method.
+
+    Parameters
+    ----------
+    address: Tuple[str, int]
+        address to listen on, port 0 picks a free port
+    results: Dict[str, Any]
+        result by method name, e.g. {'get_context': {...}}, others
+        return None
+    protocol_version: str
+        HTTP/1.0 closes the connection after every response, like
+        the aenea server, HTTP/1.1 keeps it open
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), results=None,
+                 protocol_version='HTTP/1.0'):
+        BaseHTTPServer.HTTPServer.__init__(self, address, _StandInHandler)
+        self.protocol_version = protocol_version
+        self.results = results or {}
+        self.calls = []
+        self.connections = 0
+        self.sockets = []
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self.serve_forever, name='stand_in_server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """Stop serving and close open connections."""
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            for client in self.sockets:
+                try:
+                    client.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
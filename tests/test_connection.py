@@ -0,0 +1,127 @@
+"""Tests of pooled connections to the aenea server."""
+import socket
+import threading
+import time
+import unittest
+from dragonfly_grammars import connection
+from tests.stand_ins import StandInServer
+
+CALLS = 10
+
+class SilentServer(object):
+
+    """Accepts connections and never answers."""
+
+    def __init__(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(5)
+        self.address = self._server.getsockname()
+        self.clients = []
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _address = self._server.accept()
+            except socket.error:
+                return
+            self.clients.append(client)
+
+    def close(self):
+        """Stop listening and drop connections."""
+        for client in self.clients:
+            client.close()
+        self._server.close()
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def test_keep_alive_connects_once(self):
+        server = StandInServer(protocol_version='HTTP/1.1')
+        pool = connection.ConnectionPool(server.server_address, size=1)
+        try:
+            for _call in range(CALLS):
+                pool.call('key_press', key='a')
+            self.assertEqual(pool.connects, 1)
+            self.assertEqual(server.connections, 1)
+            self.assertEqual(pool.reconnects, 0)
+            self.assertEqual(len(server.calls), CALLS)
+        finally:
+            pool.close()
+            server.close()
+
+    def test_http_1_0_connect_per_call(self):
+        # like aenea, the server closes the connection after answering
+        server = StandInServer(results={'get_context': {'title': 'vim'}})
+        pool = connection.ConnectionPool(server.server_address, size=1)
+        try:
+            for _call in range(CALLS):
+                self.assertEqual(
+                    pool.call('get_context'), {'title': 'vim'})
+            self.assertEqual(pool.connects, server.connections)
+            self.assertEqual(pool.connects, CALLS)
+            self.assertEqual(pool.reconnects, 0)
+        finally:
+            pool.close()
+            server.close()
+
+    def test_closed_idle_connection_is_a_connect(self):
+        server = StandInServer(protocol_version='HTTP/1.1')
+        pool = connection.ConnectionPool(server.server_address, size=1)
+        try:
+            pool.prewarm()
+            # the server handles the connection on its own thread
+            deadline = time.time() + 5
+            while server.connections == 0 and time.time() < deadline:
+                time.sleep(0.01)
+            with server.lock:
+                for client in server.sockets:
+                    client.shutdown(socket.SHUT_RDWR)
+            # the end of file reaches the client
+            time.sleep(0.1)
+            pool.call('key_press', key='a')
+            self.assertEqual(pool.closed, 1)
+            self.assertEqual(pool.reconnects, 0)
+            self.assertEqual(pool.connects, 2)
+            self.assertEqual(len(server.calls), 1)
+        finally:
+            pool.close()
+            server.close()
+
+    def test_timeout_is_not_retried(self):
+        server = SilentServer()
+        pool = connection.ConnectionPool(
+            server.address, size=1, timeout=0.2)
+        try:
+            pool.prewarm()
+            with self.assertRaises(socket.timeout):
+                pool.call('key_press', key='a')
+            self.assertEqual(pool.connects, 1)
+            self.assertEqual(pool.reconnects, 0)
+            self.assertEqual(len(server.clients), 1)
+        finally:
+            pool.close()
+            server.close()
+
+    def test_change_address_does_not_wait(self):
+        server = StandInServer(protocol_version='HTTP/1.1')
+        pool = connection.ConnectionPool(server.server_address, size=1)
+        try:
+            start = time.time()
+            # not routable, connecting waits for the timeout
+            pool.change_address(('10.255.255.1', 8240))
+            self.assertLess(time.time() - start, 0.5)
+            pool.change_address(server.server_address)
+            deadline = time.time() + 5
+            while pool._idle.qsize() == 0 and time.time() < deadline:
+                time.sleep(0.01)
+            pool.call('key_press', key='a')
+            self.assertEqual(len(server.calls), 1)
+        finally:
+            pool.close()
+            server.close()
+
+if __name__ == '__main__':
+    unittest.main()
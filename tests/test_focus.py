@@ -0,0 +1,82 @@
+"""Tests of focus event subscriptions."""
+import time
+import unittest
+from dragonfly_grammars import focus
+from tests.stand_ins import FocusEventServer
+
+def wait_for(predicate, timeout=5.0):
+    """Return True once predicate holds, False after timeout seconds."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+class FocusSubscriptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FocusEventServer()
+        self.subscription = focus.FocusSubscription(
+            self.server.address, reconnect_delay=0.1)
+        self.subscription.poll_interval = 0.1
+        self.subscription.start()
+
+    def tearDown(self):
+        self.subscription.stop()
+        self.server.close()
+
+    def test_focus_and_title(self):
+        self.server.focus(cls='terminator', title='vim')
+        self.assertTrue(wait_for(
+            lambda: self.subscription.properties ==
+            {'cls': 'terminator', 'title': 'vim'}))
+        self.server.title('bash')
+        self.assertTrue(wait_for(
+            lambda: self.subscription.properties ==
+            {'cls': 'terminator', 'title': 'bash'}))
+
+    def test_reconnect(self):
+        self.server.focus(cls='terminator', title='vim')
+        self.assertTrue(wait_for(
+            lambda: self.subscription.properties is not None))
+        address = self.server.address
+        self.server.close()
+        self.assertTrue(wait_for(
+            lambda: self.subscription.properties is None))
+        self.server = FocusEventServer(address)
+        self.server.focus(cls='firefox', title='docs')
+        self.assertTrue(wait_for(
+            lambda: self.subscription.properties ==
+            {'cls': 'firefox', 'title': 'docs'}))
+
+    def test_change_address(self):
+        self.server.focus(cls='terminator', title='vim')
+        self.assertTrue(wait_for(
+            lambda: self.subscription.properties is not None))
+        other = FocusEventServer()
+        try:
+            other.focus(cls='firefox', title='docs')
+            self.subscription.change_address(other.address)
+            # nothing of the old connection survives the change
+            self.server.focus(cls='terminator', title='stale')
+            self.assertTrue(wait_for(
+                lambda: self.subscription.properties ==
+                {'cls': 'firefox', 'title': 'docs'}))
+        finally:
+            other.close()
+
+    def test_long_event_drops_connection(self):
+        self.server.focus(cls='terminator', title='vim')
+        self.assertTrue(wait_for(
+            lambda: self.subscription.properties is not None))
+        self.server.publish(
+            {'event': 'title', 'title': 'x' * focus.MAX_EVENT_BYTES})
+        # reconnected, the server sends its window state on accept
+        self.assertTrue(wait_for(lambda: self.subscription.events > 1))
+        self.assertEqual(
+            self.subscription.properties,
+            {'cls': 'terminator', 'title': 'vim'})
+
+if __name__ == '__main__':
+    unittest.main()
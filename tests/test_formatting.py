@@ -0,0 +1,37 @@
+"""Tests of dictation formats."""
+import unittest
+from dragonfly_grammars import cache, formatting
+
+class FormattingTest(unittest.TestCase):
+
+    def test_formats(self):
+        text = 'Read the config file'
+        self.assertEqual(
+            formatting.format_text('kebab', text), 'read-the-config-file')
+        self.assertEqual(
+            formatting.format_text('dotted', text), 'read.the.config.file')
+        self.assertEqual(
+            formatting.format_text('path', text), 'read/the/config/file')
+        self.assertEqual(
+            formatting.format_text('mixed', text), 'readTheConfigFile')
+
+    def test_register(self):
+        formatting.register('shout', lambda text: text.upper())
+        try:
+            self.assertEqual(
+                formatting.format_batch('shout', ['a b', 'c']), ['A B', 'C'])
+        finally:
+            del formatting.FORMATTERS['shout']
+
+    def test_spoken_format_changes_cache_key(self):
+        key = cache.GrammarCache('enx').key
+        formatting.register('shout', lambda text: text.upper(), 'shout')
+        try:
+            self.assertNotEqual(cache.GrammarCache('enx').key, key)
+        finally:
+            del formatting.FORMATTERS['shout']
+            del formatting.SPOKEN_FORMATS['shout']
+        self.assertEqual(cache.GrammarCache('enx').key, key)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Tests of bulk password encryption."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from pathlib2 import Path
+import speechpass
+from dragonfly_grammars.vault import Vault
+
+class BulkEncryptTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        self.argv = sys.argv
+        self.getpass = speechpass.getpass
+        os.environ['HOME'] = self.home
+        speechpass.getpass = lambda prompt='': 'passphrase'
+        self.input = os.path.join(self.home, 'passwords.txt')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        sys.argv = self.argv
+        speechpass.getpass = self.getpass
+        shutil.rmtree(self.home)
+
+    def _bulk(self, lines):
+        with open(self.input, 'wb') as input_file:
+            input_file.write(''.join(line + '\n' for line in lines))
+        sys.argv = [
+            'speechpass-bulk', 'enx', '--input', self.input,
+            '--processes', '1']
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            speechpass.bulk_encrypt()
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_existing_unicode_name_is_kept(self):
+        vault = Vault(Path(self.home).joinpath('speechpass', 'enx.vault'))
+        vault.write({u'caf\xe9': 'stored crypt text'})
+        output = self._bulk(['café\tnew secret', 'bank\tsecret'])
+        self.assertIn('skip: café already exists', output)
+        self.assertIn('1 passwords encrypted', output)
+        vault.refresh()
+        self.assertEqual(vault.names(), [u'bank', u'caf\xe9'])
+        self.assertEqual(vault.read(u'caf\xe9'), 'stored crypt text')
+
+    def test_existing_unicode_file_is_kept(self):
+        language_path = Path(self.home).joinpath('speechpass', 'enx')
+        language_path.mkdir(parents=True)
+        language_path.joinpath('café').write_bytes('stored crypt text')
+        output = self._bulk(['café\tnew secret', 'bank\tsecret'])
+        self.assertIn('skip: café already exists', output)
+        self.assertIn('1 passwords encrypted', output)
+        self.assertEqual(
+            language_path.joinpath('café').read_bytes(), 'stored crypt text')
+        self.assertTrue(language_path.joinpath('bank').exists())
+
+if __name__ == '__main__':
+    unittest.main()
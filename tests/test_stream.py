@@ -0,0 +1,67 @@
+"""Tests of the action stream."""
+import threading
+import time
+import unittest
+from dragonfly_grammars import stream
+
+class ActionStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = stream.ActionStream(max_pending=4)
+        self.release = threading.Event()
+        self.done = []
+
+    def tearDown(self):
+        self.release.set()
+        self.stream.stop()
+
+    def _block(self):
+        """Occupy the sender until release is set."""
+        self.stream.submit([lambda: self.release.wait(5.0)])
+
+    def test_submit_does_not_block_when_full(self):
+        self._block()
+        start = time.time()
+        accepted = [self.stream.submit([lambda: None]) for _ in range(6)]
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(accepted, [True] * 3 + [False] * 3)
+        self.assertEqual(self.stream.dropped, 3)
+
+    def test_keys_queued_when_full(self):
+        self._block()
+        for index in range(3):
+            self.stream.submit(
+                [lambda index=index: self.done.append('text{}'.format(index))])
+        self.assertFalse(self.stream.submit([lambda: self.done.append('x')]))
+        for index in range(3):
+            self.assertTrue(self.stream.submit(
+                [lambda index=index: self.done.append('key{}'.format(index))],
+                cancellable=False))
+        self.release.set()
+        self.assertTrue(self.stream.join(5.0))
+        self.assertEqual(
+            self.done,
+            ['text0', 'text1', 'text2', 'key0', 'key1', 'key2'])
+
+    def test_stop_with_full_queue(self):
+        self._block()
+        for _ in range(3):
+            self.stream.submit([lambda: self.done.append('text')])
+        self.release.set()
+        start = time.time()
+        self.stream.stop()
+        self.assertLess(time.time() - start, 1.0)
+        self.assertFalse(self.stream.busy())
+
+    def test_cancel_keeps_keys(self):
+        self._block()
+        self.stream.submit([lambda: self.done.append('text')])
+        self.stream.submit(
+            [lambda: self.done.append('key')], cancellable=False)
+        self.stream.cancel()
+        self.release.set()
+        self.assertTrue(self.stream.join(5.0))
+        self.assertEqual(self.done, ['key'])
+
+if __name__ == '__main__':
+    unittest.main()